@@ -11,7 +11,14 @@ import rich_click as click  # import click
 import rich
 import uvicorn
 
-from synthmap.app.cli_modules import dump, show, parse_video, register
+from synthmap.app.cli_modules import (
+    database,
+    dump,
+    show,
+    parse_video,
+    register,
+    snapshot,
+)
 from synthmap.db import manager as db_man
 from synthmap.log.logger import getLogger
 
@@ -177,9 +184,14 @@ def watchdog(ctx):
 #              images --dirn2session --session-name
 #              projects --type
 #              entities
+#     db version
+#        upgrade --target
+#     snapshot --out-dir --skip-scenes --check
 
 
 cli.add_command(dump.dump)
 cli.add_command(show.show)
 cli.add_command(parse_video.parse_video)
 cli.add_command(register.register)
+cli.add_command(database.database)
+cli.add_command(snapshot.snapshot)
@@ -0,0 +1,58 @@
+"""Defines the CLI commands for maintaining the synthmap DB itself."""
+import sqlite3
+
+import rich_click as click  # import click
+
+from synthmap.db import manager as db_man, migrations
+from synthmap.projectManager import colmapParser
+
+
+@click.group(name="db")
+def database():
+    """Inspects & upgrades the database in --db-path"""
+
+
+@database.command()
+@click.pass_context
+def version(ctx):
+    """Prints the database's schema version & the latest one available."""
+    with db_man.mk_conn(ctx.obj["db_path"]) as db:
+        current = migrations.get_schema_version(db)
+    print(f"Schema version {current} (latest: {migrations.LATEST_VERSION})")
+
+
+@database.command()
+@click.option(
+    "--target",
+    default=migrations.LATEST_VERSION,
+    show_default=True,
+    type=int,
+    help="Schema version to upgrade to.",
+)
+@click.pass_context
+def upgrade(ctx, target):
+    """Applies pending schema migrations (new tables, indexes...) in place."""
+    with db_man.mk_conn(ctx.obj["db_path"]) as db:
+        before = migrations.get_schema_version(db)
+        try:
+            after = migrations.upgrade(db, target=target)
+        except sqlite3.Error as e:
+            current = migrations.get_schema_version(db)
+            raise click.ClickException(f"Upgrade failed at version {current}: {e}")
+    if after == before:
+        print(f"Schema already at version {after}")
+    else:
+        print(f"Schema upgraded from version {before} to {after}")
+
+
+@database.command()
+@click.pass_context
+def reindex(ctx):
+    """Rebuilds the match index & covisibility graph of every Colmap project."""
+    with db_man.mk_conn(ctx.obj["db_path"]) as db:
+        unreachable = colmapParser.reindex_projects(db)
+    if unreachable:
+        raise click.ClickException(
+            f"Projects {unreachable} could not be read, register them again"
+        )
+    print("Match index & covisibility graph rebuilt")
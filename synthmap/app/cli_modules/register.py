@@ -1,19 +1,23 @@
 """Defines the CLI commands for registering data into the synthmap DB."""
-from glob import glob
-import itertools
-import os
 from pathlib import Path
 
+from pydantic import ValidationError
 import rich_click as click  # import click
 
-from synthmap.db import manager as db_man
+from synthmap.db import ingest, manager as db_man
 from synthmap.log.logger import getLogger
 from synthmap.models import colmap as colmodels, alice as alicemodels
-from synthmap.projectManager import colmapParser, aliceParser
+from synthmap.projectManager import colmapParser, aliceParser, scanner
 
 
 log = getLogger(__name__)
 
+# Project file kinds (see scanner.PROJECT_FILES) and how to read them
+PROJECT_READERS = {
+    "colmap": (colmapParser.get_proj_dirs, colmodels.ColmapProject),
+    "alice": (aliceParser.parse_sfm_header, alicemodels.AliceProject),
+}
+
 
 @click.group()
 @click.option(
@@ -42,52 +46,82 @@ def register(ctx, root_folder, exclude_folders):
     ctx.obj["exclude_folders"] = exclude_folders
 
 
+def scan_items(ctx, kinds):
+    """Yields (kind, path) for every Item of <kinds> under the root folder
+    (see `cli register --root-folder`), never entering --exclude-folders."""
+    return scanner.scan(
+        ctx.obj["register_root"],
+        exclude_folders=ctx.obj["exclude_folders"],
+        kinds=kinds,
+    )
+
+
+def read_project(kind, path):
+    """Applies the extractor function matching this kind of project file.
+    Returns the project's model, None if the file doesn't describe a usable project."""
+    extractor_fn, model = PROJECT_READERS[kind]
+    data = extractor_fn(path)
+    if not data:
+        return None
+    if data and not "label" in data:
+        data["label"] = data.get("project_file") or data.get("file_path")
+    log.debug(f"Found project data {data}")
+    try:
+        return model(**data)
+    except ValidationError as e:
+        log.error(f"Invalid project {path}: {e}")
+        return None
+
+
+def register_project(db, project):
+    """Inserts a Project, its Images and its Scenes."""
+    project = {k: str(v) for k, v in dict(project).items()}
+    project["project_file"] = project["label"]
+    project_id = db_man.insert_project(db, project)
+    if project["project_type"] == "colmap":
+        colmapParser.register_project_images(db, project_id)
+    for model_data in colmapParser.get_model_files(
+        Path(project["project_file"]).parent.absolute()
+    ):
+        db_man.insert_scene(db, project_id, model_data)
+    return project_id
+
+
+def report(registered, hashed, elapsed):
+    """Progress report for ingest.register_images()"""
+    rate = registered / elapsed if elapsed else 0.0
+    print(f"{registered} images registered, {hashed} hashed ({rate:.1f} img/s)")
+
+
 @register.command()
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="Number of processes hashing images. Defaults to one per CPU.",
+)
+@click.option(
+    "--batch-size",
+    default=ingest.BATCH_SIZE,
+    show_default=True,
+    type=int,
+    help="Number of images written (and committed) to the database at once.",
+)
 @click.pass_context
-def images(ctx):
+def images(ctx, workers, batch_size):
     """Seeks all .JPG files under --root-folder"""
     log.info(f"Seeking Images under {ctx.obj['register_root']}")
-    q_strings = [
-        os.path.join(ctx.obj["register_root"], "**", "*") + f".{ext}"
-        for ext in ["JPG", "jpg"]
-    ]
-    paths = list(
-        itertools.chain.from_iterable(
-            [glob(q_string, recursive=True) for q_string in q_strings]
+    paths = (path for _, path in scan_items(ctx, ["image"]))
+    with db_man.mk_conn(ctx.obj["db_path"]) as db:
+        file_ids = ingest.register_images(
+            db,
+            paths,
+            workers=workers,
+            batch_size=batch_size,
+            progress=report,
+            commit=True,
         )
-    )
-    count = 0
-    for path in paths:
-        for exclude in ctx.obj["exclude_folders"]:
-            if exclude in path:
-                continue
-        with db_man.mk_conn(ctx.obj["db_path"]) as db:
-            db_man.insert_image(db, path)
-            count += 1
-    log.info(f"Found {count} images under {ctx.obj['register_root']}")
-
-
-def seek_projects(ctx, filename, extractor_fn, model):
-    """Applies the specified extractor function to all files matching the given filename
-    under the root folder (see `cli register --root-folder`)."""
-    q_string = os.path.join(ctx.obj["register_root"], f"**\\{filename}")
-    q_string2 = os.path.join(ctx.obj["register_root"], f"**/{filename}")
-    for path in glob(q_string2, recursive=True):
-        excluded = False
-        for exclude in ctx.obj["exclude_folders"]:
-            if exclude in path:
-                excluded = True
-                break
-        if excluded:
-            continue
-        data = extractor_fn(path)
-        if not data:
-            continue
-        if data and not "label" in data:
-            data["label"] = data.get("project_file") or data.get("file_path")
-        log.debug(f"Found project data {data}")
-        m = model(**data)
-        yield m
+    log.info(f"Found {len(file_ids)} images under {ctx.obj['register_root']}")
 
 
 @register.command()
@@ -103,28 +137,66 @@ def projects(ctx, project_type):
     """Seeks project files for different backends under --root-folder.
     Colmap: project.ini
     AliceVision: sfm.json"""
-    candidates = []
-    if project_type in ["all", "colmap"]:
-        log.debug(f"Seeking Colmap Projects under {ctx.obj['register_root']}")
-        candidates += seek_projects(
-            ctx, "project.ini", colmapParser.get_proj_dirs, colmodels.ColmapProject
-        )
-    if project_type in ["all", "alice"]:
-        log.debug(f"Seeking AliceVision Projects under {ctx.obj['register_root']}")
-        candidates += seek_projects(
-            ctx, "sfm.json", aliceParser.parse_sfm, alicemodels.AliceProject
-        )
-    log.debug(f"Found {len(candidates)} projects under {ctx.obj['register_root']}")
+    if project_type == "all":
+        kinds = list(PROJECT_READERS.keys())
+    else:
+        kinds = [project_type]
+    log.debug(f"Seeking {kinds} Projects under {ctx.obj['register_root']}")
+    count = 0
     with db_man.mk_conn(ctx.obj["db_path"]) as db:
-        for project in candidates:
-            project = {k: str(v) for k, v in dict(project).items()}
-            project["project_file"] = project["label"]
-            project_id = db_man.insert_project(db, project)
-            colmapParser.register_project_images(db, project_id)
-            for model_data in colmapParser.get_model_files(
-                Path(project["project_file"]).parent.absolute()
-            ):
-                db_man.insert_scene(db, project_id, model_data)
+        for kind, path in scan_items(ctx, kinds):
+            project = read_project(kind, path)
+            if not project:
+                continue
+            register_project(db, project)
+            db.commit()
+            count += 1
+    log.debug(f"Found {count} projects under {ctx.obj['register_root']}")
+
+
+@register.command(name="all")
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="Number of processes hashing images. Defaults to one per CPU.",
+)
+@click.option(
+    "--batch-size",
+    default=ingest.BATCH_SIZE,
+    show_default=True,
+    type=int,
+    help="Number of images written (and committed) to the database at once.",
+)
+@click.pass_context
+def register_all(ctx, workers, batch_size):
+    """Seeks Images and project files for all backends under --root-folder in a
+    single pass. Projects are registered once all Images have been."""
+    project_paths = []
+
+    def image_paths():
+        for kind, path in scan_items(ctx, scanner.ALL_KINDS):
+            if kind == "image":
+                yield path
+            else:
+                project_paths.append((kind, path))
+
+    with db_man.mk_conn(ctx.obj["db_path"]) as db:
+        ingest.register_images(
+            db,
+            image_paths(),
+            workers=workers,
+            batch_size=batch_size,
+            progress=report,
+            commit=True,
+        )
+        for kind, path in project_paths:
+            project = read_project(kind, path)
+            if not project:
+                continue
+            register_project(db, project)
+            db.commit()
+    log.info(f"Found {len(project_paths)} projects under {ctx.obj['register_root']}")
 
 
 @register.command()
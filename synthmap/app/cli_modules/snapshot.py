@@ -0,0 +1,50 @@
+"""Defines the CLI command writing binary snapshots of the synthmap DB."""
+import rich_click as click  # import click
+
+from synthmap.db import snapshot as db_snapshot
+
+
+@click.command()
+@click.option(
+    "--out-dir",
+    default=None,
+    help="Folder to write the snapshot to, defaults to <db-path>.snapshot",
+)
+@click.option(
+    "--skip-scenes",
+    is_flag=True,
+    default=False,
+    help="Only snapshot the database tables, don't parse the Colmap scenes.",
+)
+@click.option(
+    "--check",
+    is_flag=True,
+    default=False,
+    help="Only report whether the existing snapshot is still fresh.",
+)
+@click.pass_context
+def snapshot(ctx, out_dir, skip_scenes, check):
+    """Writes a memory mappable snapshot of the database (tables & scene arrays),
+    for notebooks & the server (SYNTHMAP_SNAPSHOT_PATH) to attach to."""
+    out_dir = out_dir or f"{ctx.obj['db_path']}.snapshot"
+    if check:
+        try:
+            changes = db_snapshot.Snapshot(out_dir).changes()
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        if changes:
+            print(f"Snapshot {out_dir} is stale, changed: {', '.join(changes)}")
+            ctx.exit(1)
+        print(f"Snapshot {out_dir} is fresh")
+        return
+    try:
+        snap = db_snapshot.write_snapshot(
+            ctx.obj["db_path"], out_dir, scenes=not skip_scenes
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    rows = sum(i["rows"] for i in snap.manifest["tables"].values())
+    print(
+        f"Snapshot written to {out_dir}: {rows} rows from {len(snap.tables)} tables, "
+        f"{len(snap.scene_ids)} scenes"
+    )
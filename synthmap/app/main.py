@@ -1,4 +1,5 @@
 """Sets up the FastAPI app"""
+
 import os
 
 from fastapi import FastAPI
@@ -8,9 +9,10 @@ from fastapi import FastAPI
 
 from synthmap.app.routers.api import apirouter
 from synthmap.app.routers.html import htmlrouter
+from synthmap.db.pool import ConnectionPool
+from synthmap.db.snapshot import load_snapshot
 from synthmap.log.logger import getLogger
 
-
 log = getLogger(__name__)
 
 app = FastAPI()
@@ -20,6 +22,22 @@ except AttributeError:
     app.state.db_path = os.environ.get("SYNTHMAP_DB_PATH") or os.path.expanduser(
         "~/.synthmap/main.db"
     )
+# Connections are opened on demand by the routes' dependencies, see routers.utils
+app.state.db_pool = ConnectionPool(app.state.db_path)
+# Optional read-only arrays of the whole database, see db.snapshot: read paths use
+# it while it is fresh (see routers.utils.db_snapshot), SQLite otherwise
+app.state.snapshot = None
+if os.environ.get("SYNTHMAP_SNAPSHOT_PATH"):
+    try:
+        app.state.snapshot = load_snapshot(os.environ["SYNTHMAP_SNAPSHOT_PATH"])
+    except ValueError as e:
+        log.warning(f"Not attaching snapshot: {e}")
+
+
+@app.on_event("shutdown")
+def close_db_pool():
+    app.state.db_pool.close()
+
 
 # Serves the myriad files from a non-minified cljs compile
 # app.mount("/js", StaticFiles(directory="frontmap\\public\\js\\"), name="js")
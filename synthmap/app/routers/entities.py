@@ -4,7 +4,7 @@ from typing import List, Optional
 from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 
-from synthmap.app.routers.utils import db_conn
+from synthmap.app.routers.utils import db_pool, db_reader
 import synthmap.db.manager as db_man
 from synthmap.models import synthmap as synthmodels
 
@@ -25,19 +25,16 @@ class CreateEntity(BaseModel):
 
 
 @entityrouter.get("/")
-def get_entities(db_path=Depends(db_conn)) -> List[synthmodels.Entity]:
+def get_entities(db=Depends(db_reader)) -> List[synthmodels.Entity]:
     """Returns the list of all registered Entities."""
-    with db_man.mk_conn(db_path, read_only=True) as db:
-        return db_man.list_entities(db)
+    return db_man.list_entities(db)
 
 
 @entityrouter.post("/")
-def create_entity(entitydata: CreateEntity, db_path=Depends(db_conn)):
+def create_entity(entitydata: CreateEntity, pool=Depends(db_pool)):
     """Inserts a new Entity"""
-    with db_man.mk_conn(db_path) as db:
-        ret = db_man.insert_entity(db, dict(entitydata))
-        db.commit()
-    return ret
+    with pool.writer() as db:
+        return db_man.insert_entity(db, dict(entitydata))
 
 
 @entityrouter.get("/{entity_id}")
@@ -47,10 +44,9 @@ def get_entityinfo(entity_id: int):
 
 
 @entityrouter.get("/{entity_id}/images")
-def get_entityimages(entity_id: int, db_path=Depends(db_conn)):
+def get_entityimages(entity_id: int, db=Depends(db_reader)):
     """Returns the Images registered to this Entity"""
-    with db_man.mk_conn(db_path, read_only=True) as db:
-        return db_man.get_entity_images(db, entity_id)
+    return db_man.get_entity_images(db, entity_id)
 
 
 @entityrouter.put("/{entity_id}")
@@ -67,8 +63,8 @@ def delete_entity(entity_id: int):
 
 @entityrouter.get("/{entity_id}/reg_image", tags=["Images"])
 def register_entity_image_get(
-    entity_id: int, image_id: int = None, db_path=Depends(db_conn)
+    entity_id: int, image_id: int = None, pool=Depends(db_pool)
 ):
     """Register an (existing) Image to this Entity."""
-    with db_man.mk_conn(db_path, read_only=True) as db:
+    with pool.writer() as db:
         return db_man.register_image_entity(db, image_id, entity_id)
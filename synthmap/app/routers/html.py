@@ -1,9 +1,9 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from fastapi.responses import HTMLResponse
 from jinja2 import Environment, FileSystemLoader
 
-from synthmap.db import manager as db_man
-from synthmap.projectManager import colmapParser
+from synthmap.app.routers.utils import db_reader
+from synthmap.db import covisibility, manager as db_man
 
 env = Environment(
     loader=FileSystemLoader("templates"),
@@ -18,11 +18,10 @@ htmlrouter = APIRouter(
 
 
 @htmlrouter.get("/", response_class=HTMLResponse)
-def main_view():
+def main_view(db=Depends(db_reader)):
     # TODO: Table for entities
     # TODO: Show N random images?
     tmpl = env.get_template("main.html")
-    db = db_man.mk_conn(read_only=True)
     projects = db_man.list_projects(db)
     entities = db.execute("SELECT * FROM Entities")
     print("inview", projects)
@@ -30,48 +29,36 @@ def main_view():
 
 
 @htmlrouter.get("/image/{image_id}", response_class=HTMLResponse)
-def view_single_image(image_id: int):
+def view_single_image(image_id: int, db=Depends(db_reader)):
     template = env.get_template("image_view.html")
-    with db_man.mk_conn(read_only=True) as db:
-        # FIXME: argument image_id != image_file id
-        image = db.execute(
-            """SELECT image_id, md5 FROM imageFiles WHERE image_id=?""", [image_id]
-        ).fetchone()
-        projects = db_man.get_image_projects(db, image_id)
-        entities = db_man.get_image_entities(db, image_id)
-        related_images = set()
-        for project in projects:
-            related_images = related_images.union(
-                list(
-                    colmapParser.list_project_matches_old(
-                        db, project["project_id"], image_id
-                    )
-                )
-            )
-            print(f"len rel img {related_images}")
-        related_images = sorted(related_images)
-        related_entities = {entity["entity_id"]: None for entity in entities}
-        for i in related_images:
-            for entity in db_man.get_image_entities(db, i):
-                if entity["entity_id"] not in related_entities:
-                    related_entities[entity["entity_id"]] = entity
-        return template.render(
-            image=image,
-            projects=projects,
-            entities=entities,
-            related_images=related_images,
-            related_entities=[i for i in related_entities.values() if i],
-        )
+    # FIXME: argument image_id != image_file id
+    image = db.execute(
+        """SELECT image_id, md5 FROM imageFiles WHERE image_id=?""", [image_id]
+    ).fetchone()
+    projects = db_man.get_image_projects(db, image_id)
+    entities = db_man.get_image_entities(db, image_id)
+    related_images = sorted(covisibility.get_neighbours(db, image_id))
+    related_entities = {entity["entity_id"]: None for entity in entities}
+    for i in related_images:
+        for entity in db_man.get_image_entities(db, i):
+            if entity["entity_id"] not in related_entities:
+                related_entities[entity["entity_id"]] = entity
+    return template.render(
+        image=image,
+        projects=projects,
+        entities=entities,
+        related_images=related_images,
+        related_entities=[i for i in related_entities.values() if i],
+    )
 
 
 @htmlrouter.get("/projects", response_class=HTMLResponse)
-def view_projects():
+def view_projects(db=Depends(db_reader)):
     def count_images(x):
         return db.execute(
             "select count(*) from projectImages where project_id=?", [x]
         ).fetchone()[0]
 
-    db = db_man.mk_conn(read_only=True)
     project_ids = [
         i[0]
         for i in db.execute("SELECT distinct(project_id) from projectImages").fetchall()
@@ -81,22 +68,20 @@ def view_projects():
 
 
 @htmlrouter.get("/projects/{project_id}", response_class=HTMLResponse)
-def view_project(project_id: int):
+def view_project(project_id: int, db=Depends(db_reader)):
     template = env.get_template("project_view.html")
-    with db_man.mk_conn(read_only=True) as db:
-        project = db.execute(
-            "SELECT * FROM Projects WHERE project_id=?", [project_id]
-        ).fetchone()
-        images = db_man.get_project_images(db, project_id)
-        return template.render(project=project, images=images)
+    project = db.execute(
+        "SELECT * FROM Projects WHERE project_id=?", [project_id]
+    ).fetchone()
+    images = db_man.get_project_images(db, project_id)
+    return template.render(project=project, images=images)
 
 
 @htmlrouter.get("/entities/{entity_id}", response_class=HTMLResponse)
-def view_entity(entity_id: int):
+def view_entity(entity_id: int, db=Depends(db_reader)):
     # TODO: Unlink image
     # TODO: Show related entities
     # TODO: Show candidate Images
-    db = db_man.mk_conn(read_only=True)
     entity = db.execute(
         "SELECT * FROM Entities WHERE entity_id=?", [entity_id]
     ).fetchone()
@@ -106,8 +91,8 @@ def view_entity(entity_id: int):
 
 
 @htmlrouter.post("/entities/{entity_id}", response_class=HTMLResponse)
-def redir_to_view(entity_id: int):
-    return view_entity(entity_id)
+def redir_to_view(entity_id: int, db=Depends(db_reader)):
+    return view_entity(entity_id, db)
 
 
 # TODO: view_project_images
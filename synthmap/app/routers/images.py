@@ -6,7 +6,7 @@ from fastapi.responses import FileResponse, RedirectResponse
 from pydantic import BaseModel
 
 from synthmap.app.routers.entities import CreateEntity
-from synthmap.app.routers.utils import db_conn
+from synthmap.app.routers.utils import db_pool, db_reader
 import synthmap.db.manager as db_man
 from synthmap.models.synthmap import Image
 from synthmap.projectManager import colmapParser
@@ -26,10 +26,9 @@ class ImageCount(BaseModel):
 
 
 @imagerouter.get("/count", response_model=ImageCount)
-def count_images(db_path=Depends(db_conn)) -> ImageCount:
+def count_images(db=Depends(db_reader)) -> ImageCount:
     """Returns the number of registered Images"""
-    with db_man.mk_conn(db_path, read_only=True) as db:
-        return db_man.count_images(db)
+    return db_man.count_images(db)
 
 
 @imagerouter.post("/")
@@ -40,14 +39,13 @@ def create_image(
 
 
 @imagerouter.get("/{image_id}")
-def get_imageinfo(imagefile_id: int, db_path=Depends(db_conn)):
+def get_imageinfo(imagefile_id: int, db=Depends(db_reader)):
     """Returns this Image's data, its Project's Data, and its Keypoints."""
-    with db_man.mk_conn(db_path, read_only=True) as db:
-        image_md5 = db.execute(
-            """SELECT md5 FROM imageFiles WHERE file_id=?""", [imagefile_id]
-        ).fetchone()["md5"]
-        image_project_data = db_man.get_image_projectdata(db, imagefile_id)
-        image_keypoints = colmapParser.list_image_keypoints(db, imagefile_id)
+    image_md5 = db.execute(
+        """SELECT md5 FROM imageFiles WHERE file_id=?""", [imagefile_id]
+    ).fetchone()["md5"]
+    image_project_data = db_man.get_image_projectdata(db, imagefile_id)
+    image_keypoints = colmapParser.list_image_keypoints(db, imagefile_id)
     return {
         "image_id": imagefile_id,
         "md5": image_md5,
@@ -64,22 +62,18 @@ def del_image(image_id: int):
 
 
 @imagerouter.get("/{image_id}/entities", tags=["Entities"])
-def get_image_entities(image_id: int, db_path=Depends(db_conn)):
+def get_image_entities(image_id: int, db=Depends(db_reader)):
     """returns this Image's registered Entities"""
-    with db_man.mk_conn(db_path, read_only=True) as db:
-        cnt = db_man.get_image_entities(db, image_id)
-    return cnt
+    return db_man.get_image_entities(db, image_id)
 
 
 @imagerouter.get("/{image_id}/reg_entity", tags=["Entities"])
 def register_image_entity_get(
-    image_id: int, entity_id: int = None, db_path=Depends(db_conn)
+    image_id: int, entity_id: int = None, pool=Depends(db_pool)
 ):
     """Register an (existing) Entity to this Image."""
-    with db_man.mk_conn(db_path) as db:
+    with pool.writer() as db:
         db_man.register_image_entity(db, image_id, entity_id)
-        db_man.get_image_entities(db, image_id)
-        db.commit()
     return RedirectResponse(f"/view/entities/{entity_id}")
 
 
@@ -96,7 +90,7 @@ def register_image_entity_post(
     administrative_area_name: str = Form(None),
     greater_admin_area_name: str = Form(None),
     country: str = Form(None),
-    db_path=Depends(db_conn),
+    pool=Depends(db_pool),
 ):
     """Create a new Entity, then register it to this Image."""
     entity = CreateEntity(
@@ -111,19 +105,16 @@ def register_image_entity_post(
         greater_admin_area_name=greater_admin_area_name,
         country=country,
     )
-    with db_man.mk_conn(db_path) as db:
+    with pool.writer() as db:
         entity_id = db_man.insert_entity(db, dict(entity))
-        db.commit()
-    # FIXME: Currently doesn't return anything
-    ret = db_man.register_image_entity(db, image_id, entity_id)
-    return ret
+        # FIXME: Currently doesn't return anything
+        return db_man.register_image_entity(db, image_id, entity_id)
 
 
 @imagerouter.get("/file/{md5}", response_class=FileResponse)
-def get_imagefile(md5: str, db_path=Depends(db_conn)):
+def get_imagefile(md5: str, db=Depends(db_reader)):
     """Returns an image file. This is the src you want to use in an HTML img."""
-    with db_man.mk_conn(db_path, read_only=True) as db:
-        image = db_man.md5_to_filepath(db, md5)
+    image = db_man.md5_to_filepath(db, md5)
     if not image:
         raise HTTPException(
             status_code=404,
@@ -137,7 +128,7 @@ def get_imagelist_size(
     all_images: bool = False,
     id_lower_bound: Optional[int] = None,
     id_upper_bound: Optional[int] = None,
-    db_path=Depends(db_conn),
+    db=Depends(db_reader),
 ) -> int:
     """Get the total size of a list of images.
 
@@ -147,20 +138,19 @@ def get_imagelist_size(
     - specify a range of ids with the lower & upper bound query parameter.
 
     Returns the cumulated size in bytes of the queried images."""
-    with db_man.mk_conn(db_path, read_only=True) as db:
-        if image_ids:
-            print("recv image_ids")
-            return db_man.get_imagelist_size(db, file_ids=[str(i) for i in image_ids])
-        if all_images:
-            print("recv all_images")
-            return db_man.get_imagelist_size(db, all_images=True)
-        if (
-            isinstance(id_lower_bound, int)
-            and isinstance(id_upper_bound, int)
-            and id_lower_bound < id_upper_bound
-        ):
-            print("recv gt/lt")
-            return db_man.get_imagelist_size(db, gt=id_lower_bound, lt=id_upper_bound)
+    if image_ids:
+        print("recv image_ids")
+        return db_man.get_imagelist_size(db, file_ids=[str(i) for i in image_ids])
+    if all_images:
+        print("recv all_images")
+        return db_man.get_imagelist_size(db, all_images=True)
+    if (
+        isinstance(id_lower_bound, int)
+        and isinstance(id_upper_bound, int)
+        and id_lower_bound < id_upper_bound
+    ):
+        print("recv gt/lt")
+        return db_man.get_imagelist_size(db, gt=id_lower_bound, lt=id_upper_bound)
     raise HTTPException(
         status_code=400,
         detail="Invalid parameters",
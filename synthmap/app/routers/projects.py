@@ -2,8 +2,8 @@
 from typing import List
 from fastapi import APIRouter, Depends
 
-from synthmap.app.routers.utils import db_conn
-from synthmap.db import manager as db_man
+from synthmap.app.routers.utils import db_pool, db_reader, db_snapshot
+from synthmap.db import manager as db_man, snapshot as db_snap
 from synthmap.models import synthmap as synthmodels
 from synthmap.log.logger import getLogger
 
@@ -14,35 +14,32 @@ projectrouter = APIRouter(prefix="/projects", tags=["Projects"])
 
 
 @projectrouter.get("/", response_model=List[synthmodels.CommonProject])
-def list_projects(db_path=Depends(db_conn)):
+def list_projects(db=Depends(db_reader)):
     """Returns all registered Projects."""
-    with db_man.mk_conn(db_path, read_only=True) as db:
-        return list(db_man.list_projects(db))
+    return list(db_man.list_projects(db))
 
 
 @projectrouter.post("/")
-def create_project(projectdata: db_man.CreateProject, db_path=Depends(db_conn)):
+def create_project(projectdata: db_man.CreateProject, pool=Depends(db_pool)):
     """Insert a new Project"""
-    with db_man.mk_conn(db_path) as db:
+    with pool.writer() as db:
         db_man.insert_project(db, dict(projectdata))
 
 
 @projectrouter.get("/{project_id}")  # , response_model=db_man.InfoProject)
-def get_projectinfo(project_id: int, db_path=Depends(db_conn)):
+def get_projectinfo(project_id: int, db=Depends(db_reader)):
     """Returns this Project's data"""
-    log.error(f"db_path {db_path}")
-    print(f"db_path {db_path}")
-    with db_man.mk_conn(db_path, read_only=True) as db:
-        project_info = db_man.get_project_info(db, project_id)
-    return project_info
+    return db_man.get_project_info(db, project_id)
 
 
 @projectrouter.get("/{project_id}/images", response_model=List[synthmodels.ImageFile])
-def list_project_images(project_id: int, db_path=Depends(db_conn)):
+def list_project_images(
+    project_id: int, snapshot=Depends(db_snapshot), db=Depends(db_reader)
+):
     """Returns a list of this Project's ImageFiles"""
-    with db_man.mk_conn(db_path, read_only=True) as db:
-        project_images = db_man.get_project_images(db, project_id)
-    return project_images
+    if snapshot is not None:
+        return db_snap.get_project_images(snapshot, project_id)
+    return db_man.get_project_images(db, project_id)
 
 
 # @projectrouter.get("/{project_id}/entities", response_model=List[synthmodels.Entity])
@@ -58,9 +55,8 @@ def update_project(project_id: int, project_data: db_man.CreateProject):
 
 
 @projectrouter.delete("/{project_id}")
-def del_project(project_id: int, db_path=Depends(db_conn)):
+def del_project(project_id: int, pool=Depends(db_pool)):
     """Removes a Project, its backend data and all it's relations to Images, Entities, etc.
     Does not delete Images, Entities, etc."""
-    with db_man.mk_conn(db_path) as db:
+    with pool.writer() as db:
         db_man.delete_project(db, project_id)
-        db.commit()
@@ -5,8 +5,7 @@ from pydantic import BaseModel, constr
 
 import synthmap.app.auth.httpbasic as auth
 from synthmap.app.auth.httpbasic import get_current_username
-from synthmap.app.routers.utils import db_conn
-from synthmap.db import manager as db_man
+from synthmap.app.routers.utils import db_pool, db_reader
 
 userrouter = APIRouter(prefix="/user", tags=["Users"])
 
@@ -23,22 +22,20 @@ class CreateUser(BaseModel):
 
 @userrouter.get("/", response_model=DBUser)
 def get_users(
-    username: str = Depends(get_current_username), db_path=Depends(db_conn)
+    username: str = Depends(get_current_username), db=Depends(db_reader)
 ) -> List[DBUser]:
-    with db_man.mk_conn(db_path, read_only=True) as db:
-        stmt = """SELECT id, name FROM Users"""
-        return db.execute(stmt).fetchall()
+    stmt = """SELECT id, name FROM Users"""
+    return db.execute(stmt).fetchall()
 
 
 @userrouter.post("/")
 def create_user(
     userdata: CreateUser,
-    db_path=Depends(db_conn),
+    pool=Depends(db_pool),
 ):  # , username: str = Depends(get_current_username)):
     # TODO: Verify user
-    with db_man.mk_conn(db_path) as db:
+    with pool.writer() as db:
         auth.insert_user(db, userdata)
-        db.commit()
 
 
 @userrouter.get("/{user_id}")
@@ -1,7 +1,29 @@
 """Convenience functions for dealing with requests & endpoints"""
+from typing import Optional
+
 from fastapi import Request
 
+from synthmap.db.pool import ConnectionPool
+from synthmap.db.snapshot import Snapshot
+
+
+def db_pool(request: Request) -> ConnectionPool:
+    """Getter for this app's database connection pool.
+    Routes which write use `with pool.writer() as db:` so changes are committed
+    before their response is sent."""
+    return request.app.state.db_pool
+
+
+def db_reader(request: Request):
+    """Dependency providing a pooled read-only connection to this app's database."""
+    with request.app.state.db_pool.reader() as db:
+        yield db
+
 
-def db_conn(request: Request):
-    """Getter for this app's active database."""
-    return request.app.state.db_path
+def db_snapshot(request: Request) -> Optional[Snapshot]:
+    """Dependency providing this app's snapshot (see db.snapshot) while its tables
+    are fresh, None otherwise: routes then read from the database instead."""
+    snapshot = request.app.state.snapshot
+    if snapshot is None or not snapshot.tables_are_fresh():
+        return None
+    return snapshot
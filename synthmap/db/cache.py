@@ -0,0 +1,158 @@
+"""Cached, read-only handles on external project databases (Colmap's database.db).
+
+Those files are large and only ever read by synthmap, yet each lookup used to open
+(and page in) a new connection. A ProjectDBCache keeps the most recently used ones
+open, as immutable & memory mapped connections, along with their table layouts &
+row counts. A handle is reopened as soon as its file's mtime or size changes."""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Tuple
+
+from synthmap.db import manager as db_man
+from synthmap.log.logger import getLogger
+
+
+log = getLogger(__name__)
+
+# Number of project databases kept open at once.
+MAX_ENTRIES = 16
+# Capped by SQLITE_MAX_MMAP_SIZE, usually 2GB.
+MMAP_SIZE = 2**31
+
+
+class ProjectDB:
+    """An open project database, see ProjectDBCache.
+    execute() is that of the underlying (dict rows) connection."""
+
+    def __init__(self, path: str, fingerprint: Tuple[int, int]):
+        self.path = path
+        self.fingerprint = fingerprint
+        db_uri = Path(path).absolute().as_uri() + "?mode=ro&immutable=1"
+        self.db = sqlite3.connect(db_uri, uri=True, check_same_thread=False)
+        self.db.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        self.db.row_factory = db_man.dict_factory
+        self.lock = threading.RLock()
+        # Number of open() calls using this handle, guarded by the cache's lock
+        self.users = 0
+        # Dropped from the cache, closed once its last user is done with it
+        self.evicted = False
+        self._columns: Dict[str, List[str]] = {}
+        self._counts: Dict[str, int] = {}
+
+    def execute(self, *args, **kwargs) -> sqlite3.Cursor:
+        return self.db.execute(*args, **kwargs)
+
+    def columns(self, table: str) -> List[str]:
+        """Returns this table's column names, an empty list if it doesn't exist."""
+        if table not in self._columns:
+            rows = self.db.execute(f"PRAGMA table_info({table})")
+            self._columns[table] = [i["name"] for i in rows]
+        return self._columns[table]
+
+    def count(self, table: str) -> int:
+        """Returns this table's number of rows.
+        Raises sqlite3.OperationalError if it doesn't exist."""
+        if table not in self._counts:
+            row = self.db.execute(f"SELECT count(*) AS cnt FROM {table}").fetchone()
+            self._counts[table] = row["cnt"]
+        return self._counts[table]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def __repr__(self):
+        return f"ProjectDB({self.path})"
+
+
+class ProjectDBCache:
+    """LRU of up to <max_entries> open ProjectDBs, keyed by path.
+
+        with cache.open(db_path) as proj_db:
+            proj_db.execute(...)
+
+    A handle is used by one thread at a time, others wait for it to be released."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, ProjectDB]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(path: str) -> Tuple[int, int]:
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            raise sqlite3.OperationalError(f"unable to open database file {path}: {e}")
+        return stat.st_mtime_ns, stat.st_size
+
+    def _evict(self, entry: ProjectDB) -> bool:
+        """Marks a handle dropped from the cache, returns whether it can be closed
+        right away. Call with _lock held."""
+        entry.evicted = True
+        return entry.users == 0
+
+    def _acquire(self, path: str) -> ProjectDB:
+        """Returns the cached handle on this database, pinned until _release()."""
+        fingerprint = self._fingerprint(path)
+        stale = []
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.fingerprint != fingerprint:
+                log.debug(f"{entry} changed on disk, reopening")
+                old_entry = self._entries.pop(path)
+                if self._evict(old_entry):
+                    stale.append(old_entry)
+                entry = None
+            if entry is None:
+                log.debug(f"New cached SQLite connection (RO) to {path}")
+                entry = self._entries[path] = ProjectDB(path, fingerprint)
+            entry.users += 1
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                old_entry = self._entries.popitem(last=False)[1]
+                if self._evict(old_entry):
+                    stale.append(old_entry)
+        for old_entry in stale:
+            old_entry.close()
+        return entry
+
+    def _release(self, entry: ProjectDB):
+        with self._lock:
+            entry.users -= 1
+            close = entry.evicted and entry.users == 0
+        if close:
+            entry.close()
+
+    @contextmanager
+    def open(self, db_path) -> Iterator[ProjectDB]:
+        """Yields the cached handle on this database, opening it if needed.
+        A handle dropped from the cache meanwhile stays open until released.
+        Handles are keyed by absolute path: relative paths reaching the same file
+        share its handle, and keep naming it once the working directory changes."""
+        entry = self._acquire(str(Path(db_path).absolute()))
+        try:
+            with entry.lock:
+                yield entry
+        finally:
+            self._release(entry)
+
+    def clear(self):
+        """Closes every cached handle, those in use once released."""
+        with self._lock:
+            entries = [i for i in self._entries.values() if self._evict(i)]
+            self._entries.clear()
+        for entry in entries:
+            entry.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared by the project parsers
+project_dbs = ProjectDBCache()
@@ -0,0 +1,142 @@
+"""Image covisibility graph, across all registered Projects.
+
+imageCovisibility holds an edge between two imageFiles whenever a Project matched
+them, weighted by their number of matches & geometrically verified inliers summed
+over all such Projects. Edges are stored in both directions so an image's
+neighbours are a primary key range scan.
+The table is derived from projectMatches & projectImages; refresh() rebuilds the
+edges of the given files only, so registering a Project costs as much as its
+images."""
+
+import json
+import sqlite3
+from typing import Dict, Iterable, List
+
+from synthmap.log.logger import getLogger
+
+
+log = getLogger(__name__)
+
+WEIGHTS = ("matches", "inliers")
+
+
+def _weight_column(weight: str) -> str:
+    if weight not in WEIGHTS:
+        raise ValueError(f"Unknown covisibility weight {weight}, expected {WEIGHTS}")
+    return weight
+
+
+###
+#
+# Maintenance
+#
+###
+
+
+def refresh(db: sqlite3.Connection, file_ids: Iterable[int]) -> int:
+    """Recomputes every edge starting from <file_ids>, from the current contents of
+    projectMatches. Returns the number of edges written."""
+    file_ids = json.dumps(sorted(set(file_ids)))
+    db.execute(
+        """DELETE FROM imageCovisibility
+        WHERE file_id IN (SELECT value FROM json_each(?))""",
+        [file_ids],
+    )
+    cursor = db.execute(
+        """INSERT INTO imageCovisibility
+        (file_id, match_file_id, matches, inliers, projects)
+        SELECT image.file_id, match.file_id,
+            sum(projectMatches.rows), sum(projectMatches.inliers), count(*)
+        FROM projectImages AS image
+        INNER JOIN projectMatches
+        ON projectMatches.project_id = image.project_id
+        AND projectMatches.project_image_id = image.project_image_id
+        INNER JOIN projectImages AS match
+        ON match.project_id = projectMatches.project_id
+        AND match.project_image_id = projectMatches.match_image_id
+        WHERE image.file_id IN (SELECT value FROM json_each(?))
+        AND image.file_id != match.file_id
+        GROUP BY image.file_id, match.file_id""",
+        [file_ids],
+    )
+    return cursor.rowcount
+
+
+def refresh_project(db: sqlite3.Connection, project_id: int) -> int:
+    """Recomputes the edges of every image in this Project."""
+    file_ids = [
+        i["file_id"]
+        for i in db.execute(
+            "SELECT file_id FROM projectImages WHERE project_id=?", [project_id]
+        )
+    ]
+    count = refresh(db, file_ids)
+    log.info(f"Covisibility: {count} edges from Project #{project_id}")
+    return count
+
+
+###
+#
+# Queries
+#
+###
+
+
+def get_neighbours(
+    db: sqlite3.Connection, file_id: int, min_weight: int = 0, weight: str = "matches"
+) -> Dict[int, int]:
+    """Returns {file_id: weight} for every image covisible with this one at least
+    <min_weight> times."""
+    column = _weight_column(weight)
+    return {
+        i["match_file_id"]: i[column]
+        for i in db.execute(
+            f"""SELECT match_file_id, {column} FROM imageCovisibility
+            WHERE file_id=? AND {column} >= ?""",
+            [file_id, min_weight],
+        )
+    }
+
+
+def get_top_k(
+    db: sqlite3.Connection, file_id: int, k: int = 10, weight: str = "inliers"
+) -> List[dict]:
+    """Returns the <k> images most strongly covisible with this one, strongest
+    first, as {match_file_id, matches, inliers, projects}."""
+    column = _weight_column(weight)
+    return db.execute(
+        f"""SELECT match_file_id, matches, inliers, projects FROM imageCovisibility
+        WHERE file_id=?
+        ORDER BY {column} DESC, match_file_id
+        LIMIT ?""",
+        [file_id, k],
+    ).fetchall()
+
+
+def expand(
+    db: sqlite3.Connection,
+    file_ids: Iterable[int],
+    hops: int = 1,
+    min_weight: int = 0,
+    weight: str = "matches",
+) -> Dict[int, int]:
+    """Breadth first expansion of <file_ids> over edges weighing at least
+    <min_weight>, one query per hop.
+    Returns {file_id: hops away}, including the starting images at distance 0."""
+    column = _weight_column(weight)
+    distances = {i: 0 for i in file_ids}
+    frontier = list(distances)
+    for hop in range(1, hops + 1):
+        if not frontier:
+            break
+        rows = db.execute(
+            f"""SELECT DISTINCT match_file_id FROM imageCovisibility
+            WHERE file_id IN (SELECT value FROM json_each(?)) AND {column} >= ?""",
+            [json.dumps(frontier), min_weight],
+        )
+        frontier = []
+        for row in rows:
+            if row["match_file_id"] not in distances:
+                distances[row["match_file_id"]] = hop
+                frontier.append(row["match_file_id"])
+    return distances
@@ -0,0 +1,160 @@
+"""Bulk registration of image files into a Synthmap database.
+
+Hashing & measuring files is farmed out to a pool of worker processes while a single
+writer (the caller's connection) inserts their results in large batches."""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import itertools
+import os
+from pathlib import Path
+import sqlite3
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from synthmap.db import manager as db_man
+from synthmap.imageProcessing import imgproc
+from synthmap.log.logger import getLogger
+
+
+log = getLogger(__name__)
+
+# Number of paths sent to a worker at once, keeps IPC overhead low for small files.
+CHUNK_SIZE = 64
+# Number of imageFiles inserted per batch (savepoint, or transaction when committed).
+BATCH_SIZE = 2000
+
+
+###
+#
+# Workers
+#
+###
+
+
+def hash_image(file_path: Path) -> Optional[dict]:
+    """Returns the data insert_images() needs about this file, None if it is unreadable.
+    The file is fingerprinted before being read so later changes are noticed."""
+    try:
+        file_stat = db_man.stat_file(file_path)
+        w, h = imgproc.get_size(file_path)
+        return {**file_stat, "md5": db_man.get_md5(file_path), "w": w, "h": h}
+    except (OSError, AttributeError) as e:
+        # cv2 returns None for undecodable files, hence the AttributeError
+        log.error(f"Could not read image {file_path}: {e}")
+        return None
+
+
+def hash_images(file_paths: List[Path]) -> List[dict]:
+    """Runs hash_image() over a chunk of paths, dropping unreadable files."""
+    return [i for i in map(hash_image, file_paths) if i]
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Yields lists of up to <size> items from <items> as they are produced."""
+    items = iter(items)
+    while chunk := list(itertools.islice(items, size)):
+        yield chunk
+
+
+def imap_chunks(fn: Callable, chunks: Iterable[list], workers: int = None):
+    """Yields the results of fn(chunk) for each chunk, in completion order.
+    Only a bounded number of chunks are in flight, so <chunks> can be a lazy stream.
+    Runs in-process when <workers> is 1 (or 0)."""
+    if workers is not None and workers <= 1:
+        yield from map(fn, chunks)
+        return
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for chunk in chunks:
+            pending.add(pool.submit(fn, chunk))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+###
+#
+# Pipeline
+#
+###
+
+
+def skip_unchanged(
+    db: sqlite3.Connection,
+    file_paths: Iterable[Path],
+    file_ids: Dict[str, int],
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[str]:
+    """Yields the paths of files that are new or changed since they were last hashed.
+    Unchanged files are only stat()-ed, their file_id is stored in <file_ids>."""
+    for chunk in chunked(file_paths, batch_size):
+        file_stats = []
+        for file_path in chunk:
+            try:
+                file_stats.append(db_man.stat_file(file_path))
+            except OSError as e:
+                log.error(f"Could not stat {file_path}: {e}")
+        unchanged = db_man.get_unchanged_files(db, file_stats)
+        file_ids.update(unchanged)
+        for file_stat in file_stats:
+            if file_stat["file_path"] not in unchanged:
+                yield file_stat["file_path"]
+
+
+def log_progress(registered: int, hashed: int, elapsed: float):
+    """Default progress report for register_images()."""
+    rate = registered / elapsed if elapsed else 0.0
+    log.info(f"{registered} images registered, {hashed} hashed ({rate:.1f} img/s)")
+
+
+def register_images(
+    db: sqlite3.Connection,
+    file_paths: Iterable[Path],
+    workers: int = None,
+    batch_size: int = BATCH_SIZE,
+    progress: Callable[[int, int, float], None] = log_progress,
+    commit: bool = False,
+) -> Dict[str, int]:
+    """Registers every image in <file_paths>, hashing them over <workers> processes
+    (default: one per CPU). Files unchanged since they were last hashed are skipped.
+    Results are written every <batch_size> files, each batch in its own savepoint of
+    the caller's transaction (left for the caller to commit), calling
+    progress(registered, hashed, elapsed_seconds) after each batch.
+    With <commit>, each batch is committed instead: a long ingest that is
+    interrupted then resumes from its last batch.
+    Returns {file_path: file_id} for every readable file."""
+    start = time.perf_counter()
+    file_ids = {}
+    changed = skip_unchanged(db, file_paths, file_ids, batch_size)
+    records = itertools.chain.from_iterable(
+        imap_chunks(hash_images, chunked(changed, CHUNK_SIZE), workers)
+    )
+    hashed = 0
+    for batch in chunked(records, batch_size):
+        # Releasing the outermost savepoint would commit
+        if not db.in_transaction:
+            db.execute("BEGIN")
+        db.execute("SAVEPOINT register_images")
+        try:
+            file_ids.update(db_man.insert_images(db, batch))
+        except sqlite3.Error:
+            db.execute("ROLLBACK TO register_images")
+            db.execute("RELEASE register_images")
+            raise
+        db.execute("RELEASE register_images")
+        if commit:
+            db.commit()
+        hashed += len(batch)
+        if progress:
+            progress(len(file_ids), hashed, time.perf_counter() - start)
+    elapsed = time.perf_counter() - start
+    if progress:
+        progress(len(file_ids), hashed, elapsed)
+    log.info(f"Registered {len(file_ids)} images ({hashed} hashed) in {elapsed:.1f}s")
+    return file_ids
@@ -2,13 +2,15 @@
 
 from datetime import datetime
 import hashlib
+import json
 import os.path
 from pathlib import Path
 import sqlite3
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel
 
+from synthmap.db import covisibility, migrations
 from synthmap.imageProcessing import imgproc
 from synthmap.log.logger import getLogger
 from synthmap.models import synthmap as synthmodels
@@ -93,6 +95,36 @@ schemas = {
         pwhash TEXT NOT NULL)""",
     "accounts": """CREATE TABLE Accounts(user_id INTEGER PRIMARY KEY,
         name TEXT NOT NULL)""",
+    "fileStates": """CREATE TABLE fileStates(file_path TEXT PRIMARY KEY,
+        size INT NOT NULL,
+        mtime_ns INT NOT NULL,
+        inode INT NOT NULL,
+        md5 TEXT NOT NULL)""",
+    "projectMatches": """CREATE TABLE projectMatches(project_id INT NOT NULL,
+        project_image_id INT NOT NULL,
+        match_image_id INT NOT NULL,
+        pair_id INT NOT NULL,
+        rows INT NOT NULL,
+        inliers INT NOT NULL DEFAULT 0,
+
+        PRIMARY KEY(project_id, project_image_id, match_image_id)) WITHOUT ROWID""",
+    "imageCovisibility": """CREATE TABLE imageCovisibility(file_id INT NOT NULL,
+        match_file_id INT NOT NULL,
+        matches INT NOT NULL,
+        inliers INT NOT NULL,
+        projects INT NOT NULL,
+
+        PRIMARY KEY(file_id, match_file_id)) WITHOUT ROWID""",
+    "projectImageDigests": """CREATE TABLE projectImageDigests(project_id INT NOT NULL,
+        project_image_id INT NOT NULL,
+        keypoints_md5 TEXT NOT NULL,
+        descriptors_md5 TEXT NOT NULL,
+
+        PRIMARY KEY(project_id, project_image_id)) WITHOUT ROWID""",
+    "projectDigestSources": """CREATE TABLE projectDigestSources(
+        project_id INTEGER PRIMARY KEY,
+        mtime_ns INT NOT NULL,
+        size INT NOT NULL)""",
 }
 ###
 #
@@ -125,8 +157,8 @@ def mk_conn(db_path=DB_PATH, read_only=False, as_dicts=True) -> sqlite3.Connecti
 
 
 def setup_db(db: sqlite3.Connection) -> sqlite3.Connection:
-    """Creates the expected tables in the passed database.
-    See <schemas> in this module."""
+    """Creates the expected tables in the passed database, then brings its indexes &
+    schema version up to date. See <schemas> in this module & db.migrations."""
     for table_name, stmt in schemas.items():
         try:
             log.debug(f"Creating table {table_name}")
@@ -134,6 +166,7 @@ def setup_db(db: sqlite3.Connection) -> sqlite3.Connection:
         except sqlite3.OperationalError as e:
             log.error(f"Creation error in {table_name}: {e}")
             continue
+    migrations.upgrade(db)
     return db
 
 
@@ -245,9 +278,25 @@ def delete_project(db: sqlite3.Connection, project_id: int):
     # TODO: Handle backend specific tables
     log.info(f"Deleting project {project_id}")
     stmt_del_pimg = "DELETE FROM projectImages WHERE project_id=?"
+    stmt_del_pmatch = "DELETE FROM projectMatches WHERE project_id=?"
+    stmt_del_pdigest = "DELETE FROM projectImageDigests WHERE project_id=?"
+    stmt_del_psource = "DELETE FROM projectDigestSources WHERE project_id=?"
     stmt_del_proj = "DELETE FROM Projects WHERE project_id=?"
-    for stmt in [stmt_del_pimg, stmt_del_proj]:
+    file_ids = [
+        i["file_id"]
+        for i in db.execute(
+            "SELECT file_id FROM projectImages WHERE project_id=?", [project_id]
+        )
+    ]
+    for stmt in [
+        stmt_del_pimg,
+        stmt_del_pmatch,
+        stmt_del_pdigest,
+        stmt_del_psource,
+        stmt_del_proj,
+    ]:
         db.execute(stmt, [project_id])
+    covisibility.refresh(db, file_ids)
 
 
 ###
@@ -271,6 +320,53 @@ def get_md5(fp: Path):
     return md5.hexdigest()
 
 
+def stat_file(file_path: Path) -> dict:
+    """Returns the fingerprint (size, mtime & inode) used to tell whether a file
+    changed since it was last hashed."""
+    stat = os.stat(file_path)
+    return {
+        "file_path": str(file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "inode": stat.st_ino,
+    }
+
+
+def get_unchanged_files(
+    db: sqlite3.Connection, file_stats: List[dict]
+) -> Dict[str, int]:
+    """Returns {file_path: file_id} for the files in <file_stats> (see stat_file())
+    which are registered and haven't changed since they were last hashed."""
+    stmt = """SELECT fileStates.*, imageFiles.file_id FROM fileStates
+    INNER JOIN imageFiles ON imageFiles.md5 = fileStates.md5
+    WHERE fileStates.file_path IN (SELECT value FROM json_each(?))"""
+    paths = json.dumps([i["file_path"] for i in file_stats])
+    states = {row["file_path"]: row for row in db.execute(stmt, [paths])}
+    unchanged = {}
+    for file_stat in file_stats:
+        state = states.get(file_stat["file_path"])
+        if state and all(
+            state[k] == file_stat[k] for k in ["size", "mtime_ns", "inode"]
+        ):
+            unchanged[file_stat["file_path"]] = state["file_id"]
+    return unchanged
+
+
+def record_file_states(db: sqlite3.Connection, records: List[dict]):
+    """Remembers the fingerprint & md5 of freshly hashed files.
+    Each record holds the output of stat_file() and the file's "md5"."""
+    stmt = """INSERT OR REPLACE INTO fileStates
+    (file_path, size, mtime_ns, inode, md5)
+    VALUES (:file_path, :size, :mtime_ns, :inode, :md5)"""
+    db.executemany(stmt, [{**i, "file_path": str(i["file_path"])} for i in records])
+
+
+# A file registered under another md5 has changed: its imageFile follows, keeping
+# its file_id (and so its projectImages & views)
+UPSERT_FILE = """ON CONFLICT(file_path) DO UPDATE
+    SET md5=excluded.md5, w=excluded.w, h=excluded.h"""
+
+
 def insert_image(
     db: sqlite3.Connection,
     file_path: Path,
@@ -278,13 +374,20 @@ def insert_image(
     orig_uri: str = None,
     orig_ipfs: str = None,
 ) -> int:
-    """Creates a new Image from <file_path> if it is not already registered in this database."""
+    """Creates a new Image from <file_path> if it is not already registered in this database.
+    Files which haven't changed since they were last hashed are not read again, the
+    imageFile of a known path whose content changed is updated in place."""
     log.debug(f"Attempt to insert image {file_path}")
+    file_stat = stat_file(file_path)
+    unchanged = get_unchanged_files(db, [file_stat])
+    if unchanged:
+        return unchanged[file_stat["file_path"]]
     md5 = get_md5(file_path)
+    record_file_states(db, [{**file_stat, "md5": md5}])
     stmt_add_image = """INSERT OR IGNORE INTO Images
     (orig_uri, orig_ipfs) VALUES (?, ?)"""
-    stmt_add_file = """INSERT OR IGNORE INTO imageFiles
-    (file_path, md5, ipfs, w, h) VALUES (?, ?, ?, ?, ?)"""
+    stmt_add_file = f"""INSERT INTO imageFiles
+    (file_path, md5, ipfs, w, h) VALUES (?, ?, ?, ?, ?) {UPSERT_FILE}"""
     file_id = db.execute(
         """SELECT file_id FROM imageFiles WHERE md5=?""", [md5]
     ).fetchone()
@@ -311,6 +414,50 @@ def insert_image(
     return file_id
 
 
+def insert_images(db: sqlite3.Connection, records: List[dict]) -> Dict[str, int]:
+    """Bulk counterpart to insert_image() for already hashed & measured files.
+    Each record holds the file's "file_path", "md5", "w" & "h", and optionally its
+    fingerprint (see stat_file()) which is then recorded in fileStates.
+    The imageFile of a known path whose content changed is updated in place.
+    Returns {file_path: file_id} for every record, known or newly created."""
+    stmt_known = """SELECT md5, file_id FROM imageFiles
+    WHERE md5 IN (SELECT value FROM json_each(?))"""
+    stmt_add_image = """INSERT OR IGNORE INTO Images
+    (orig_uri, orig_ipfs) VALUES (?, NULL)"""
+    stmt_add_file = f"""INSERT INTO imageFiles
+    (file_path, md5, ipfs, w, h) VALUES (:file_path, :md5, NULL, :w, :h)
+    {UPSERT_FILE}"""
+    stmt_add_views = """INSERT OR IGNORE INTO imageViews (image_id, file_id)
+    SELECT Images.id, imageFiles.file_id FROM imageFiles
+    INNER JOIN Images ON Images.orig_uri = 'file://' || imageFiles.file_path
+    WHERE imageFiles.md5 IN (SELECT value FROM json_each(?))"""
+    md5s = json.dumps(list({r["md5"] for r in records}))
+    known = {row["md5"]: row["file_id"] for row in db.execute(stmt_known, [md5s])}
+    new = {}
+    for record in records:
+        if record["md5"] not in known and record["md5"] not in new:
+            new[record["md5"]] = {**record, "file_path": str(record["file_path"])}
+    if new:
+        log.debug(f"Bulk insertion of {len(new)} imageFiles")
+        db.executemany(
+            stmt_add_image, [[f"file://{r['file_path']}"] for r in new.values()]
+        )
+        db.executemany(stmt_add_file, new.values())
+        new_md5s = json.dumps(list(new.keys()))
+        db.execute(stmt_add_views, [new_md5s])
+        known.update(
+            {row["md5"]: row["file_id"] for row in db.execute(stmt_known, [new_md5s])}
+        )
+    record_file_states(db, [i for i in records if "mtime_ns" in i])
+    file_ids = {}
+    for record in records:
+        if record["md5"] not in known:
+            log.warning(f"Could not register {record['file_path']}")
+            continue
+        file_ids[str(record["file_path"])] = known[record["md5"]]
+    return file_ids
+
+
 def filepath2image(db: sqlite3.Connection, file_path: Path) -> int:
     stmt = """SELECT image_id FROM imageViews
     INNER JOIN imageFiles ON imageViews.file_id = imageFiles.file_id
@@ -0,0 +1,203 @@
+"""Versioned, in place upgrades of a Synthmap database's schema.
+
+Each migration is applied at most once, its version is then recorded in the
+schema_version table. Steps are written to be idempotent (IF NOT EXISTS...) so they
+also hold on databases created by a setup_db() which already includes them."""
+
+from datetime import datetime
+import sqlite3
+from typing import Callable, List, NamedTuple, Union
+
+from synthmap.log.logger import getLogger
+
+log = getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    # SQL statements, or functions taking the connection for conditional steps
+    statements: List[Union[str, Callable[[sqlite3.Connection], None]]]
+
+
+def add_column(table: str, column: str, declaration: str):
+    """Step adding <column> to <table>, unless it was already created with it."""
+
+    def step(db: sqlite3.Connection):
+        cursor = db.cursor()
+        cursor.row_factory = None
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+    return step
+
+
+def reindex_projects(db: sqlite3.Connection):
+    """Step rebuilding every ColmapProject's projectMatches rows & covisibility
+    edges from its own database, see colmapParser.reindex_projects()."""
+    # Imported here, colmapParser depends on this module through db.manager
+    from synthmap.db import manager as db_man
+    from synthmap.projectManager import colmapParser
+
+    row_factory = db.row_factory
+    db.row_factory = db_man.dict_factory
+    try:
+        unreachable = colmapParser.reindex_projects(db)
+    finally:
+        db.row_factory = row_factory
+    if unreachable:
+        log.warning(
+            f"Projects {unreachable} have no match index nor covisibility edges "
+            "until they are registered again (or `cli db reindex` is run)"
+        )
+
+
+###
+#
+# Migrations
+#
+###
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "Track file fingerprints",
+        [
+            """CREATE TABLE IF NOT EXISTS fileStates(file_path TEXT PRIMARY KEY,
+            size INT NOT NULL,
+            mtime_ns INT NOT NULL,
+            inode INT NOT NULL,
+            md5 TEXT NOT NULL)""",
+        ],
+    ),
+    Migration(
+        2,
+        "Index relation tables on their lookup columns",
+        [
+            # get_image_projectdata(), covering
+            """CREATE INDEX IF NOT EXISTS idx_projectImages_file
+            ON projectImages(file_id, project_id, project_image_id)""",
+            # get_entity_images() & get_image_entities()
+            """CREATE INDEX IF NOT EXISTS idx_imageEntities_entity
+            ON imageEntities(entity_id, image_id)""",
+            """CREATE INDEX IF NOT EXISTS idx_imageEntities_image
+            ON imageEntities(image_id, entity_id)""",
+            """CREATE INDEX IF NOT EXISTS idx_projectScenes_project
+            ON projectScenes(project_id, scene_id)""",
+            """CREATE INDEX IF NOT EXISTS idx_sessionImages_session
+            ON sessionImages(session_id, image_id)""",
+            """CREATE INDEX IF NOT EXISTS idx_imageViews_file
+            ON imageViews(file_id, image_id)""",
+        ],
+    ),
+    Migration(
+        3,
+        "Index Colmap matches by image",
+        [
+            """CREATE TABLE IF NOT EXISTS projectMatches(project_id INT NOT NULL,
+            project_image_id INT NOT NULL,
+            match_image_id INT NOT NULL,
+            pair_id INT NOT NULL,
+            rows INT NOT NULL,
+
+            PRIMARY KEY(project_id, project_image_id, match_image_id)) WITHOUT ROWID""",
+        ],
+    ),
+    Migration(
+        4,
+        "Add the image covisibility graph",
+        [
+            add_column("projectMatches", "inliers", "INT NOT NULL DEFAULT 0"),
+            """CREATE TABLE IF NOT EXISTS imageCovisibility(file_id INT NOT NULL,
+            match_file_id INT NOT NULL,
+            matches INT NOT NULL,
+            inliers INT NOT NULL,
+            projects INT NOT NULL,
+
+            PRIMARY KEY(file_id, match_file_id)) WITHOUT ROWID""",
+            # Indexed again with inlier counts, the graph built from them
+            reindex_projects,
+        ],
+    ),
+    Migration(
+        5,
+        "Cache Colmap feature digests",
+        [
+            # Filled when projects are registered again
+            """CREATE TABLE IF NOT EXISTS projectImageDigests(project_id INT NOT NULL,
+            project_image_id INT NOT NULL,
+            keypoints_md5 TEXT NOT NULL,
+            descriptors_md5 TEXT NOT NULL,
+
+            PRIMARY KEY(project_id, project_image_id)) WITHOUT ROWID""",
+        ],
+    ),
+    Migration(
+        6,
+        "Record which version of Colmap databases digests were read from",
+        [
+            # Digests without a source are stale, read again when next used
+            """CREATE TABLE IF NOT EXISTS projectDigestSources(
+            project_id INTEGER PRIMARY KEY,
+            mtime_ns INT NOT NULL,
+            size INT NOT NULL)""",
+        ],
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+###
+#
+# Engine
+#
+###
+
+
+def get_schema_version(db: sqlite3.Connection) -> int:
+    """Returns the version of the last migration applied to this database, 0 if
+    none was."""
+    db.execute("""CREATE TABLE IF NOT EXISTS schema_version(version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied TEXT)""")
+    # Plain tuples, whatever the connection's row_factory
+    cursor = db.cursor()
+    cursor.row_factory = None
+    (version,) = cursor.execute(
+        "SELECT coalesce(max(version), 0) FROM schema_version"
+    ).fetchone()
+    return version
+
+
+def upgrade(db: sqlite3.Connection, target: int = LATEST_VERSION) -> int:
+    """Applies, in order, every migration newer than this database's schema up to
+    version <target>. Each one is atomic & committed on its own.
+    Returns the resulting schema version."""
+    version = get_schema_version(db)
+    db.commit()
+    for migration in MIGRATIONS:
+        if migration.version <= version or migration.version > target:
+            continue
+        log.info(f"Migrating schema to v{migration.version}: {migration.description}")
+        db.execute("SAVEPOINT migration")
+        try:
+            for stmt in migration.statements:
+                if callable(stmt):
+                    stmt(db)
+                else:
+                    db.execute(stmt)
+            db.execute(
+                "INSERT INTO schema_version VALUES (?, ?, ?)",
+                [migration.version, migration.description, str(datetime.utcnow())],
+            )
+        except sqlite3.Error as e:
+            log.error(f"Migration to v{migration.version} failed: {e}")
+            db.execute("ROLLBACK TO migration")
+            db.execute("RELEASE migration")
+            raise
+        db.execute("RELEASE migration")
+        db.commit()
+        version = migration.version
+    return version
@@ -0,0 +1,138 @@
+"""Long lived connections to a Synthmap SQLite database.
+
+The HTTP app used to open (and configure) a new connection for every request. A
+ConnectionPool instead keeps a set of read-only connections which are checked out
+for the duration of a request, and a single writer connection shared behind a lock
+since SQLite only ever allows one writer at a time anyway.
+Pragmas are applied once, when each connection is opened."""
+
+from contextlib import contextmanager
+import queue
+import sqlite3
+import threading
+from typing import Dict, Iterator
+
+from synthmap.db import manager as db_man
+from synthmap.log.logger import getLogger
+
+
+log = getLogger(__name__)
+
+# Number of read-only connections a pool opens at most.
+MAX_READERS = 8
+# Seconds to wait for a connection to be released before giving up.
+TIMEOUT = 30.0
+# Applied to every connection.
+READER_PRAGMAS = {
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # negative: size in KiB
+}
+# Applied to the writer connection, which also sets the (persistent) journal mode.
+WRITER_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    **READER_PRAGMAS,
+}
+
+
+def apply_pragmas(db: sqlite3.Connection, pragmas: Dict[str, object]):
+    """Sets each of {pragma_name: value} on this connection."""
+    for name, value in pragmas.items():
+        db.execute(f"PRAGMA {name}={value}")
+
+
+class ConnectionPool:
+    """Hands out connections to the database at <db_path>.
+
+    reader() checks out one of up to <max_readers> read-only connections, opened on
+    demand and reused by later requests. writer() serialises access to the one
+    read/write connection and commits (or rolls back) when its block exits.
+    Connections are not bound to the thread which opened them: FastAPI may run a
+    dependency & its route on different threads of its pool.
+    Requires a database file, an in-memory database isn't shared between
+    connections."""
+
+    def __init__(
+        self,
+        db_path: str = db_man.DB_PATH,
+        max_readers: int = MAX_READERS,
+        timeout: float = TIMEOUT,
+    ):
+        self.db_path = str(db_path)
+        self.max_readers = max_readers
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._readers = []
+        self._writer = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _connect(self, read_only: bool) -> sqlite3.Connection:
+        if read_only:
+            db_uri = f"file:{self.db_path}?mode=ro"
+            db = sqlite3.connect(db_uri, uri=True, check_same_thread=False)
+            apply_pragmas(db, READER_PRAGMAS)
+        else:
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            apply_pragmas(db, WRITER_PRAGMAS)
+        db.row_factory = db_man.dict_factory
+        log.debug(f"Pooled SQLite connection ({'RO' if read_only else 'RW'}) to {self}")
+        return db
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._readers) < self.max_readers:
+                db = self._connect(read_only=True)
+                self._readers.append(db)
+                return db
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No reader available on {self} after {self.timeout}s")
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """Yields a read-only connection, returned to the pool afterwards."""
+        db = self._acquire()
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                db.rollback()
+            self._idle.put(db)
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """Yields the read/write connection, holding it until the block exits.
+        Commits on success, rolls back if an exception was raised."""
+        if not self._write_lock.acquire(timeout=self.timeout):
+            raise TimeoutError(f"Writer on {self} still busy after {self.timeout}s")
+        try:
+            if self._writer is None:
+                self._writer = self._connect(read_only=False)
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+        finally:
+            self._write_lock.release()
+
+    def close(self):
+        """Closes every connection this pool opened."""
+        with self._lock, self._write_lock:
+            for db in self._readers:
+                db.close()
+            self._readers = []
+            self._idle = queue.LifoQueue()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def __repr__(self):
+        return f"ConnectionPool({self.db_path})"
@@ -0,0 +1,336 @@
+"""Binary snapshots of a synthmap database, for fast cold starts.
+
+Rebuilding a Workspace means reading every table back through SQLite & pydantic,
+and parsing every Colmap scene again. A snapshot is a directory holding each table
+column, and each scene's SceneArrays, as a .npy file that is memory mapped when
+attached, along with a JSON manifest:
+
+    <snapshot>/manifest.json
+    <snapshot>/tables/<table>/<column>.npy
+    <snapshot>/scenes/<scene_id>/<field>.npy
+
+Text columns are stored as fixed width unicode arrays so they can be mapped too,
+NULLs becoming "" (see Snapshot.null_mask()).
+The manifest records the database's file change counter, size & mtime, and the
+mtime of every scene file: a snapshot is only fresh while none of them changed."""
+
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import shutil
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from synthmap.models.colmapScene import SceneArrays
+from synthmap.models.synthmap import Workspace
+from synthmap.log.logger import getLogger
+
+
+log = getLogger(__name__)
+
+# Bumped whenever the layout changes, older snapshots are then refused.
+SNAPSHOT_VERSION = 1
+MANIFEST = "manifest.json"
+SNAPSHOT_TABLES = (
+    "Projects",
+    "ColmapProjects",
+    "AliceProjects",
+    "Images",
+    "imageFiles",
+    "projectImages",
+    "imageViews",
+    "Entities",
+    "imageEntities",
+    "ColmapScenes",
+    "projectScenes",
+    "Sessions",
+    "sessionImages",
+)
+# Offset & size of the "file change counter" in the SQLite header, see
+# https://www.sqlite.org/fileformat.html#file_change_counter
+CHANGE_COUNTER = slice(24, 28)
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+
+def db_fingerprint(db_path) -> dict:
+    """Returns what identifies this version of the database file.
+    PRAGMA data_version is only meaningful within one connection, so the header's
+    file change counter is used instead, along with the file's (and its WAL's, as
+    commits in WAL mode don't touch the header) size & mtime."""
+    db_path = Path(db_path)
+    with open(db_path, "rb") as fd:
+        header = fd.read(100)
+    if not header.startswith(SQLITE_MAGIC):
+        raise ValueError(f"{db_path} is not an SQLite database")
+    stat = db_path.stat()
+    fingerprint = {
+        "change_counter": int.from_bytes(header[CHANGE_COUNTER], "big"),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+    wal_path = Path(f"{db_path}-wal")
+    if wal_path.exists():
+        wal_stat = wal_path.stat()
+        fingerprint["wal"] = [wal_stat.st_size, wal_stat.st_mtime_ns]
+    return fingerprint
+
+
+def _mtime_ns(file_path) -> Optional[int]:
+    try:
+        return os.stat(file_path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _text_column(values: np.ndarray):
+    """Returns (unicode array, NULL mask or None) for an object column."""
+    nulls = np.array([i is None for i in values], dtype=bool)
+    text = np.array(["" if i is None else str(i) for i in values], dtype=str)
+    if not len(text):
+        text = text.astype("U1")
+    return text, nulls if nulls.any() else None
+
+
+###
+#
+# Writing
+#
+###
+
+
+def _write_tables(workspace: Workspace, folder: Path) -> Dict[str, dict]:
+    tables = {}
+    with workspace.connection() as db:
+        # Every table is read from the same version of the database
+        db.execute("BEGIN")
+        try:
+            for table in SNAPSHOT_TABLES:
+                try:
+                    columns = workspace.read_columns(table)
+                except ValueError:
+                    log.debug(f"Snapshot: no table {table} in {workspace.db_path}")
+                    continue
+                table_folder = folder / table
+                table_folder.mkdir(parents=True)
+                layout = {}
+                for name, values in columns.items():
+                    nulls = None
+                    if values.dtype.kind == "O":
+                        values, nulls = _text_column(values)
+                    np.save(table_folder / f"{name}.npy", values)
+                    if nulls is not None:
+                        np.save(table_folder / f"{name}.null.npy", nulls)
+                    layout[name] = {
+                        "dtype": values.dtype.str,
+                        "nulls": nulls is not None,
+                    }
+                rows = len(next(iter(columns.values()))) if columns else 0
+                tables[table] = {"rows": rows, "columns": layout}
+        finally:
+            db.rollback()
+    return tables
+
+
+def _write_scenes(scene_rows: Dict[str, np.ndarray], folder: Path) -> Dict[str, dict]:
+    scenes = {}
+    for scene_id, *paths in zip(
+        scene_rows["scene_id"],
+        scene_rows["cameras_path"],
+        scene_rows["images_path"],
+        scene_rows["points_path"],
+    ):
+        sources = {str(i): _mtime_ns(i) for i in paths}
+        if None in sources.values():
+            log.warning(f"Snapshot: skipping ColmapScene #{scene_id}, missing files")
+            continue
+        try:
+            arrays = SceneArrays.from_files(*paths)
+        except (OSError, ValueError) as e:
+            log.warning(f"Snapshot: skipping ColmapScene #{scene_id}: {e}")
+            continue
+        scene_folder = folder / str(scene_id)
+        scene_folder.mkdir(parents=True)
+        for field in arrays.__fields__:
+            values = getattr(arrays, field)
+            if values.dtype.kind == "O":
+                values = _text_column(values)[0]
+            np.save(scene_folder / f"{field}.npy", values)
+        scenes[str(scene_id)] = {"sources": sources, "arrays": list(arrays.__fields__)}
+    return scenes
+
+
+def write_snapshot(db_path, snapshot_path, scenes: bool = True) -> "Snapshot":
+    """Writes a snapshot of the database at <db_path> into the <snapshot_path>
+    folder, replacing any previous one. With <scenes>, every ColmapScene is parsed
+    & stored as SceneArrays too.
+    The manifest is written last: an interrupted snapshot is never attached."""
+    start = time.perf_counter()
+    snapshot_path = Path(snapshot_path)
+    snapshot_path.mkdir(parents=True, exist_ok=True)
+    (snapshot_path / MANIFEST).unlink(missing_ok=True)
+    for subfolder in ["tables", "scenes"]:
+        shutil.rmtree(snapshot_path / subfolder, ignore_errors=True)
+    # Taken first: rows committed meanwhile make the snapshot stale, never wrong
+    fingerprint = db_fingerprint(db_path)
+    workspace = Workspace(db_path=db_path)
+    try:
+        tables = _write_tables(workspace, snapshot_path / "tables")
+        scene_rows = workspace.read_columns("ColmapScenes") if scenes else None
+    finally:
+        workspace.close()
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created": datetime.now().isoformat(),
+        "db_path": str(Path(db_path).absolute()),
+        "db": fingerprint,
+        "tables": tables,
+        "scenes": _write_scenes(scene_rows, snapshot_path / "scenes") if scenes else {},
+    }
+    tmp_path = snapshot_path / f"{MANIFEST}.tmp"
+    with open(tmp_path, "w") as fd:
+        json.dump(manifest, fd, indent=2)
+    os.replace(tmp_path, snapshot_path / MANIFEST)
+    log.info(
+        f"Snapshot of {db_path} written to {snapshot_path}: {len(tables)} tables, "
+        f"{len(manifest['scenes'])} scenes in {time.perf_counter() - start:.2f}s"
+    )
+    return Snapshot(snapshot_path)
+
+
+###
+#
+# Reading
+#
+###
+
+
+class Snapshot:
+    """A snapshot written by write_snapshot(), its arrays are memory mapped
+    (read-only) as they are accessed."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        try:
+            with open(self.path / MANIFEST) as fd:
+                self.manifest = json.load(fd)
+        except OSError as e:
+            raise ValueError(f"No snapshot in {self.path}: {e}")
+        if self.manifest.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(
+                f"Snapshot {self.path} has version {self.manifest.get('version')}, "
+                f"expected {SNAPSHOT_VERSION}"
+            )
+        self.db_path = self.manifest["db_path"]
+
+    def changes(self) -> List[str]:
+        """Returns what changed since the snapshot was taken, nothing if it is
+        still fresh."""
+        changes = []
+        try:
+            if db_fingerprint(self.db_path) != self.manifest["db"]:
+                changes.append(f"database {self.db_path}")
+        except OSError:
+            changes.append(f"database {self.db_path} (missing)")
+        for scene_id, scene in self.manifest["scenes"].items():
+            for file_path, mtime_ns in scene["sources"].items():
+                if _mtime_ns(file_path) != mtime_ns:
+                    changes.append(f"ColmapScene #{scene_id} file {file_path}")
+        return changes
+
+    def is_fresh(self) -> bool:
+        return not self.changes()
+
+    def tables_are_fresh(self) -> bool:
+        """Returns whether the snapshot's tables still match the database, without
+        checking every scene file as is_fresh() does."""
+        try:
+            return db_fingerprint(self.db_path) == self.manifest["db"]
+        except OSError:
+            return False
+
+    @property
+    def tables(self) -> List[str]:
+        return list(self.manifest["tables"])
+
+    @property
+    def scene_ids(self) -> List[int]:
+        return [int(i) for i in self.manifest["scenes"]]
+
+    def _load(self, *parts) -> np.ndarray:
+        return np.load(self.path.joinpath(*parts), mmap_mode="r")
+
+    def columns(self, table: str) -> Dict[str, np.ndarray]:
+        """Returns this table as {column: array}, see Workspace.read_columns().
+        Raises KeyError if the table isn't part of the snapshot."""
+        if table not in self.manifest["tables"]:
+            raise KeyError(f"No table {table} in snapshot {self.path}")
+        return {
+            name: self._load("tables", table, f"{name}.npy")
+            for name in self.manifest["tables"][table]["columns"]
+        }
+
+    def rows(self, table: str, mask: np.ndarray = None) -> List[dict]:
+        """Returns this table's rows (those selected by <mask> if given) as dicts,
+        like those of manager.dict_factory: NULLs are None again, NaNs too as
+        SQLite never stores them (NULL only columns are read as floats)."""
+        columns = self.columns(table)
+        if mask is None:
+            mask = np.ones(self.manifest["tables"][table]["rows"], dtype=bool)
+        values = {}
+        for name, column in columns.items():
+            column = column[mask]
+            values[name] = column.tolist()
+            if self.manifest["tables"][table]["columns"][name]["nulls"]:
+                nulls = self.null_mask(table, name)[mask]
+            elif column.dtype.kind == "f":
+                nulls = np.isnan(column)
+            else:
+                continue
+            values[name] = [None if n else v for v, n in zip(values[name], nulls)]
+        return [dict(zip(values, row)) for row in zip(*values.values())]
+
+    def null_mask(self, table: str, column: str) -> np.ndarray:
+        """Returns which rows of this text column were NULL."""
+        layout = self.manifest["tables"][table]["columns"][column]
+        if layout["nulls"]:
+            return self._load("tables", table, f"{column}.null.npy")
+        return np.zeros(self.manifest["tables"][table]["rows"], dtype=bool)
+
+    def scene(self, scene_id: int) -> SceneArrays:
+        """Returns the SceneArrays of this ColmapScene, backed by the snapshot.
+        Raises KeyError if it isn't part of the snapshot."""
+        scene = self.manifest["scenes"].get(str(scene_id))
+        if scene is None:
+            raise KeyError(f"No ColmapScene #{scene_id} in snapshot {self.path}")
+        return SceneArrays.construct(
+            **{
+                i: self._load("scenes", str(scene_id), f"{i}.npy")
+                for i in scene["arrays"]
+            }
+        )
+
+    def __repr__(self):
+        return f"Snapshot({self.path})"
+
+
+def get_project_images(snapshot: Snapshot, project_id: int) -> List[dict]:
+    """Snapshot counterpart to manager.get_project_images()."""
+    project_images = snapshot.columns("projectImages")
+    file_ids = project_images["file_id"][project_images["project_id"] == project_id]
+    return snapshot.rows(
+        "imageFiles", np.isin(snapshot.columns("imageFiles")["file_id"], file_ids)
+    )
+
+
+def load_snapshot(snapshot_path, check: bool = True) -> Snapshot:
+    """Attaches the snapshot in this folder.
+    Raises ValueError if there is none, or if <check> and it is stale."""
+    snapshot = Snapshot(snapshot_path)
+    if check:
+        changes = snapshot.changes()
+        if changes:
+            raise ValueError(f"{snapshot} is stale, changed: {', '.join(changes)}")
+    return snapshot
@@ -3,12 +3,13 @@ from datetime import timedelta
 import math
 import os
 from pathlib import Path
-from typing import Tuple
+from typing import Dict, Iterable, Tuple
 
 import cv2
 from exif import Image as EXIFImage
 from PIL import Image as PILImage
 
+from synthmap.imageProcessing import probe
 from synthmap.log.logger import getLogger
 
 
@@ -16,11 +17,26 @@ log = getLogger(__name__)
 
 
 def get_size(image_path: Path) -> Tuple[int, int]:
-    """Returns (width, height) for this image."""
+    """Returns (width, height) for this image.
+    Read from the file's header when possible, decodes the whole image otherwise."""
+    size = probe.probe_size(image_path)
+    if size:
+        return size
+    log.debug(f"Could not probe {image_path}, decoding it")
     y, x, depth = cv2.imread(str(image_path)).shape
     return x, y
 
 
+def get_sizes(image_paths: Iterable[Path]) -> Dict[str, Tuple[int, int]]:
+    """Returns {image_path: (width, height)} for many images at once.
+    See get_size()"""
+    sizes = probe.probe_sizes(image_paths)
+    for image_path, size in sizes.items():
+        if not size:
+            sizes[image_path] = get_size(image_path)
+    return sizes
+
+
 def new_size(x: int, y: int, max_size: int = 3000) -> (int, int):
     """Returns a (width, height) pair such that max(pair) < max_size while
     preserving aspect ratio."""
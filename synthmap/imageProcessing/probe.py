@@ -0,0 +1,163 @@
+"""Reads image dimensions from file headers, without decoding any pixel data.
+
+JPEG: the frame header (SOFn marker), rotated according to the EXIF orientation so
+results agree with cv2.imread(). EXIF PixelX/YDimension is used when no frame header
+can be found.
+PNG: the IHDR chunk."""
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import struct
+from typing import BinaryIO, Dict, Iterable, Optional, Tuple
+
+from synthmap.log.logger import getLogger
+
+
+log = getLogger(__name__)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Start Of Frame markers, excluding DHT (C4), JPG (C8) & DAC (CC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers without a length field
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xD8)) | {0x01}
+JPEG_SOS = 0xDA
+JPEG_APP1 = 0xE1
+# EXIF orientations for which the stored image is rotated by +/-90 degrees
+EXIF_TRANSPOSED = {5, 6, 7, 8}
+EXIF_ORIENTATION = 0x0112
+EXIF_IFD_POINTER = 0x8769
+EXIF_PIXEL_X = 0xA002
+EXIF_PIXEL_Y = 0xA003
+
+
+###
+#
+# EXIF
+#
+###
+
+
+def read_exif_tags(data: bytes) -> Dict[int, int]:
+    """Returns the integer valued tags of an APP1 segment's IFD0 & EXIF IFD
+    (orientation, pixel dimensions...). <data> starts at the TIFF header."""
+    tags = {}
+    if data[:2] == b"II":
+        endian = "<"
+    elif data[:2] == b"MM":
+        endian = ">"
+    else:
+        return tags
+
+    def read_ifd(offset):
+        (count,) = struct.unpack_from(endian + "H", data, offset)
+        for idx in range(count):
+            entry = offset + 2 + 12 * idx
+            tag, kind = struct.unpack_from(endian + "HH", data, entry)
+            if kind == 3:  # SHORT
+                (tags[tag],) = struct.unpack_from(endian + "H", data, entry + 8)
+            elif kind == 4:  # LONG
+                (tags[tag],) = struct.unpack_from(endian + "I", data, entry + 8)
+
+    try:
+        (ifd0,) = struct.unpack_from(endian + "I", data, 4)
+        read_ifd(ifd0)
+        if EXIF_IFD_POINTER in tags:
+            read_ifd(tags[EXIF_IFD_POINTER])
+    except struct.error:
+        log.debug("Truncated EXIF data")
+    return tags
+
+
+###
+#
+# Formats
+#
+###
+
+
+def read_jpeg_size(fd: BinaryIO) -> Optional[Tuple[int, int]]:
+    """Walks the JPEG markers of <fd> up to the frame header.
+    Returns (width, height) as displayed, None if no size could be read."""
+    if fd.read(2) != b"\xff\xd8":
+        return None
+    exif = {}
+    size = None
+    while True:
+        byte = fd.read(1)
+        if not byte:
+            break
+        if byte != b"\xff":
+            continue
+        marker = fd.read(1)
+        while marker == b"\xff":
+            marker = fd.read(1)
+        if not marker:
+            break
+        marker = marker[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == JPEG_SOS:
+            break
+        header = fd.read(2)
+        if len(header) < 2:
+            break
+        (length,) = struct.unpack(">H", header)
+        if marker in JPEG_SOF_MARKERS:
+            frame = fd.read(5)
+            if len(frame) == 5:
+                _, h, w = struct.unpack(">BHH", frame)
+                size = (w, h)
+            break
+        if marker == JPEG_APP1:
+            segment = fd.read(length - 2)
+            if segment[:6] == b"Exif\x00\x00":
+                exif = read_exif_tags(segment[6:])
+            continue
+        fd.seek(length - 2, os.SEEK_CUR)
+    if not size and exif.get(EXIF_PIXEL_X) and exif.get(EXIF_PIXEL_Y):
+        size = (exif[EXIF_PIXEL_X], exif[EXIF_PIXEL_Y])
+    if size and exif.get(EXIF_ORIENTATION) in EXIF_TRANSPOSED:
+        size = size[::-1]
+    return size
+
+
+def read_png_size(fd: BinaryIO) -> Optional[Tuple[int, int]]:
+    """Returns (width, height) from the PNG's IHDR chunk."""
+    header = fd.read(24)
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", header[16:24])
+
+
+###
+#
+# Probing
+#
+###
+
+
+def probe_size(image_path: Path) -> Optional[Tuple[int, int]]:
+    """Returns (width, height) for this image from its header alone.
+    None if the format is unknown or the header can't be parsed."""
+    try:
+        with open(image_path, "rb") as fd:
+            magic = fd.read(8)
+            fd.seek(0)
+            if magic[:2] == b"\xff\xd8":
+                return read_jpeg_size(fd)
+            if magic == PNG_SIGNATURE:
+                return read_png_size(fd)
+    except (OSError, struct.error) as e:
+        log.debug(f"Could not probe {image_path}: {e}")
+    return None
+
+
+def probe_sizes(
+    image_paths: Iterable[Path], workers: int = 16
+) -> Dict[str, Optional[Tuple[int, int]]]:
+    """Runs probe_size() over many files at once.
+    Header reads are latency bound, so a thread pool keeps several in flight.
+    Returns {image_path: (width, height) or None}."""
+    image_paths = [str(i) for i in image_paths]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(image_paths, pool.map(probe_size, image_paths)))
@@ -2,6 +2,7 @@
 
 from typing import List, Optional, Tuple
 
+import numpy as np
 from pydantic import conlist
 
 from synthmap.models.common import BaseModel
@@ -26,6 +27,32 @@ class Structure(BaseModel):
     observations: List[Observation]
 
 
+class StructureArrays(BaseModel):
+    """Array-backed structure, the observations of the landmark at index i are
+    observation_*[observation_offsets[i]:observation_offsets[i + 1]]."""
+
+    landmark_ids: np.ndarray  # int64
+    X: np.ndarray  # float64, (n_landmarks, 3)
+    color: np.ndarray  # uint8, (n_landmarks, 3)
+    observation_offsets: np.ndarray  # int64, n_landmarks + 1
+    observation_view_ids: np.ndarray  # int64
+    observation_feature_ids: np.ndarray  # int64
+    observation_x: np.ndarray  # float32, (n_observations, 2)
+    observation_scales: np.ndarray  # float32
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def observations(cls, idx: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns views on (view_ids, feature_ids, x) of the landmark at <idx>."""
+        obs = slice(cls.observation_offsets[idx], cls.observation_offsets[idx + 1])
+        return (
+            cls.observation_view_ids[obs],
+            cls.observation_feature_ids[obs],
+            cls.observation_x[obs],
+        )
+
+
 class View(BaseModel):
     viewId: int
     poseId: int
@@ -59,6 +86,7 @@ class PoseTransform(BaseModel):
 
 
 class Pose(BaseModel):
+    poseId: Optional[int]
     locked: Optional[bool]
     transform: Optional[PoseTransform]
 
@@ -74,6 +102,7 @@ class AliceProject(BaseModel):
     intrinsics: Optional[List[Intrinsics]]
     poses: Optional[List[Pose]]
     structure: Optional[List[Structure]]
+    structure_arrays: Optional[StructureArrays]
 
     def load_all(cls):
         pass
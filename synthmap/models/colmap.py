@@ -1,7 +1,15 @@
 # pylint: disable=E0213
 
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+import json
+from pathlib import Path
 import sqlite3
-from typing import Dict, Optional, Tuple, Union
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 from pydantic import validator, FilePath, DirectoryPath
@@ -10,9 +18,15 @@ from pydantic import validator, FilePath, DirectoryPath
 from synthmap.log.logger import getLogger
 from synthmap.models.common import BaseModel
 
-
 log = getLogger(__name__)
 
+# Bytes of decoded blobs kept by a lazily loaded ColmapProject
+CACHE_BYTES = 2**28
+# pair_id = image_id1 * MAX_IMAGE_ID + image_id2, with image_id1 < image_id2
+MAX_IMAGE_ID = 2**31 - 1
+# ColmapProject tables, in dependency order
+TABLES = ("cameras", "images", "keypoints", "descriptors", "matches", "geometries")
+
 
 ###
 #
@@ -133,6 +147,37 @@ class ImageDescriptors(ImageData):
 ###
 
 
+def pair_id_ranges(
+    image_ids: Iterable[int], new_ids: Iterable[int] = None
+) -> List[Tuple[int, int]]:
+    """Returns the [first, last] pair_id ranges covering every pair made of two of
+    <image_ids>, one range per image: pair_ids sharing their first image are
+    contiguous, which lets SQLite walk the pair tables' primary key.
+    With <new_ids>, only the pairs including at least one of them are needed: the
+    range of an image that isn't new only spans the new images after it."""
+    image_ids = sorted(set(image_ids))
+    if new_ids is None:
+        return [
+            (
+                image_id * MAX_IMAGE_ID + image_ids[idx + 1],
+                image_id * MAX_IMAGE_ID + image_ids[-1],
+            )
+            for idx, image_id in enumerate(image_ids[:-1])
+        ]
+    new_set = set(new_ids).intersection(image_ids)
+    new_ids = sorted(new_set)
+    ranges = []
+    for idx, image_id in enumerate(image_ids[:-1]):
+        if image_id in new_set:
+            first, last = image_ids[idx + 1], image_ids[-1]
+        elif new_ids and new_ids[-1] > image_id:
+            first, last = new_ids[bisect_right(new_ids, image_id)], new_ids[-1]
+        else:
+            continue
+        ranges.append((image_id * MAX_IMAGE_ID + first, image_id * MAX_IMAGE_ID + last))
+    return ranges
+
+
 class PairData(RowData):
     pair_id: int
 
@@ -172,6 +217,225 @@ class PairGeometry(PairData):
         arbitrary_types_allowed = True
 
 
+###
+#
+# Row decoding
+#
+###
+
+
+def _dict_row(cursor: sqlite3.Cursor, row: tuple) -> dict:
+    """Row factory shared by the eager & lazy readers: {column: value}."""
+    return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
+
+
+def _blob_data(row: dict, dtype) -> Optional[np.ndarray]:
+    if not row["data"]:
+        return None
+    return np.frombuffer(row["data"], dtype=dtype).reshape((row["rows"], row["cols"]))
+
+
+def _keypoints_from_row(row: dict) -> ImageKeypoints:
+    data = _blob_data(row, np.float32)
+    return ImageKeypoints(
+        image_id=row["image_id"], rows=row["rows"], cols=row["cols"], data=data
+    )
+
+
+def _descriptors_from_row(row: dict) -> ImageDescriptors:
+    data = _blob_data(row, np.uint8)
+    return ImageDescriptors(
+        image_id=row["image_id"], rows=row["rows"], cols=row["cols"], data=data
+    )
+
+
+def _matches_from_row(row: dict) -> PairMatches:
+    data = _blob_data(row, np.uint32)
+    return PairMatches(
+        pair_id=row["pair_id"], rows=row["rows"], cols=row["cols"], data=data
+    )
+
+
+def _geometry_from_row(row: dict) -> PairGeometry:
+    data = _blob_data(row, np.uint32)
+    matrices = {
+        i: np.frombuffer(row[i], dtype=np.float64).reshape((3, 3))
+        for i in ("F", "E", "H")
+        if row.get(i)
+    }
+    return PairGeometry(
+        pair_id=row["pair_id"],
+        rows=row["rows"],
+        cols=row["cols"],
+        data=data,
+        **matrices,
+    )
+
+
+###
+#
+# Lazy tables
+#
+###
+
+
+def _model_nbytes(model) -> int:
+    return sum(i.nbytes for i in dict(model).values() if isinstance(i, np.ndarray))
+
+
+class BlobCache:
+    """LRU of decoded rows, bounded by the total size of their arrays.
+    Can be shared by several LazyTables."""
+
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries: "OrderedDict[tuple, Tuple[object, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: tuple, value, nbytes: int):
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LazyTable(Mapping):
+    """Read-only {id: model} view on a Colmap database table.
+    Rows are only fetched & decoded when accessed, then kept in a BlobCache.
+    With <image_ids>, only the rows of those images (or of pairs made of two of
+    them) are part of the view."""
+
+    def __init__(
+        self,
+        db_path: Path,
+        table: str,
+        key: str,
+        from_row: Callable[[dict], BaseModel],
+        cache: BlobCache,
+        image_ids: Iterable[int] = None,
+    ):
+        self.db_path = db_path
+        self.table = table
+        self.key = key
+        self.from_row = from_row
+        self.cache = cache
+        self.image_ids = None
+        if image_ids is not None:
+            self.image_ids = np.array(sorted(set(int(i) for i in image_ids)))
+        self._keys = None
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _execute(self, *args) -> sqlite3.Cursor:
+        if self._db is None:
+            db_uri = Path(self.db_path).absolute().as_uri() + "?mode=ro"
+            self._db = sqlite3.connect(db_uri, uri=True, check_same_thread=False)
+            self._db.row_factory = _dict_row
+        return self._db.execute(*args)
+
+    def keys_array(self) -> np.ndarray:
+        """Returns this table's ids, in increasing order."""
+        if self._keys is None:
+            with self._lock:
+                rows = self._execute(
+                    f"SELECT {self.key} FROM {self.table} ORDER BY {self.key}"
+                )
+                keys = np.array([i[self.key] for i in rows], dtype=np.int64)
+                if self.image_ids is None:
+                    self._keys = keys
+                elif self.key == "pair_id":
+                    self._keys = keys[
+                        np.isin(keys // MAX_IMAGE_ID, self.image_ids)
+                        & np.isin(keys % MAX_IMAGE_ID, self.image_ids)
+                    ]
+                else:
+                    self._keys = keys[np.isin(keys, self.image_ids)]
+        return self._keys
+
+    def __getitem__(self, key: int):
+        if self.image_ids is not None and key not in self:
+            raise KeyError(key)
+        value = self.cache.get((self.table, key))
+        if value is not None:
+            return value
+        with self._lock:
+            row = self._execute(
+                f"SELECT * FROM {self.table} WHERE {self.key}=?", [key]
+            ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = self.from_row(row)
+        self.cache.put((self.table, key), value, _model_nbytes(value))
+        return value
+
+    def __contains__(self, key) -> bool:
+        keys = self.keys_array()
+        pos = np.searchsorted(keys, key)
+        return bool(pos < len(keys) and keys[pos] == key)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.keys_array().tolist())
+
+    def __len__(self) -> int:
+        return len(self.keys_array())
+
+    def concatenated(self, dtype) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns (ids, offsets, data) with the data of every row of the table
+        stacked in one array, the rows of ids[i] being data[offsets[i]:offsets[i + 1]].
+        Bypasses the cache. Raises ValueError if rows don't all have the same width."""
+        where, params = "rows > 0", []
+        if self.image_ids is not None:
+            where += f" AND {self.key} IN (SELECT value FROM json_each(?))"
+            params = [json.dumps(self.keys_array().tolist())]
+        with self._lock:
+            sizes = self._execute(
+                f"""SELECT count(*) AS cnt, sum(rows) AS total,
+                min(cols) AS min_cols, max(cols) AS max_cols
+                FROM {self.table} WHERE {where}""",
+                params,
+            ).fetchone()
+            if sizes["min_cols"] != sizes["max_cols"]:
+                raise ValueError(f"{self.table}: rows have different widths")
+            ids = np.zeros(sizes["cnt"], dtype=np.int64)
+            offsets = np.zeros(sizes["cnt"] + 1, dtype=np.int64)
+            data = np.empty((sizes["total"] or 0, sizes["max_cols"] or 0), dtype=dtype)
+            rows = self._execute(
+                f"""SELECT {self.key}, rows, data FROM {self.table}
+                WHERE {where} ORDER BY {self.key}""",
+                params,
+            )
+            for idx, row in enumerate(rows):
+                ids[idx] = row[self.key]
+                offsets[idx + 1] = offsets[idx] + row["rows"]
+                data[offsets[idx] : offsets[idx + 1]] = np.frombuffer(
+                    row["data"], dtype=dtype
+                ).reshape(row["rows"], -1)
+        return ids, offsets, data
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
 ###
 #
 # Project
@@ -186,10 +450,11 @@ class ColmapProject(BaseModel):
     label: Optional[str] = None
     cameras: Optional[Dict[int, Camera]] = None
     images: Optional[Dict[int, Image]] = None
-    keypoints: Optional[Dict[int, ImageKeypoints]] = None
-    descriptors: Optional[Dict[int, ImageDescriptors]] = None
-    matches: Optional[Dict[int, PairMatches]] = None
-    geometries: Optional[Dict[int, PairGeometry]] = None
+    # LazyTable first, or pydantic would copy it into a dict
+    keypoints: Optional[Union[LazyTable, Dict[int, ImageKeypoints]]] = None
+    descriptors: Optional[Union[LazyTable, Dict[int, ImageDescriptors]]] = None
+    matches: Optional[Union[LazyTable, Dict[int, PairMatches]]] = None
+    geometries: Optional[Union[LazyTable, Dict[int, PairGeometry]]] = None
 
     @validator("images")
     def valid_images_camera_ids(cls, images):
@@ -199,6 +464,8 @@ class ColmapProject(BaseModel):
 
     @validator("keypoints")
     def valid_keypoint_image_ids(cls, keypoints):
+        if isinstance(keypoints, LazyTable):
+            return keypoints
         if keypoints and {i.image_id for i in keypoints.values()} - set(
             cls.images.keys()
         ):
@@ -207,6 +474,8 @@ class ColmapProject(BaseModel):
 
     @validator("descriptors")
     def valid_descriptor_image_ids(cls, descriptors):
+        if isinstance(descriptors, LazyTable):
+            return descriptors
         if descriptors and {i.image_id for i in descriptors.values()} - set(
             cls.images.keys()
         ):
@@ -239,123 +508,170 @@ class ColmapProject(BaseModel):
                 )
         return db_path
 
-    def load_cameras(cls):
+    def _read_rows(
+        cls, table: str, key: str = None, image_ids: Iterable[int] = None
+    ) -> Iterator[dict]:
+        """Yields the rows of this table as dicts, those of <image_ids> only if
+        given: rows whose <key> is one of them, or for the pair tables rows of
+        pairs made of two of them."""
+        stmt, params = f"SELECT * FROM {table}", []
+        if image_ids is not None:
+            image_ids = sorted(set(int(i) for i in image_ids))
+        if image_ids is not None and key == "pair_id":
+            stmt = f"""SELECT {table}.* FROM json_each(?) AS ranges
+            INNER JOIN {table}
+            ON {table}.pair_id BETWEEN json_extract(ranges.value, '$[0]')
+            AND json_extract(ranges.value, '$[1]')
+            WHERE {table}.pair_id % {MAX_IMAGE_ID}
+            IN (SELECT value FROM json_each(?))"""
+            params = [json.dumps(pair_id_ranges(image_ids)), json.dumps(image_ids)]
+        elif image_ids is not None:
+            stmt += f" WHERE {key} IN (SELECT value FROM json_each(?))"
+            params = [json.dumps(image_ids)]
+        db_uri = Path(cls.db_path).absolute().as_uri() + "?mode=ro"
+        with closing(sqlite3.connect(db_uri, uri=True)) as db:
+            db.row_factory = _dict_row
+            yield from db.execute(stmt, params)
+
+    def _merge(cls, attr: str, rows: dict):
+        # Updated in place, assigning a full dict would trigger the validators
+        if not isinstance(getattr(cls, attr), dict):
+            setattr(cls, attr, {})
+        getattr(cls, attr).update(rows)
+
+    def read_cameras(cls, image_ids: Iterable[int] = None) -> Dict[int, Camera]:
+        """Cameras aren't filtered by <image_ids>, there are few of them."""
         log.debug(f"Attempt extraction of Cameras from {cls.db_path}")
-        if not cls.cameras:
-            cls.cameras = {}
-        with sqlite3.connect(cls.db_path) as db:
-            for row in db.execute("SELECT * FROM cameras"):
-                cls.cameras[row[0]] = Camera(
-                    camera_id=row[0],
-                    model=row[1],
-                    width=row[2],
-                    height=row[3],
-                    params=np.frombuffer(row[4]),
-                    prior_focal_length=row[5],
-                )
-        log.info(f"Extraction of {len(cls.cameras)} Cameras from {cls.db_path}")
+        cameras = {}
+        for row in cls._read_rows("cameras"):
+            cameras[row["camera_id"]] = Camera(
+                camera_id=row["camera_id"],
+                model=row["model"],
+                width=row["width"],
+                height=row["height"],
+                params=np.frombuffer(row["params"]),
+                prior_focal_length=row["prior_focal_length"],
+            )
+        return cameras
 
-    def load_images(cls):
+    def read_images(cls, image_ids: Iterable[int] = None) -> Dict[int, Image]:
         log.debug(f"Attempt extraction of Images from {cls.db_path}")
-        if not cls.images:
-            cls.images = {}
-        with sqlite3.connect(cls.db_path) as db:
-            for row in db.execute("SELECT * FROM images"):
-                cls.images[row[0]] = Image(
-                    id=row[0], name=row[1], camera_id=row[2], priors=row[3]
-                )
+        images = {}
+        for row in cls._read_rows("images", "image_id", image_ids):
+            images[row["image_id"]] = Image(
+                id=row["image_id"],
+                name=row["name"],
+                camera_id=row["camera_id"],
+                priors=row["prior_qw"],
+            )
+        return images
+
+    def read_keypoints(cls, image_ids: Iterable[int] = None):
+        return {
+            row["image_id"]: _keypoints_from_row(row)
+            for row in cls._read_rows("keypoints", "image_id", image_ids)
+        }
+
+    def read_descriptors(cls, image_ids: Iterable[int] = None):
+        return {
+            row["image_id"]: _descriptors_from_row(row)
+            for row in cls._read_rows("descriptors", "image_id", image_ids)
+        }
+
+    def read_matches(cls, image_ids: Iterable[int] = None):
+        return {
+            row["pair_id"]: _matches_from_row(row)
+            for row in cls._read_rows("matches", "pair_id", image_ids)
+        }
+
+    def read_geometries(cls, image_ids: Iterable[int] = None):
+        return {
+            row["pair_id"]: _geometry_from_row(row)
+            for row in cls._read_rows("two_view_geometries", "pair_id", image_ids)
+        }
+
+    def load_cameras(cls, image_ids: Iterable[int] = None):
+        cls._merge("cameras", cls.read_cameras(image_ids))
+        log.info(f"Extraction of {len(cls.cameras)} Cameras from {cls.db_path}")
+
+    def load_images(cls, image_ids: Iterable[int] = None):
+        cls._merge("images", cls.read_images(image_ids))
         log.info(f"Extraction of {len(cls.images)} Images from {cls.db_path}")
 
-    def load_keypoints(cls):
-        if not cls.keypoints:
-            cls.keypoints = {}
-        with sqlite3.connect(cls.db_path) as db:
-            for row in db.execute("SELECT * FROM keypoints"):
-                data = None
-                if row[3]:
-                    data = np.frombuffer(row[3], dtype=np.float32).reshape(
-                        (row[1], row[2])
-                    )
-                cls.keypoints[row[0]] = ImageKeypoints(
-                    image_id=row[0], rows=row[1], cols=row[2], data=data
-                )
+    def load_keypoints(cls, image_ids: Iterable[int] = None):
+        cls._merge("keypoints", cls.read_keypoints(image_ids))
         log.info(f"Extracted {len(cls.keypoints)} Keypoints from {cls.db_path}")
 
-    def load_descriptors(cls):
-        if not cls.descriptors:
-            cls.descriptors = {}
-        with sqlite3.connect(cls.db_path) as db:
-            for row in db.execute("SELECT * FROM descriptors"):
-                data = None
-                if row[3]:
-                    data = np.frombuffer(row[3], dtype=np.uint8).reshape(
-                        (row[1], row[2])
-                    )
-                cls.descriptors[row[0]] = ImageDescriptors(
-                    image_id=row[0], rows=row[1], cols=row[2], data=data
-                )
+    def load_descriptors(cls, image_ids: Iterable[int] = None):
+        cls._merge("descriptors", cls.read_descriptors(image_ids))
         log.info(f"Extraction of {len(cls.descriptors)} Descriptors from {cls.db_path}")
 
-    def load_matches(cls):
-        if not cls.matches:
-            cls.matches = {}
-        with sqlite3.connect(cls.db_path) as db:
-            for row in db.execute("SELECT * FROM matches"):
-                data = None
-                if row[3]:
-                    data = np.frombuffer(row[3], dtype=np.uint32).reshape(
-                        (row[1], row[2])
-                    )
-                cls.matches[row[0]] = PairMatches(
-                    pair_id=row[0], rows=row[1], cols=row[2], data=data
-                )
+    def load_matches(cls, image_ids: Iterable[int] = None):
+        cls._merge("matches", cls.read_matches(image_ids))
         log.info(f"Extraction of {len(cls.matches)} Matches from {cls.db_path}")
 
-    def load_geometries(cls):
-        def parse_blob(blob):
-            return np.frombuffer(blob, dtype=np.float64).reshape((3, 3))
-
-        if not cls.geometries:
-            cls.geometries = {}
-        with sqlite3.connect(cls.db_path) as db:
-            for row in db.execute("SELECT * FROM two_view_geometries"):
-                data = None
-                if row[3]:
-                    data = np.frombuffer(row[3], dtype=np.uint32).reshape(
-                        (row[1], row[2])
-                    )
-                table = {}
-                for i in range(5, 8):
-                    if row[i]:
-                        table[i] = parse_blob(row[i])
-                cls.geometries[row[0]] = PairGeometry(
-                    pair_id=row[0],
-                    rows=row[1],
-                    cols=row[2],
-                    data=data,
-                    config=row[4],
-                    F=table.get(5),
-                    E=table.get(6),
-                    H=table.get(7),
-                )
+    def load_geometries(cls, image_ids: Iterable[int] = None):
+        cls._merge("geometries", cls.read_geometries(image_ids))
         log.info(f"Extraction of {len(cls.geometries)} Geometries from {cls.db_path}")
 
-    def load_all(cls):
-        for fn in [
-            cls.load_cameras,
-            cls.load_images,
-            cls.load_keypoints,
-            cls.load_descriptors,
-            cls.load_matches,
-            cls.load_geometries,
+    def load_tables(
+        cls,
+        tables: Iterable[str] = TABLES,
+        image_ids: Iterable[int] = None,
+        workers: int = None,
+    ) -> Dict[str, Exception]:
+        """Reads <tables> (see TABLES) concurrently, each on its own connection,
+        restricted to <image_ids> if given (see _read_rows()).
+        A table failing to load doesn't prevent the others from loading.
+        Returns {table: exception} for those that failed."""
+        tables = list(tables)
+        readers = {i: getattr(cls, f"read_{i}") for i in tables}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=workers or len(tables) or 1) as pool:
+            futures = {i: pool.submit(readers[i], image_ids) for i in tables}
+            for table, future in futures.items():
+                try:
+                    rows = future.result()
+                except (sqlite3.Error, ValueError) as e:
+                    log.error(f"Could not load {table} from {cls.db_path}: {e}")
+                    errors[table] = e
+                    continue
+                # Assigned here, pydantic's validate_assignment isn't thread safe
+                cls._merge(table, rows)
+                log.info(f"Extraction of {len(rows)} {table} from {cls.db_path}")
+        return errors
+
+    def load_lazy(cls, max_bytes: int = CACHE_BYTES, image_ids: Iterable[int] = None):
+        """Loads cameras & images, keypoints, descriptors, matches & geometries
+        become LazyTables sharing a cache of up to <max_bytes> of decoded data.
+        All restricted to <image_ids> if given, as in load_tables()."""
+        cls.load_cameras()
+        cls.load_images(image_ids)
+        cache = BlobCache(max_bytes)
+        for attr, table, key, from_row in [
+            ("keypoints", "keypoints", "image_id", _keypoints_from_row),
+            ("descriptors", "descriptors", "image_id", _descriptors_from_row),
+            ("matches", "matches", "pair_id", _matches_from_row),
+            ("geometries", "two_view_geometries", "pair_id", _geometry_from_row),
         ]:
-            try:
-                fn()
-                continue
-            # TODO: sqlite.OperationalError et al.
-            except Exception as e:
-                print(e)
-            break
+            setattr(
+                cls,
+                attr,
+                LazyTable(cls.db_path, table, key, from_row, cache, image_ids),
+            )
+        log.info(f"Lazy loading of {cls.db_path}, {max_bytes / 2**20:.0f}MB cache")
+
+    def load_all(
+        cls, lazy: bool = False, image_ids: Iterable[int] = None, workers: int = None
+    ):
+        """Loads the whole project, or the data of <image_ids> only, see
+        load_tables(). See load_lazy() for <lazy>, which reads nothing upfront:
+        raises ValueError if <workers> are given along with it."""
+        if lazy:
+            if workers is not None:
+                raise ValueError("Lazy tables are read on access, without workers")
+            return cls.load_lazy(image_ids=image_ids)
+        return cls.load_tables(image_ids=image_ids, workers=workers)
 
     def yield_pairs_for(cls, image_id: int, pair_dict: Dict[int, PairData]):
         for pair_id, pair_data in pair_dict.items():
@@ -368,10 +684,11 @@ class ColmapProject(BaseModel):
                 # If we are the second image, reverse the data columns so the
                 # indexed image's keypoints remain in the second column.
                 # aka: pair_data.T[::-1].T
-                pair_data.data = pair_data.data[:, ::-1]
-                yield p1, pair_data
+                # Copied, pair_dict may be a LazyTable sharing its cached models
+                yield p1, pair_data.copy(update={"data": pair_data.data[:, ::-1]})
 
     class Config:
+        arbitrary_types_allowed = True
         validate_assignment = True
 
 
@@ -1,9 +1,11 @@
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 
-from pydantic import conlist
+import numpy as np
+from pydantic import PrivateAttr, conlist
 
 from synthmap.log.logger import getLogger
 from synthmap.models.common import BaseModel
+from synthmap.projectManager import colmapModel
 
 
 log = getLogger(__name__)
@@ -57,6 +59,101 @@ class Landmark(BaseModel):
     track: Dict[int, int]  # image_id: feature_id
 
 
+class SceneArrays(BaseModel):
+    """Array-backed Scene, see colmapModel for the record dtypes.
+    Variable length lists are stored flat with offsets (CSR): the features of the
+    image at index i are feature_*[feature_offsets[i]:feature_offsets[i + 1]], the
+    track of the point at index j is track_*[track_offsets[j]:track_offsets[j + 1]].
+    An observation costs 8 bytes of track & 12 bytes of feature."""
+
+    cameras: np.ndarray  # colmapModel.CAMERA_DTYPE
+    images: np.ndarray  # colmapModel.IMAGE_DTYPE
+    image_names: np.ndarray
+    feature_offsets: np.ndarray  # int64, n_images + 1
+    feature_xy: np.ndarray  # float32, (n_features, 2)
+    feature_landmark_ids: np.ndarray  # int32 unless ids need more, -1 if none
+    points: np.ndarray  # colmapModel.POINT_DTYPE
+    track_offsets: np.ndarray  # int64, n_points + 1
+    track_image_ids: np.ndarray  # int32
+    track_point2d_idx: np.ndarray  # int32
+    _image_index: Optional[Tuple[np.ndarray, np.ndarray]] = PrivateAttr(None)
+    _point_index: Optional[Tuple[np.ndarray, np.ndarray]] = PrivateAttr(None)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_files(cls, cameras_path, images_path, points_path):
+        """Reads a text or binary model, see colmapModel.read_*()."""
+        images = colmapModel.read_images(images_path)
+        points = colmapModel.read_points3D(points_path)
+        landmark_ids = images["points2D_point3D_ids"]
+        if len(landmark_ids) and landmark_ids.max() > np.iinfo(np.int32).max:
+            landmark_dtype = np.int64
+        else:
+            landmark_dtype = np.int32
+        return cls(
+            cameras=colmapModel.read_cameras(cameras_path)["cameras"],
+            images=images["images"],
+            image_names=images["names"],
+            feature_offsets=images["points2D_offsets"],
+            feature_xy=images["points2D_xy"].astype(np.float32),
+            feature_landmark_ids=landmark_ids.astype(landmark_dtype),
+            points=points["points"],
+            track_offsets=points["track_offsets"],
+            track_image_ids=points["track_image_ids"],
+            track_point2d_idx=points["track_point2D_idx"],
+        )
+
+    @staticmethod
+    def _lookup(index: Tuple[np.ndarray, np.ndarray], record_id: int, kind: str) -> int:
+        sorted_ids, order = index
+        pos = np.searchsorted(sorted_ids, record_id)
+        if pos == len(sorted_ids) or sorted_ids[pos] != record_id:
+            raise KeyError(f"No {kind} #{record_id} in Scene")
+        return int(order[pos])
+
+    @staticmethod
+    def _sort_ids(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        order = np.argsort(ids, kind="stable")
+        return ids[order], order
+
+    def image_index(cls, image_id: int) -> int:
+        """Returns the position of this image in the arrays.
+        Raises KeyError if it isn't part of the Scene."""
+        if cls._image_index is None:
+            cls._image_index = cls._sort_ids(cls.images["image_id"])
+        return cls._lookup(cls._image_index, image_id, "Image")
+
+    def point_index(cls, landmark_id: int) -> int:
+        """Returns the position of this landmark in the arrays.
+        Raises KeyError if it isn't part of the Scene."""
+        if cls._point_index is None:
+            cls._point_index = cls._sort_ids(cls.points["point3D_id"])
+        return cls._lookup(cls._point_index, landmark_id, "Landmark")
+
+    def features(cls, image_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns views on (xy, landmark_ids) of this image's features."""
+        idx = cls.image_index(image_id)
+        features = slice(cls.feature_offsets[idx], cls.feature_offsets[idx + 1])
+        return cls.feature_xy[features], cls.feature_landmark_ids[features]
+
+    def track(cls, landmark_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns views on (image_ids, point2d_idx) of this landmark's track."""
+        idx = cls.point_index(landmark_id)
+        track = slice(cls.track_offsets[idx], cls.track_offsets[idx + 1])
+        return cls.track_image_ids[track], cls.track_point2d_idx[track]
+
+    @property
+    def nbytes(cls) -> int:
+        """Memory held by the arrays, image names excluded."""
+        return sum(
+            getattr(cls, field).nbytes
+            for field in cls.__fields__
+            if field != "image_names"
+        )
+
+
 class Scene(BaseModel):
     scene_id: Optional[int]
     cameras_path: str
@@ -65,119 +162,98 @@ class Scene(BaseModel):
     images: Optional[Dict[int, Image]]
     points_path: str
     points: Optional[Dict[int, Landmark]]
+    arrays: Optional[SceneArrays]
 
     def parse_camera_file(cls, file_path=None):
+        """Yields each camera's data from the bulk parsed file,
+        see colmapModel.read_cameras()."""
         assert cls.cameras_path or file_path
-        with open(cls.cameras_path or file_path, "r") as fd:
-            line = fd.readline().strip()
-            while line:
-                if line[0] == "#":
-                    line = fd.readline().strip()
-                    continue
-                tokens = line.split()
-                camera_data = dict(
-                    zip(
-                        ["camera_id", "model", "width", "height"],
-                        [int(tokens[0]), tokens[1], int(tokens[2]), int(tokens[3])],
-                    )
-                )
-                # TODO: Fancify parameter handling based on declared model
-                # cf. http://colmap.github.io/cameras.html
-                camera_data["params"] = [float(i) for i in tokens[4:]]
-                print(f"Done Camera {tokens[0]}")
-                yield camera_data
-                line = fd.readline().strip()
+        data = colmapModel.read_cameras(cls.cameras_path or file_path)
+        for camera in data["cameras"]:
+            model, num_params = colmapModel.CAMERA_MODELS[int(camera["model_id"])]
+            # TODO: Fancify parameter handling based on declared model
+            # cf. http://colmap.github.io/cameras.html
+            yield {
+                "camera_id": int(camera["camera_id"]),
+                "model": model,
+                "width": int(camera["width"]),
+                "height": int(camera["height"]),
+                "params": camera["params"][:num_params].tolist(),
+            }
 
     def parse_image_file(cls, file_path=None):
+        """Yields each image's data from the bulk parsed file,
+        see colmapModel.read_images()."""
         assert cls.images_path or file_path
-        image_data = {}
-        with open(cls.images_path or file_path, "r") as fd:
-            line = fd.readline().strip()
-            while line:
-                if line[0] == "#":
-                    line = fd.readline().strip()
-                    continue
-                tokens = line.split()
-                if len(tokens) == 10:
-                    image_data = dict(
-                        zip(
-                            [
-                                "image_id",
-                                "qw",
-                                "qx",
-                                "qy",
-                                "qz",
-                                "tx",
-                                "ty",
-                                "tz",
-                                "camera_id",
-                                "name",
-                            ],
-                            [
-                                int(tokens[0]),
-                                float(tokens[1]),
-                                float(tokens[2]),
-                                float(tokens[3]),
-                                float(tokens[4]),
-                                float(tokens[5]),
-                                float(tokens[6]),
-                                float(tokens[7]),
-                                int(tokens[8]),
-                                tokens[9],
-                            ],
-                        )
-                    )
-                    line = fd.readline().strip()
-                    continue
-                features = []
-                iteration = 0
-                while 3 * iteration < len(tokens):
-                    x, y, landmark = (
-                        float(tokens[3 * iteration]),
-                        float(tokens[3 * iteration + 1]),
-                        int(tokens[3 * iteration + 2]),
-                    )
-                    features.append([x, y, landmark])
-                    iteration += 1
-                image_data["features"] = features
-                print(f"Done Image {image_data['image_id']}")
-                yield image_data
-                line = fd.readline().strip()
+        data = colmapModel.read_images(cls.images_path or file_path)
+        offsets = data["points2D_offsets"]
+        for idx, image in enumerate(data["images"]):
+            start, end = offsets[idx], offsets[idx + 1]
+            xy = data["points2D_xy"][start:end].tolist()
+            landmarks = data["points2D_point3D_ids"][start:end].tolist()
+            yield {
+                "image_id": int(image["image_id"]),
+                "qw": float(image["q"][0]),
+                "qx": float(image["q"][1]),
+                "qy": float(image["q"][2]),
+                "qz": float(image["q"][3]),
+                "tx": float(image["t"][0]),
+                "ty": float(image["t"][1]),
+                "tz": float(image["t"][2]),
+                "camera_id": int(image["camera_id"]),
+                "name": data["names"][idx],
+                "features": [[x, y, i] for (x, y), i in zip(xy, landmarks)],
+            }
 
     def parse_point_file(cls, file_path=None):
+        """Yields each point's data from the bulk parsed file,
+        see colmapModel.read_points3D()."""
         assert cls.points_path or file_path
-        with open(cls.points_path or file_path, "r") as fd:
-            line = fd.readline().strip()
-            while line:
-                if line[0] == "#":
-                    line = fd.readline().strip()
-                    continue
-                tokens = line.split()
-                point_data = dict(
-                    zip(
-                        ["landmark_id", "x", "y", "z", "r", "g", "b", "error"],
-                        [
-                            int(tokens[0]),
-                            float(tokens[1]),
-                            float(tokens[2]),
-                            float(tokens[3]),
-                            int(tokens[4]),
-                            int(tokens[5]),
-                            int(tokens[6]),
-                            float(tokens[7]),
-                        ],
-                    )
-                )
-                point_data["track"] = dict(zip(tokens[8::2], tokens[9::2]))
-                yield point_data
-                line = fd.readline().strip()
+        data = colmapModel.read_points3D(cls.points_path or file_path)
+        points = data["points"]
+        offsets = data["track_offsets"].tolist()
+        image_ids = data["track_image_ids"].tolist()
+        point2D_idx = data["track_point2D_idx"].tolist()
+        for idx, (landmark_id, (x, y, z), (r, g, b), error) in enumerate(
+            zip(
+                points["point3D_id"].tolist(),
+                points["xyz"].tolist(),
+                points["rgb"].tolist(),
+                points["error"].tolist(),
+            )
+        ):
+            start, end = offsets[idx], offsets[idx + 1]
+            yield {
+                "landmark_id": landmark_id,
+                "x": x,
+                "y": y,
+                "z": z,
+                "r": r,
+                "g": g,
+                "b": b,
+                "error": error,
+                "track": dict(zip(image_ids[start:end], point2D_idx[start:end])),
+            }
+
+    def load_arrays(cls) -> SceneArrays:
+        """Loads the whole Scene as arrays, without any per record object."""
+        log.info(f"Loading Scene arrays from {cls.points_path}")
+        assert cls.cameras_path and cls.images_path and cls.points_path
+        cls.arrays = SceneArrays.from_files(
+            cls.cameras_path, cls.images_path, cls.points_path
+        )
+        log.info(
+            f"Done {len(cls.arrays.images)} Images, {len(cls.arrays.points)} Points"
+            f" in {cls.arrays.nbytes / 2**20:.1f}MB"
+        )
+        return cls.arrays
 
     def load_all(cls):
-        print("Starting load complete Scene")
+        log.info(f"Loading complete Scene from {cls.points_path}")
         assert cls.cameras_path and cls.images_path and cls.points_path
         cls.cameras = {i["camera_id"]: i for i in cls.parse_camera_file()}
-        print(f"Done {len(cls.cameras)} Cameras")
+        log.info(f"Done {len(cls.cameras)} Cameras")
         cls.images = {i["image_id"]: i for i in cls.parse_image_file()}
-        print(f"Done {len(cls.images)} Images")
+        log.info(f"Done {len(cls.images)} Images")
         cls.points = {i["landmark_id"]: i for i in cls.parse_point_file()}
-        print(f"Done {len(cls.points)} Points")
+        log.info(f"Done {len(cls.points)} Points")
@@ -1,10 +1,13 @@
 # pylint: disable=E0213
 
+from contextlib import contextmanager
 from enum import Enum
 import sqlite3
-from typing import Dict, List, NewType, Optional, Union
+import threading
+from typing import Dict, Iterator, List, NewType, Optional, Union
 
-from pydantic import conlist, constr, validator, FilePath
+import numpy as np
+from pydantic import PrivateAttr, conlist, constr, validator, FilePath
 
 from synthmap.models.alice import AliceProject
 from synthmap.models.colmap import ColmapProject
@@ -227,8 +230,23 @@ class SFMScene(BaseModel):
 ###
 
 
+def _column_array(values) -> np.ndarray:
+    values = list(values)
+    array = np.array(values)
+    if array.dtype.kind in "iuf":
+        return array
+    if array.dtype.kind == "O" and all(
+        i is None or isinstance(i, (int, float)) for i in values
+    ):
+        # Numbers & NULLs
+        return np.array(values, dtype=np.float64)
+    return np.array(values, dtype=object)
+
+
 class Workspace(BaseModel):
-    """Represents and loads the content of an entire synthmap database"""
+    """Represents and loads the content of an entire synthmap database.
+    Used as a context manager (`with workspace:`), its connection stays open for
+    every load_* call of the block."""
 
     db_path: FilePath
     projects: Optional[Dict[int, CommonProject]] = None
@@ -245,6 +263,10 @@ class Workspace(BaseModel):
     projectScenes: Optional[list] = None
     sessions: Optional[Dict[int, Session]] = None
     sessionImages: Optional[List[SessionImages]] = None
+    _db: Optional[sqlite3.Connection] = PrivateAttr(None)
+    # Guards _db, which threads share, & counts the blocks keeping it open
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+    _users: int = PrivateAttr(0)
 
     @validator("db_path")
     def db_is_init(cls, db_path):
@@ -279,13 +301,90 @@ class Workspace(BaseModel):
                 )
         return db_path
 
-    def load_Projects(cls):
+    @contextmanager
+    def connection(cls) -> Iterator[sqlite3.Connection]:
+        """Yields this Workspace's connection, shared by nested blocks (those of
+        load_all() or of a `with workspace:` block) and closed once the outermost
+        one exits. Threads use it in turn: the block holds the Workspace's lock."""
+        with cls._lock:
+            if cls._db is None:
+                cls._db = sqlite3.connect(cls.db_path, check_same_thread=False)
+            cls._users += 1
+            try:
+                yield cls._db
+            finally:
+                cls._users -= 1
+                if not cls._users:
+                    cls.close()
+
+    def close(cls):
+        with cls._lock:
+            if cls._db is not None:
+                cls._db.close()
+                cls._db = None
+
+    def __enter__(cls):
+        with cls._lock:
+            cls._users += 1
+        return cls
+
+    def __exit__(cls, *exc):
+        with cls._lock:
+            cls._users -= 1
+            if not cls._users:
+                cls.close()
+
+    def read_columns(cls, table: str) -> Dict[str, np.ndarray]:
+        """Returns this table as {column: array}. Integer & real columns become
+        numeric arrays (NULLs turning integers into floats & NaN), others object
+        arrays. No model is built for its rows."""
+        with cls.connection() as db:
+            known = {
+                i[0]
+                for i in db.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            }
+            if table not in known:
+                raise ValueError(f"No table {table} in {cls.db_path}")
+            cursor = db.execute(f"SELECT * FROM {table}")
+            names = [i[0] for i in cursor.description]
+            rows = cursor.fetchall()
+        columns = zip(*rows) if rows else [[] for _ in names]
+        return {name: _column_array(values) for name, values in zip(names, columns)}
+
+    def read_array(cls, table: str) -> np.recarray:
+        """Returns this table as a NumPy structured array, see read_columns()."""
+        columns = cls.read_columns(table)
+        return np.rec.fromarrays(list(columns.values()), names=list(columns))
+
+    def load_all(cls, trusted: bool = True):
+        """Runs every load_* method over a single connection, closed once done.
+        With <trusted>, rows from our own database aren't validated: models are
+        built with construct()."""
+        with cls:
+            for fn in [
+                cls.load_Projects,
+                cls.load_ColmapProjects,
+                cls.load_AliceProjects,
+                cls.load_Images,
+                cls.load_ProjectImages,
+                cls.load_ImageFiles,
+                cls.load_ImageViews,
+                cls.load_Entities,
+                cls.load_ImageEntities,
+                cls.load_ColmapScenes,
+                cls.load_Sessions,
+                cls.load_SessionImages,
+            ]:
+                fn(trusted=trusted)
+
+    def load_Projects(cls, trusted: bool = False):
         log.debug(f"Attempt extraction of Projects from {cls.db_path}")
+        make = CommonProject.construct if trusted else CommonProject
         if not cls.projects:
             cls.projects = {}
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM Projects"""):
-                cls.projects[row[0]] = CommonProject(
+                cls.projects[row[0]] = make(
                     project_id=row[0],
                     label=row[1],
                     project_type=row[2],
@@ -294,64 +393,63 @@ class Workspace(BaseModel):
                 )
         log.info(f"Extraction of {len(cls.projects)} Projects from {cls.db_path}")
 
-    def load_ColmapProjects(cls, populate=False):
+    def load_ColmapProjects(cls, populate=False, trusted: bool = False):
         log.debug(f"Attempt extraction of ColmapProjects from {cls.db_path}")
+        make = ColmapProject.construct if trusted else ColmapProject
         if not cls.colmapProjects:
             cls.colmapProjects = {}
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM ColmapProjects"""):
                 # TODO: if populate ColmapProject.load_all()
-                cls.colmapProjects[row[0]] = ColmapProject(
-                    db_path=row[1], image_path=row[2]
-                )
+                cls.colmapProjects[row[0]] = make(db_path=row[1], image_path=row[2])
         log.info(
             f"Extraction of {len(cls.colmapProjects)} ColmapProjects from {cls.db_path}"
         )
 
-    def load_AliceProjects(cls):
+    def load_AliceProjects(cls, trusted: bool = False):
         log.debug(f"Attempt extraction of AliceProjects from {cls.db_path}")
+        make = AliceProject.construct if trusted else AliceProject
         if not cls.aliceProjects:
             cls.aliceProjects = {}
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM AliceProjects"""):
-                cls.aliceProjects[row[0]] = AliceProject(
-                    db_path=row[1], image_path=row[2]
-                )
+                cls.aliceProjects[row[0]] = make(db_path=row[1], image_path=row[2])
         log.info(
             f"Extraction of {len(cls.aliceProjects)} AliceProjects from {cls.db_path}"
         )
 
-    def load_Images(cls):
+    def load_Images(cls, trusted: bool = False):
         log.debug(f"Attempt extraction of Images from {cls.db_path}")
+        make = Image.construct if trusted else Image
         if not cls.images:
             cls.images = {}
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM Images"""):
-                cls.images[row[0]] = Image(id=row[0], orig_uri=row[1], orig_ipfs=row[2])
+                cls.images[row[0]] = make(id=row[0], orig_uri=row[1], orig_ipfs=row[2])
         log.info(f"Extraction of {len(cls.images)} Images from {cls.db_path}")
 
-    def load_ProjectImages(cls):
+    def load_ProjectImages(cls, trusted: bool = False):
         log.debug(f"Attempt extraction of ProjectImages from {cls.db_path}")
+        make = ProjectImages.construct if trusted else ProjectImages
         if not cls.projectImages:
             cls.projectImages = []
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM projectImages"""):
                 cls.projectImages.append(
-                    ProjectImages(
-                        file_id=row[0], project_id=row[1], project_image_id=row[2]
-                    )
+                    make(file_id=row[0], project_id=row[1], project_image_id=row[2])
                 )
         log.info(
             f"Extraction of {len(cls.projectImages)} ProjectImages from {cls.db_path}"
         )
 
-    def load_ImageFiles(cls):
+    def load_ImageFiles(cls, trusted: bool = False):
         log.debug(f"Attempt extraction of ImageFiles from {cls.db_path}")
+        make = ImageFile.construct if trusted else ImageFile
         if not cls.imageFiles:
             cls.imageFiles = {}
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM imageFiles"""):
-                cls.imageFiles[row[0]] = ImageFile(
+                cls.imageFiles[row[0]] = make(
                     file_id=row[0],
                     file_path=row[1],
                     md5=row[2],
@@ -361,25 +459,27 @@ class Workspace(BaseModel):
                 )
         log.info(f"Extraction of {len(cls.imageFiles)} ImageFiles from {cls.db_path}")
 
-    def load_ImageViews(cls):
+    def load_ImageViews(cls, trusted: bool = False):
         log.debug(f"Attempt extraction of ImageViews from {cls.db_path}")
+        make = ImageView.construct if trusted else ImageView
         if not cls.imageViews:
             cls.imageViews = {}
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM imageViews"""):
-                cls.imageViews[row[0]] = ImageView(
+                cls.imageViews[row[0]] = make(
                     image_id=row[0],
                     file_id=row[1],
                 )
         log.info(f"Extraction of {len(cls.imageViews)} ImageViews from {cls.db_path}")
 
-    def load_Entities(cls):
+    def load_Entities(cls, trusted: bool = False):
         log.debug(f"Attempt extraction of Entities from {cls.db_path}")
+        make = Entity.construct if trusted else Entity
         if not cls.entities:
             cls.entities = {}
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM Entities"""):
-                cls.entities[row[0]] = Entity(
+                cls.entities[row[0]] = make(
                     entity_id=row[0],
                     label=row[1],
                     detail=row[2],
@@ -394,14 +494,15 @@ class Workspace(BaseModel):
                 )
         log.info(f"Extraction of {len(cls.entities)} Entities from {cls.db_path}")
 
-    def load_ImageEntities(cls):
+    def load_ImageEntities(cls, trusted: bool = False):
         log.debug(f"Attempt extraction of ImageEntities from {cls.db_path}")
+        make = ImageEntities.construct if trusted else ImageEntities
         if not cls.imageEntities:
             cls.imageEntities = []
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM imageEntities"""):
                 cls.imageEntities.append(
-                    ImageEntities(
+                    make(
                         image_id=row[0],
                         entity_id=row[1],
                         tiles16=row[2],
@@ -410,13 +511,14 @@ class Workspace(BaseModel):
                 )
         log.info(f"Extraction of {len(cls.imageEntities)} Entities from {cls.db_path}")
 
-    def load_ColmapScenes(cls):
+    def load_ColmapScenes(cls, trusted: bool = False):
         log.debug(f"Attempt extraction of ColmapScenes from {cls.db_path}")
+        make = ColmapScene.construct if trusted else ColmapScene
         if not cls.colmapScenes:
             cls.colmapScenes = {}
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM ColmapScenes"""):
-                cls.colmapScenes[row[0]] = ColmapScene(
+                cls.colmapScenes[row[0]] = make(
                     scene_id=row[0],
                     cameras_path=row[1],
                     images_path=row[2],
@@ -429,13 +531,15 @@ class Workspace(BaseModel):
     def load_AliceScenes(cls):
         pass
 
-    def load_Sessions(cls):
+    def load_Sessions(cls, trusted: bool = False):
         log.debug(f"Attempt extraction of Sessions from {cls.db_path}")
+        make = Session.construct if trusted else Session
         if not cls.sessions:
             cls.sessions = {}
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM Sessions"""):
-                cls.sessions[row[0]] = Session(
+                cls.sessions[row[0]] = make(
+                    session_id=row[0],
                     orig_uri=row[1],
                     label=row[2],
                     created=row[3],
@@ -443,14 +547,15 @@ class Workspace(BaseModel):
                 )
         log.info(f"Extraction of {len(cls.sessions)} Sessions from {cls.db_path}")
 
-    def load_SessionImages(cls):
+    def load_SessionImages(cls, trusted: bool = False):
         log.debug(f"Attempt extraction of SessionImages from {cls.db_path}")
+        make = SessionImages.construct if trusted else SessionImages
         if not cls.sessionImages:
             cls.sessionImages = []
-        with sqlite3.connect(cls.db_path) as db:
+        with cls.connection() as db:
             for row in db.execute("""SELECT * FROM sessionImages"""):
                 cls.sessionImages.append(
-                    SessionImages(
+                    make(
                         session_id=row[0],
                         image_id=row[1],
                     )
@@ -1,6 +1,39 @@
+"""Reads AliceVision (Meshroom) sfm.json files.
+
+Those reach gigabytes on big scenes, mostly because of structure[].observations, so
+they are never loaded as a whole: the top level object is decoded one item of its
+arrays at a time (see SfmStream) and structure goes straight into NumPy arrays,
+see models.alice.StructureArrays."""
+
 import json
 import os
+import re
 from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import warnings
+
+import numpy as np
+
+from synthmap.db import ingest
+from synthmap.log.logger import getLogger
+from synthmap.models import alice as alicemodels, colmap as colmodels
+
+log = getLogger(__name__)
+
+# Characters read from the file at once
+READ_SIZE = 2**20
+# Landmarks converted to arrays at once
+LANDMARKS_PER_BATCH = 2**16
+# Top level keys describing the project, found before its (large) arrays
+HEADER_KEYS = ("version", "featuresFolders", "matchesFolders")
+WHITESPACE = re.compile(r"\s*")
+# Files written by AliceVision's FeatureMatching node
+MATCHES_GLOB = "*.matches.txt"
+# Files written by AliceVision's FeatureExtraction node, <view_id>.<describer>.<ext>
+FEATURES_EXT = ".feat"
+DESCRIPTORS_EXT = ".desc"
+# Bytes per descriptor of the SIFT describers
+DESCRIPTOR_LENGTH = 128
 
 
 def resolve_folders(project_path, folder_path):
@@ -11,14 +44,397 @@ def resolve_folders(project_path, folder_path):
     return os.path.join(parent_p, folder_path[6:])
 
 
-def parse_sfm(file_path):
+###
+#
+# Incremental decoding
+#
+###
+
+
+class SfmStream:
+    """Incremental decoder of a JSON object holding large arrays.
+
+        for key, value in SfmStream(fd).items():
+            ...
+
+    Array values are yielded as iterators over their items, which must be consumed
+    (or not) before moving to the next key. Other values are yielded decoded."""
+
+    def __init__(self, fd, read_size: int = READ_SIZE):
+        self.fd = fd
+        self.name = getattr(fd, "name", "<stream>")
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Reads more of the file, dropping what was already decoded.
+        Returns False at the end of the file."""
+        if self.eof:
+            return False
+        data = self.fd.read(self.read_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + data
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """Returns the next non whitespace character, without consuming it."""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError(f"{self.name}: unexpected end of file")
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(f"{self.name}: expected one of {chars!r}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def _value(self) -> Any:
+        """Decodes the next complete value, reading more of the file as needed."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number may go on past the end of the buffer
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def _array(self) -> Iterator[Any]:
+        """Yields the items of the array starting at the current position."""
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(",]") == "]":
+                return
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """Yields (key, value) for each item of the top level object."""
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if self._peek() == "[":
+                items = self._array()
+                yield key, items
+                # Whatever the caller didn't read
+                for _ in items:
+                    pass
+            else:
+                yield key, self._value()
+            if self._expect(",}") == "}":
+                return
+
+
+###
+#
+# sfm.json
+#
+###
+
+
+def _structure_arrays(structure: Iterator[dict]) -> alicemodels.StructureArrays:
+    """Converts the items of sfm.json's structure to arrays, a batch at a time."""
+    batches = []
+    ids, coords, colors, counts = [], [], [], []
+    view_ids, feature_ids, xy, scales = [], [], [], []
+
+    def flush():
+        batches.append(
+            {
+                "landmark_ids": np.array(ids, dtype=np.int64),
+                "X": np.array(coords, dtype=np.float64).reshape(-1, 3),
+                "color": np.array(colors, dtype=np.uint8).reshape(-1, 3),
+                "counts": np.array(counts, dtype=np.int64),
+                "view_ids": np.array(view_ids, dtype=np.int64),
+                "feature_ids": np.array(feature_ids, dtype=np.int64),
+                "x": np.array(xy, dtype=np.float32).reshape(-1, 2),
+                "scales": np.array(scales, dtype=np.float32),
+            }
+        )
+        for i in (ids, coords, colors, counts, view_ids, feature_ids, xy, scales):
+            i.clear()
+
+    for landmark in structure:
+        ids.append(landmark["landmarkId"])
+        coords.extend(landmark["X"])
+        colors.extend(landmark["color"])
+        counts.append(len(landmark["observations"]))
+        for observation in landmark["observations"]:
+            view_ids.append(observation["observationId"])
+            feature_ids.append(observation["featureId"])
+            xy.extend(observation["x"])
+            scales.append(observation["scale"])
+        if len(ids) >= LANDMARKS_PER_BATCH:
+            flush()
+    flush()
+    merged = {k: np.concatenate([i[k] for i in batches]) for k in batches[0]}
+    offsets = np.zeros(len(merged["counts"]) + 1, dtype=np.int64)
+    np.cumsum(merged.pop("counts"), out=offsets[1:])
+    return alicemodels.StructureArrays(
+        landmark_ids=merged["landmark_ids"],
+        X=merged["X"],
+        color=merged["color"],
+        observation_offsets=offsets,
+        observation_view_ids=merged["view_ids"],
+        observation_feature_ids=merged["feature_ids"],
+        observation_x=merged["x"],
+        observation_scales=merged["scales"],
+    )
+
+
+def _pose(item: dict) -> alicemodels.Pose:
+    """sfm.json nests each pose's data under "pose"."""
+    return alicemodels.Pose(poseId=item["poseId"], **item.get("pose", {}))
+
+
+# How to stream each array of sfm.json
+SECTION_READERS = {
+    "views": lambda items: [alicemodels.View(**i) for i in items],
+    "intrinsics": lambda items: [alicemodels.Intrinsics(**i) for i in items],
+    "poses": lambda items: [_pose(i) for i in items],
+    "structure": _structure_arrays,
+}
+
+
+def parse_sfm(file_path, header_only: bool = False) -> Dict[str, Any]:
+    """Returns an AliceProject's data read from this sfm.json.
+    views, intrinsics & poses are returned as models, structure as StructureArrays
+    (under "structure_arrays").
+    With <header_only>, reading stops as soon as the project's folders are known."""
     data = {"file_path": file_path, "project_type": "alice"}
+    file_data = {}
     with open(file_path) as fd:
-        file_data = json.load(fd)
-    if isinstance(file_data["featuresFolders"], list):
+        for key, value in SfmStream(fd).items():
+            if key in SECTION_READERS:
+                if header_only:
+                    # Left unread
+                    continue
+                value = SECTION_READERS[key](value)
+                key = "structure_arrays" if key == "structure" else key
+            elif isinstance(value, Iterator):
+                value = list(value)
+            file_data[key] = value
+            if header_only and all(i in file_data for i in HEADER_KEYS[1:]):
+                break
+    if isinstance(file_data.get("featuresFolders"), list):
         fp = file_data["featuresFolders"][0]
         file_data["featuresFolders"] = resolve_folders(file_path, fp)
-    if isinstance(file_data["matchesFolders"], list):
+    if isinstance(file_data.get("matchesFolders"), list):
         fp = file_data["matchesFolders"][0]
         file_data["matchesFolders"] = resolve_folders(file_path, fp)
     return {**file_data, **data}
+
+
+def parse_sfm_header(file_path) -> Dict[str, Any]:
+    """parse_sfm() for project discovery, only reads up to the project's folders."""
+    return parse_sfm(file_path, header_only=True)
+
+
+###
+#
+# FeatureMatching/*.matches.txt
+#
+###
+
+# {(view_id1, view_id2): {describer_type: uint32 (n_matches, 2) feature indices}}
+PairMatches = Dict[Tuple[int, int], Dict[str, np.ndarray]]
+
+
+def read_matches_text(file_path: Path) -> PairMatches:
+    """Reads a matches file, made of one block per pair of views:
+
+        view_id1 view_id2
+        number of describer types
+        describer_type number of matches
+        feature_index1 feature_index2
+        ...
+
+    Only the block headers are walked line by line, each describer type's matches
+    are parsed in a single call."""
+    with open(file_path, "rb") as fd:
+        block = fd.read()
+    buf = np.frombuffer(block, dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord("\n"))
+    if not len(ends) or ends[-1] != len(block) - 1:
+        ends = np.append(ends, len(block))
+    starts = np.concatenate([[0], ends[:-1] + 1])
+
+    def line(idx: int) -> List[bytes]:
+        if idx >= len(ends):
+            raise ValueError(f"{file_path}: unexpected end of file")
+        return block[starts[idx] : ends[idx]].split()
+
+    matches = {}
+    idx = 0
+    while idx < len(ends):
+        tokens = line(idx)
+        if not tokens:
+            idx += 1
+            continue
+        view_ids = (int(tokens[0]), int(tokens[1]))
+        (num_describers,) = line(idx + 1)
+        idx += 2
+        pair_matches = matches.setdefault(view_ids, {})
+        for _ in range(int(num_describers)):
+            describer_type, num_matches = line(idx)
+            num_matches = int(num_matches)
+            first, last = idx + 1, idx + num_matches
+            if last >= len(ends):
+                raise ValueError(f"{file_path}: unexpected end of file")
+            with warnings.catch_warnings():
+                # Unparseable input warns before returning what it could read
+                warnings.simplefilter("ignore", DeprecationWarning)
+                data = np.fromstring(
+                    block[starts[first] : ends[last]] if num_matches else b"",
+                    dtype=np.uint32,
+                    sep=" ",
+                )
+            if len(data) != 2 * num_matches:
+                raise ValueError(
+                    f"{file_path}: expected {num_matches} matches for {view_ids}"
+                )
+            pair_matches[describer_type.decode()] = data.reshape(-1, 2)
+            idx = last + 1
+    return matches
+
+
+def read_matches_files(file_paths: List[Path]) -> List[PairMatches]:
+    return [read_matches_text(i) for i in file_paths]
+
+
+def read_matches_folder(folder_path: Path, workers: int = None) -> PairMatches:
+    """Reads every matches file in this folder, over <workers> processes
+    (see ingest.imap_chunks) and merges them."""
+    file_paths = sorted(Path(folder_path).glob(MATCHES_GLOB))
+    log.debug(f"Reading {len(file_paths)} matches files from {folder_path}")
+    matches = {}
+    chunks = ([i] for i in file_paths)
+    for file_matches in ingest.imap_chunks(read_matches_files, chunks, workers):
+        for file_data in file_matches:
+            for view_ids, pair_matches in file_data.items():
+                merged = matches.setdefault(view_ids, {})
+                for describer_type, data in pair_matches.items():
+                    if describer_type in merged:
+                        data = np.concatenate([merged[describer_type], data])
+                    merged[describer_type] = data
+    return matches
+
+
+def list_image_matches(
+    matches: PairMatches, view_id: int, min_matches: int = 0
+) -> Dict[int, dict]:
+    """Returns this view's matches with every other view, shaped as a Project's
+    entry of colmapParser.list_image_matches():
+        {match_view_id: {rows: int, data: list, describer_types: {type: rows}}}
+    data's first column holds this view's feature indices, rows of all describer
+    types are concatenated in the order of describer_types."""
+    image_matches = {}
+    for (view_id1, view_id2), pair_matches in matches.items():
+        if view_id not in (view_id1, view_id2):
+            continue
+        data = np.concatenate(list(pair_matches.values()))
+        if len(data) < min_matches:
+            continue
+        if view_id == view_id2:
+            view_id1, view_id2 = view_id2, view_id1
+            data = data[:, ::-1]
+        image_matches[view_id2] = {
+            "rows": len(data),
+            "data": data.tolist(),
+            "describer_types": {k: len(v) for k, v in pair_matches.items()},
+        }
+    return image_matches
+
+
+###
+#
+# FeatureExtraction/*.feat & *.desc
+#
+###
+
+
+def list_feature_files(features_folder: Path) -> Dict[int, Dict[str, dict]]:
+    """Returns {view_id: {describer_type: {"feat": Path, "desc": Path}}} for the
+    files found in this folder, "desc" may be missing."""
+    files = {}
+    for file_path in Path(features_folder).iterdir():
+        if file_path.suffix not in (FEATURES_EXT, DESCRIPTORS_EXT):
+            continue
+        view_id, _, describer_type = file_path.stem.partition(".")
+        if not view_id.isdigit() or not describer_type:
+            continue
+        describers = files.setdefault(int(view_id), {})
+        describers.setdefault(describer_type, {})[file_path.suffix[1:]] = file_path
+    return files
+
+
+def read_features(file_path: Path, view_id: int) -> colmodels.ImageKeypoints:
+    """Reads a .feat file, one "x y scale orientation" line per feature, as
+    float32 keypoints shaped like a Colmap project's."""
+    with open(file_path, "rb") as fd:
+        block = fd.read()
+    first_line = block[: block.find(b"\n")] if b"\n" in block else block
+    cols = len(first_line.split())
+    with warnings.catch_warnings():
+        # Unparseable input warns before returning what it could read
+        warnings.simplefilter("ignore", DeprecationWarning)
+        data = np.fromstring(block, dtype=np.float32, sep=" ")
+    if cols and len(data) % cols:
+        raise ValueError(f"{file_path}: expected {cols} values per feature")
+    data = data.reshape(-1, cols or 4)
+    return colmodels.ImageKeypoints(
+        image_id=view_id, rows=data.shape[0], cols=data.shape[1], data=data
+    )
+
+
+def read_descriptors(
+    file_path: Path, view_id: int, length: int = DESCRIPTOR_LENGTH
+) -> colmodels.ImageDescriptors:
+    """Memory maps a .desc file: the number of descriptors (uint64), followed by
+    that many <length> bytes descriptors. Nothing is read until the data is used."""
+    with open(file_path, "rb") as fd:
+        header = fd.read(8)
+    if len(header) != 8:
+        raise ValueError(f"{file_path}: not an AliceVision descriptors file")
+    rows = int(np.frombuffer(header, dtype="<u8")[0])
+    if os.path.getsize(file_path) != 8 + rows * length:
+        raise ValueError(f"{file_path}: expected {rows} descriptors of {length} bytes")
+    data = (
+        np.memmap(file_path, dtype=np.uint8, mode="r", offset=8, shape=(rows, length))
+        if rows
+        else np.zeros((0, length), dtype=np.uint8)
+    )
+    return colmodels.ImageDescriptors(
+        image_id=view_id, rows=rows, cols=length, data=data
+    )
+
+
+def get_image_features(
+    features_folder: Path, view_id: int, describer_type: str = "sift"
+) -> Tuple[colmodels.ImageKeypoints, Optional[colmodels.ImageDescriptors]]:
+    """Returns this view's keypoints & (memory mapped) descriptors, the latter None
+    when there is no .desc file. Raises KeyError if the view has no such features."""
+    files = list_feature_files(features_folder)[view_id][describer_type]
+    keypoints = read_features(files["feat"], view_id)
+    descriptors = read_descriptors(files["desc"], view_id) if "desc" in files else None
+    return keypoints, descriptors
@@ -0,0 +1,481 @@
+"""Bulk readers for Colmap sparse models (cameras, images & points3D files).
+
+Each file is read in large chunks straight into NumPy arrays instead of one Python
+object per token: records go into structured arrays and variable length lists (an
+image's 2D points, a point's track) into flat arrays indexed by offsets, so that the
+items of record i are flat[offsets[i]:offsets[i + 1]].
+See https://colmap.github.io/format.html for the file formats."""
+
+import itertools
+import struct
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+import warnings
+
+import numpy as np
+
+from synthmap.log.logger import getLogger
+
+log = getLogger(__name__)
+
+# Number of image lines parsed at once
+LINES_PER_CHUNK = 2**12
+# Bytes of points3D lines parsed at once
+BLOCK_SIZE = 2**24
+
+# model_id: (model_name, number of parameters)
+# https://github.com/colmap/colmap/blob/dev/src/colmap/sensor/models.h
+CAMERA_MODELS = {
+    0: ("SIMPLE_PINHOLE", 3),
+    1: ("PINHOLE", 4),
+    2: ("SIMPLE_RADIAL", 4),
+    3: ("RADIAL", 5),
+    4: ("OPENCV", 8),
+    5: ("OPENCV_FISHEYE", 8),
+    6: ("FULL_OPENCV", 12),
+    7: ("FOV", 5),
+    8: ("SIMPLE_RADIAL_FISHEYE", 4),
+    9: ("RADIAL_FISHEYE", 5),
+    10: ("THIN_PRISM_FISHEYE", 12),
+}
+CAMERA_MODEL_IDS = {name: model_id for model_id, (name, _) in CAMERA_MODELS.items()}
+MAX_CAMERA_PARAMS = 12
+
+CAMERA_DTYPE = np.dtype(
+    [
+        ("camera_id", "<i4"),
+        ("model_id", "<i4"),
+        ("width", "<u8"),
+        ("height", "<u8"),
+        ("params", "<f8", MAX_CAMERA_PARAMS),  # NaN padded
+    ]
+)
+IMAGE_DTYPE = np.dtype(
+    [
+        ("image_id", "<i4"),
+        ("q", "<f8", 4),  # qw, qx, qy, qz
+        ("t", "<f8", 3),
+        ("camera_id", "<i4"),
+    ]
+)
+POINT_DTYPE = np.dtype(
+    [
+        ("point3D_id", "<u8"),
+        ("xyz", "<f8", 3),
+        ("rgb", "u1", 3),
+        ("error", "<f8"),
+    ]
+)
+# Fixed columns of a points3D.txt line, followed by its track
+POINT_COLUMNS = 8
+
+
+###
+#
+# Helpers
+#
+###
+
+
+def data_lines(fd) -> Iterator[str]:
+    """Yields the lines of a Colmap text file, without comments or line endings."""
+    for line in fd:
+        if not line.startswith("#"):
+            yield line.rstrip("\r\n")
+
+
+def chunked_lines(lines: Iterable[str], size: int) -> Iterator[List[str]]:
+    lines = iter(lines)
+    while chunk := list(itertools.islice(lines, size)):
+        yield chunk
+
+
+def read_blocks(fd, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """Yields the contents of a binary file object in blocks of whole lines, without
+    comment lines. Each block ends with a line ending."""
+    remainder = b""
+    while True:
+        data = fd.read(block_size)
+        if not data:
+            break
+        data = remainder + data
+        cut = data.rfind(b"\n") + 1
+        block, remainder = data[:cut], data[cut:]
+        if b"#" in block:
+            block = b"".join(
+                i for i in block.splitlines(keepends=True) if not i.startswith(b"#")
+            )
+        if block:
+            yield block
+    if remainder and not remainder.startswith(b"#"):
+        yield remainder + b"\n"
+
+
+def parse_numbers(block: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """Parses space separated numbers over many lines at once.
+    Returns (float64 values of all lines, number of values on each line).
+    <block> must end with a line ending, empty lines have no values.
+    Raises ValueError if any token isn't a number."""
+    # Colmap separates tokens with single spaces, counting them per line is enough
+    buf = np.frombuffer(block, dtype=np.uint8)
+    line_ends = np.flatnonzero(buf == ord("\n"))
+    spaces = np.searchsorted(np.flatnonzero(buf == ord(" ")), line_ends)
+    line_spaces = np.diff(spaces, prepend=0)
+    line_lengths = np.diff(line_ends, prepend=-1) - 1
+    line_lengths -= buf[np.maximum(line_ends - 1, 0)] == ord("\r")
+    counts = np.where(line_lengths > 0, line_spaces + 1, 0)
+    with warnings.catch_warnings():
+        # Unparseable input warns before returning what it could read
+        warnings.simplefilter("ignore", DeprecationWarning)
+        values = np.fromstring(block, dtype=np.float64, sep=" ")
+    if len(values) != counts.sum():
+        # Repeated or trailing whitespace
+        counts = np.array([len(i.split()) for i in block.splitlines()], np.int64)
+    if len(values) != counts.sum():
+        raise ValueError(
+            f"Expected {counts.sum()} numbers, parsed {len(values)}: malformed line"
+        )
+    return values, counts
+
+
+def to_offsets(counts: np.ndarray) -> np.ndarray:
+    """Turns per-record item counts into offsets in the flat item array."""
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+###
+#
+# Text format
+#
+###
+
+
+def read_cameras_text(file_path: Path) -> Dict[str, np.ndarray]:
+    """Returns {"cameras": CAMERA_DTYPE array}"""
+    with open(file_path, "r") as fd:
+        lines = [i for i in data_lines(fd) if i]
+    cameras = np.zeros(len(lines), dtype=CAMERA_DTYPE)
+    cameras["params"] = np.nan
+    for idx, line in enumerate(lines):
+        tokens = line.split()
+        params = [float(i) for i in tokens[4:]]
+        cameras[idx]["camera_id"] = int(tokens[0])
+        cameras[idx]["model_id"] = CAMERA_MODEL_IDS[tokens[1]]
+        cameras[idx]["width"] = int(tokens[2])
+        cameras[idx]["height"] = int(tokens[3])
+        cameras[idx]["params"][: len(params)] = params
+    return {"cameras": cameras}
+
+
+def read_images_text(
+    file_path: Path, lines_per_chunk: int = LINES_PER_CHUNK
+) -> Dict[str, np.ndarray]:
+    """Returns {
+        "images": IMAGE_DTYPE array,
+        "names": array of image names,
+        "points2D_offsets": int64 (n_images + 1),
+        "points2D_xy": float64 (n_points2D, 2),
+        "points2D_point3D_ids": int64 (n_points2D), -1 when not triangulated
+    }"""
+    images, names, xy, point3D_ids, counts = [], [], [], [], []
+    with open(file_path, "r") as fd:
+        # Two lines per image, keep them in the same chunk
+        for chunk in chunked_lines(data_lines(fd), 2 * (lines_per_chunk // 2)):
+            headers, features = chunk[0::2], chunk[1::2]
+            if len(features) < len(headers):
+                features.append("")
+            chunk_images = np.zeros(len(headers), dtype=IMAGE_DTYPE)
+            for idx, header in enumerate(headers):
+                tokens = header.split(" ", 9)
+                chunk_images[idx]["image_id"] = int(tokens[0])
+                chunk_images[idx]["q"] = [float(i) for i in tokens[1:5]]
+                chunk_images[idx]["t"] = [float(i) for i in tokens[5:8]]
+                chunk_images[idx]["camera_id"] = int(tokens[8])
+                names.append(tokens[9])
+            values, chunk_counts = parse_numbers(("\n".join(features) + "\n").encode())
+            if (chunk_counts % 3).any():
+                raise ValueError(f"{file_path}: 2D points aren't (X, Y, POINT3D_ID)")
+            values = values.reshape(-1, 3)
+            images.append(chunk_images)
+            xy.append(values[:, :2])
+            point3D_ids.append(values[:, 2].astype(np.int64))
+            counts.append(chunk_counts // 3)
+    counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+    return {
+        "images": np.concatenate(images) if images else np.zeros(0, IMAGE_DTYPE),
+        "names": np.array(names, dtype=object),
+        "points2D_offsets": to_offsets(counts),
+        "points2D_xy": np.concatenate(xy) if xy else np.zeros((0, 2)),
+        "points2D_point3D_ids": (
+            np.concatenate(point3D_ids) if point3D_ids else np.zeros(0, np.int64)
+        ),
+    }
+
+
+def read_points3D_text(
+    file_path: Path, block_size: int = BLOCK_SIZE
+) -> Dict[str, np.ndarray]:
+    """Returns {
+        "points": POINT_DTYPE array,
+        "track_offsets": int64 (n_points + 1),
+        "track_image_ids": int32 (n_observations),
+        "track_point2D_idx": int32 (n_observations)
+    }"""
+    points, image_ids, point2D_idx, lengths = [], [], [], []
+    with open(file_path, "rb") as fd:
+        for block in read_blocks(fd, block_size):
+            values, counts = parse_numbers(block)
+            counts = counts[counts > 0]
+            starts = to_offsets(counts)[:-1]
+            columns = starts[:, None] + np.arange(POINT_COLUMNS)
+            fixed = values[columns]
+            chunk_points = np.zeros(len(counts), dtype=POINT_DTYPE)
+            chunk_points["point3D_id"] = fixed[:, 0]
+            chunk_points["xyz"] = fixed[:, 1:4]
+            chunk_points["rgb"] = fixed[:, 4:7]
+            chunk_points["error"] = fixed[:, 7]
+            is_track = np.ones(len(values), dtype=bool)
+            is_track[columns] = False
+            track = values[is_track].astype(np.int32)
+            points.append(chunk_points)
+            image_ids.append(track[0::2])
+            point2D_idx.append(track[1::2])
+            lengths.append((counts - POINT_COLUMNS) // 2)
+    lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+    return {
+        "points": np.concatenate(points) if points else np.zeros(0, POINT_DTYPE),
+        "track_offsets": to_offsets(lengths),
+        "track_image_ids": (
+            np.concatenate(image_ids) if image_ids else np.zeros(0, np.int32)
+        ),
+        "track_point2D_idx": (
+            np.concatenate(point2D_idx) if point2D_idx else np.zeros(0, np.int32)
+        ),
+    }
+
+
+###
+#
+# Binary format
+#
+###
+
+# Fixed size parts of the binary records, packed as written by Colmap
+CAMERA_HEADER_DTYPE = np.dtype(
+    [("camera_id", "<i4"), ("model_id", "<i4"), ("width", "<u8"), ("height", "<u8")]
+)
+POINT2D_DTYPE = np.dtype([("xy", "<f8", 2), ("point3D_id", "<i8")])
+POINT_HEADER_DTYPE = np.dtype(POINT_DTYPE.descr + [("track_length", "<u8")])
+TRACK_DTYPE = np.dtype([("image_id", "<i4"), ("point2D_idx", "<i4")])
+COUNT_DTYPE = np.dtype("<u8")
+
+
+def _gather(buf: np.ndarray, starts: np.ndarray, itemsize: int) -> np.ndarray:
+    """Returns the <itemsize> bytes following each of <starts> in <buf>,
+    as a (len(starts), itemsize) array."""
+    return buf[starts[:, None] + np.arange(itemsize)]
+
+
+def _track_starts(starts: np.ndarray, offsets: np.ndarray, itemsize: int) -> np.ndarray:
+    """Returns the position of each item of the variable length lists that follow
+    the records at <starts>, see to_offsets()."""
+    lengths = np.diff(offsets)
+    ranks = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+    return np.repeat(starts, lengths) + itemsize * ranks
+
+
+def _read_name(buf: np.ndarray, pos: int) -> Tuple[str, int]:
+    """Returns (the null terminated string at <pos>, position following it)."""
+    end = pos
+    while True:
+        nulls = np.flatnonzero(buf[end : end + 256] == 0)
+        if len(nulls):
+            end += int(nulls[0])
+            return buf[pos:end].tobytes().decode(), end + 1
+        if end + 256 >= len(buf):
+            raise ValueError(f"Unterminated image name at byte {pos}")
+        end += 256
+
+
+def read_cameras_binary(file_path: Path) -> Dict[str, np.ndarray]:
+    """Returns {"cameras": CAMERA_DTYPE array}"""
+    buf = np.fromfile(file_path, dtype=np.uint8)
+    num_cameras = int(buf[: COUNT_DTYPE.itemsize].view(COUNT_DTYPE)[0])
+    cameras = np.zeros(num_cameras, dtype=CAMERA_DTYPE)
+    cameras["params"] = np.nan
+    pos = COUNT_DTYPE.itemsize
+    for idx in range(num_cameras):
+        header = np.frombuffer(buf, CAMERA_HEADER_DTYPE, count=1, offset=pos)[0]
+        pos += CAMERA_HEADER_DTYPE.itemsize
+        num_params = CAMERA_MODELS[int(header["model_id"])][1]
+        for field in CAMERA_HEADER_DTYPE.names:
+            cameras[idx][field] = header[field]
+        cameras[idx]["params"][:num_params] = np.frombuffer(
+            buf, "<f8", count=num_params, offset=pos
+        )
+        pos += 8 * num_params
+    return {"cameras": cameras}
+
+
+def read_images_binary(file_path: Path) -> Dict[str, np.ndarray]:
+    """Same as read_images_text().
+    Each image's 2D points are a fixed size record section read as a whole."""
+    buf = np.memmap(file_path, dtype=np.uint8, mode="r")
+    num_images = int(buf[: COUNT_DTYPE.itemsize].view(COUNT_DTYPE)[0])
+    images = np.zeros(num_images, dtype=IMAGE_DTYPE)
+    names, points2D, counts = [], [], np.zeros(num_images, dtype=np.int64)
+    pos = COUNT_DTYPE.itemsize
+    for idx in range(num_images):
+        images[idx] = np.frombuffer(buf, IMAGE_DTYPE, count=1, offset=pos)[0]
+        pos += IMAGE_DTYPE.itemsize
+        name, pos = _read_name(buf, pos)
+        names.append(name)
+        counts[idx] = np.frombuffer(buf, COUNT_DTYPE, count=1, offset=pos)[0]
+        pos += COUNT_DTYPE.itemsize
+        points2D.append(
+            np.frombuffer(buf, POINT2D_DTYPE, count=counts[idx], offset=pos)
+        )
+        pos += POINT2D_DTYPE.itemsize * int(counts[idx])
+    points2D = np.concatenate(points2D) if points2D else np.zeros(0, POINT2D_DTYPE)
+    return {
+        "images": images,
+        "names": np.array(names, dtype=object),
+        "points2D_offsets": to_offsets(counts),
+        "points2D_xy": np.ascontiguousarray(points2D["xy"]),
+        "points2D_point3D_ids": np.ascontiguousarray(points2D["point3D_id"]),
+    }
+
+
+def read_points3D_binary(file_path: Path) -> Dict[str, np.ndarray]:
+    """Same as read_points3D_text().
+    Records only need walking to find where each starts, their fields & tracks are
+    then gathered from the memory mapped file in bulk."""
+    buf = np.memmap(file_path, dtype=np.uint8, mode="r")
+    num_points = int(buf[: COUNT_DTYPE.itemsize].view(COUNT_DTYPE)[0])
+    # track_length is the last field of a record's header
+    length_pos = POINT_HEADER_DTYPE.fields["track_length"][1]
+    unpack = struct.Struct("<Q").unpack_from
+    raw = memoryview(buf)
+    starts, lengths = [], []
+    pos = COUNT_DTYPE.itemsize
+    for _ in range(num_points):
+        (length,) = unpack(raw, pos + length_pos)
+        starts.append(pos)
+        lengths.append(length)
+        pos += POINT_HEADER_DTYPE.itemsize + TRACK_DTYPE.itemsize * length
+    starts = np.array(starts, dtype=np.int64)
+    lengths = np.array(lengths, dtype=np.int64)
+    headers = _gather(buf, starts, POINT_HEADER_DTYPE.itemsize)
+    headers = headers.view(POINT_HEADER_DTYPE).reshape(-1)
+    points = np.zeros(num_points, dtype=POINT_DTYPE)
+    for field in POINT_DTYPE.names:
+        points[field] = headers[field]
+    offsets = to_offsets(lengths)
+    track = _gather(
+        buf,
+        _track_starts(
+            starts + POINT_HEADER_DTYPE.itemsize, offsets, TRACK_DTYPE.itemsize
+        ),
+        TRACK_DTYPE.itemsize,
+    )
+    track = track.view(TRACK_DTYPE).reshape(-1)
+    return {
+        "points": points,
+        "track_offsets": offsets,
+        "track_image_ids": np.ascontiguousarray(track["image_id"]),
+        "track_point2D_idx": np.ascontiguousarray(track["point2D_idx"]),
+    }
+
+
+def write_cameras_binary(file_path: Path, data: Dict[str, np.ndarray]):
+    """Writes {"cameras": CAMERA_DTYPE array} as a cameras.bin file."""
+    cameras = data["cameras"]
+    with open(file_path, "wb") as fd:
+        fd.write(np.array(len(cameras), dtype=COUNT_DTYPE).tobytes())
+        for camera in cameras:
+            header = np.zeros(1, dtype=CAMERA_HEADER_DTYPE)
+            for field in CAMERA_HEADER_DTYPE.names:
+                header[field] = camera[field]
+            num_params = CAMERA_MODELS[int(camera["model_id"])][1]
+            fd.write(header.tobytes())
+            fd.write(camera["params"][:num_params].astype("<f8").tobytes())
+
+
+def write_images_binary(file_path: Path, data: Dict[str, np.ndarray]):
+    """Writes the output of read_images_text() as an images.bin file."""
+    images, offsets = data["images"], data["points2D_offsets"]
+    with open(file_path, "wb") as fd:
+        fd.write(np.array(len(images), dtype=COUNT_DTYPE).tobytes())
+        for idx, image in enumerate(images):
+            start, end = offsets[idx], offsets[idx + 1]
+            points2D = np.zeros(end - start, dtype=POINT2D_DTYPE)
+            points2D["xy"] = data["points2D_xy"][start:end]
+            points2D["point3D_id"] = data["points2D_point3D_ids"][start:end]
+            fd.write(image.astype(IMAGE_DTYPE).tobytes())
+            fd.write(data["names"][idx].encode() + b"\x00")
+            fd.write(np.array(len(points2D), dtype=COUNT_DTYPE).tobytes())
+            fd.write(points2D.tobytes())
+
+
+def write_points3D_binary(file_path: Path, data: Dict[str, np.ndarray]):
+    """Writes the output of read_points3D_text() as a points3D.bin file.
+    Records are scattered into a single buffer, the reverse of
+    read_points3D_binary()."""
+    points, offsets = data["points"], data["track_offsets"]
+    lengths = np.diff(offsets)
+    sizes = POINT_HEADER_DTYPE.itemsize + TRACK_DTYPE.itemsize * lengths
+    starts = to_offsets(sizes)
+    buf = np.zeros(starts[-1], dtype=np.uint8)
+    starts = starts[:-1]
+    headers = np.zeros(len(points), dtype=POINT_HEADER_DTYPE)
+    for field in POINT_DTYPE.names:
+        headers[field] = points[field]
+    headers["track_length"] = lengths
+    buf[starts[:, None] + np.arange(POINT_HEADER_DTYPE.itemsize)] = headers.view(
+        np.uint8
+    ).reshape(-1, POINT_HEADER_DTYPE.itemsize)
+    track = np.zeros(offsets[-1], dtype=TRACK_DTYPE)
+    track["image_id"] = data["track_image_ids"]
+    track["point2D_idx"] = data["track_point2D_idx"]
+    track_starts = _track_starts(
+        starts + POINT_HEADER_DTYPE.itemsize, offsets, TRACK_DTYPE.itemsize
+    )
+    buf[track_starts[:, None] + np.arange(TRACK_DTYPE.itemsize)] = track.view(
+        np.uint8
+    ).reshape(-1, TRACK_DTYPE.itemsize)
+    with open(file_path, "wb") as fd:
+        fd.write(np.array(len(points), dtype=COUNT_DTYPE).tobytes())
+        fd.write(buf.tobytes())
+
+
+###
+#
+# Either format
+#
+###
+
+
+def _reader(file_path: Path, readers: Dict[str, Callable]) -> Dict[str, np.ndarray]:
+    suffix = Path(file_path).suffix
+    if suffix not in readers:
+        raise ValueError(f"{file_path}: not a Colmap model file ({list(readers)})")
+    return readers[suffix](file_path)
+
+
+def read_cameras(file_path: Path) -> Dict[str, np.ndarray]:
+    """Reads a cameras.txt or cameras.bin file, see read_cameras_text()."""
+    return _reader(file_path, {".txt": read_cameras_text, ".bin": read_cameras_binary})
+
+
+def read_images(file_path: Path) -> Dict[str, np.ndarray]:
+    """Reads an images.txt or images.bin file, see read_images_text()."""
+    return _reader(file_path, {".txt": read_images_text, ".bin": read_images_binary})
+
+
+def read_points3D(file_path: Path) -> Dict[str, np.ndarray]:
+    """Reads a points3D.txt or points3D.bin file, see read_points3D_text()."""
+    return _reader(
+        file_path, {".txt": read_points3D_text, ".bin": read_points3D_binary}
+    )
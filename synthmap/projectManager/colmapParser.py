@@ -1,27 +1,38 @@
 # pylint: disable=C0301
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from glob import glob
+import hashlib
+import json
 import os
 from pathlib import Path
+import queue
 import re
 import shutil
 import sqlite3
-from typing import List, Optional
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 
 import numpy as np
 from pydantic import BaseModel, conint
 
 
-from synthmap.db import manager as db_man
+from synthmap.db import covisibility, ingest, manager as db_man
+from synthmap.db.cache import MAX_ENTRIES, project_dbs
 from synthmap.log.logger import getLogger
+from synthmap.models.colmap import MAX_IMAGE_ID, pair_id_ranges
+from synthmap.projectManager import scanner
 
 
 log = getLogger(__name__)
 
-MAX_IMAGE_ID = 2**31 - 1
+# Image pairs with fewer matches aren't considered related
+MIN_MATCHES = 25
+# Images read per query & inserted per statement when digesting a Project
+DIGEST_BATCH_SIZE = 256
 
 
 ###
@@ -48,6 +59,12 @@ def pair_id_to_image_ids(pair_id):
     return int(image_id1), int(image_id2)
 
 
+def pair_ids_to_image_ids(pair_ids: np.ndarray):
+    """Vectorised pair_id_to_image_ids(), returns two arrays of image_ids."""
+    pair_ids = np.asarray(pair_ids, dtype=np.int64)
+    return pair_ids // MAX_IMAGE_ID, pair_ids % MAX_IMAGE_ID
+
+
 def array_to_blob(array: np.ndarray) -> bytes:
     """Serialise any ndarray to bytes."""
     return array.tobytes()
@@ -88,22 +105,27 @@ def get_proj_dirs(proj_path):
     return data
 
 
+MODEL_FILES = ("cameras", "images", "points3D")
+# Colmap writes its sparse models as either
+MODEL_FORMATS = (".bin", ".txt")
+
+
 def get_model_files(project_root_path: Path):
-    file_paths = [
-        Path(i) for i in glob(os.path.join(project_root_path, "*.txt"), recursive=True)
+    """Yields [cameras, images, points3D] file paths for each sparse model found in
+    <project_root_path> or in its sparse/ subdirectories (Colmap's default layout).
+    A model present in both formats is only yielded once, as binary."""
+    candidates = [
+        Path(i)
+        for pattern in ("cameras.*", os.path.join("sparse", "*", "cameras.*"))
+        for i in glob(os.path.join(project_root_path, pattern))
     ]
-    log.debug(f"Found files that could be part of a model {file_paths}")
-    file_tree = defaultdict(list)
-    for fp in file_paths:
-        dirp = fp.parent.absolute()
-        file_tree[dirp].append(fp)
-    for dirp, file_names in file_tree.items():
-        if len(file_names) == 3:
-            model_files = {i.name.replace(".txt", "_path"): i for i in file_names}
-            if set(model_files.keys()) == set(
-                ["cameras_path", "images_path", "points3D_path"]
-            ):
+    log.debug(f"Found files that could be part of a model {candidates}")
+    for dirp in sorted(set(i.parent.absolute() for i in candidates)):
+        for ext in MODEL_FORMATS:
+            file_names = [dirp / f"{i}{ext}" for i in MODEL_FILES]
+            if all(i.is_file() for i in file_names):
                 yield file_names
+                break
 
 
 def update_project_paths(project_path, database_path=None, image_path=None):
@@ -131,9 +153,11 @@ def find_projects(db, paths: List[Path] = list()):
     Creates a Project in <db> for each new one found."""
     projects = []
     for p in paths:
-        q_string = str(p / "**" /"project.ini")
-        log.debug(f"Searching for projects under {q_string}")
-        projects += [get_proj_dirs(i) for i in glob(q_string, recursive=True)]
+        log.debug(f"Searching for projects under {p}")
+        projects += [
+            get_proj_dirs(path) for _, path in scanner.scan(p, kinds=["colmap"])
+        ]
+    projects = [i for i in projects if i]
     log.debug(f"...found {len(projects)} projects")
     for i in projects:
         if not "label" in i:
@@ -148,8 +172,18 @@ def find_projects(db, paths: List[Path] = list()):
     db.commit()
 
 
-def register_project_images(db: sqlite3.Connection, project_id: int, project_path_prefix: Path=None) -> bool:
-    """Attempts to register all images listed in the Project."""
+def register_project_images(
+    db: sqlite3.Connection,
+    project_id: int,
+    project_path_prefix: Path = None,
+    workers: int = None,
+) -> bool:
+    """Attempts to register all images listed in the Project & to index its matches
+    (see index_project_matches()) if that wasn't done yet. The covisibility graph is
+    then updated with the Project's images.
+    Image paths are resolved up front, files already known & unchanged are not read
+    again and the others are hashed over <workers> processes (see ingest.register_images).
+    The new imageFiles are committed along with their projectImages, at once."""
     stmt_get_proj_data = """SELECT db_path, image_path FROM ColmapProjects
         WHERE project_id=?"""
     proj_data = db.execute(stmt_get_proj_data, [project_id]).fetchone()
@@ -158,56 +192,227 @@ def register_project_images(db: sqlite3.Connection, project_id: int, project_pat
         VALUES (?, ?, ?)"""
     if project_path_prefix:
         proj_db_path = project_path_prefix / proj_data["db_path"].replace('\\', '/')
+        image_root = project_path_prefix / Path(proj_data["image_path"].replace('\\', '/'))
     else:
         proj_db_path = proj_data["db_path"].replace('\\', '/')
-    with db_man.mk_conn(proj_db_path, read_only=True) as proj_db:
+        image_root = Path(proj_data["image_path"].replace('\\', '/'))
+    with project_dbs.open(proj_db_path) as proj_db:
         try:
-            num_images = proj_db.execute(
-                "SELECT count(*) AS cnt FROM Images"
-            ).fetchone()["cnt"]
+            num_images = proj_db.count("images")
         except sqlite3.OperationalError:
             return None
+        is_indexed = db.execute(
+            "SELECT 1 FROM projectMatches WHERE project_id=? LIMIT 1", [project_id]
+        ).fetchone()
+        if not is_indexed:
+            index_project_matches(db, project_id, proj_db)
+        if not digests_are_fresh(db, project_id, proj_db):
+            index_project_digests(db, project_id, proj_db)
         num_in_db = db.execute(
             "SELECT count(*) AS cnt FROM projectImages WHERE project_id=?", [project_id]
         ).fetchone()["cnt"]
         if num_in_db >= num_images:
+            if not is_indexed:
+                covisibility.refresh_project(db, project_id)
             return None
-        for row in proj_db.execute("""SELECT image_id, name FROM Images"""):
-            if project_path_prefix:
-                file_path = project_path_prefix / Path(proj_data["image_path"].replace('\\', '/')) / row["name"]
-            else:
-                file_path = Path(proj_data["image_path"].replace('\\', '/')) / row["name"]
-            syn_image_id = db_man.insert_image(db, file_path)
-            db.execute(
-                stmt_add_image_to_project, [syn_image_id, project_id, row["image_id"]]
-            )
-            print(f"Done #{row['image_id']}/{num_images}, global #{syn_image_id}")
+        file_paths = {
+            str(image_root / row["name"]): row["image_id"]
+            for row in proj_db.execute("""SELECT image_id, name FROM Images""")
+        }
+    file_ids = ingest.register_images(db, file_paths.keys(), workers=workers)
+    db.executemany(
+        stmt_add_image_to_project,
+        [
+            [file_id, project_id, file_paths[file_path]]
+            for file_path, file_id in file_ids.items()
+        ],
+    )
+    covisibility.refresh_project(db, project_id)
+    db.commit()
+    log.info(f"Registered {len(file_ids)}/{num_images} Images of Project #{project_id}")
     return True
 
 
+def index_project_matches(
+    db: sqlite3.Connection, project_id: int, proj_db: sqlite3.Connection
+) -> int:
+    """(Re)builds this Project's rows in projectMatches: for each of its images, the
+    pair_id, match & inlier counts linking it to every other image it was matched
+    against. Only reads the pair_id & rows columns of matches & two_view_geometries,
+    never their blobs.
+    Returns the number of indexed pairs."""
+    rows = proj_db.execute(
+        """SELECT matches.pair_id, matches.rows,
+            coalesce(two_view_geometries.rows, 0) AS inliers
+        FROM matches
+        LEFT JOIN two_view_geometries
+        ON two_view_geometries.pair_id = matches.pair_id"""
+    ).fetchall()
+    db.execute("DELETE FROM projectMatches WHERE project_id=?", [project_id])
+    if not rows:
+        return 0
+    pair_ids = np.array([row["pair_id"] for row in rows], dtype=np.int64)
+    counts = [row["rows"] for row in rows]
+    inliers = [row["inliers"] for row in rows]
+    image_ids1, image_ids2 = pair_ids_to_image_ids(pair_ids)
+    image_ids1, image_ids2 = image_ids1.tolist(), image_ids2.tolist()
+    pair_ids = pair_ids.tolist()
+    stmt = """INSERT OR REPLACE INTO projectMatches
+        (project_id, project_image_id, match_image_id, pair_id, rows, inliers)
+        VALUES (?, ?, ?, ?, ?, ?)"""
+    project_ids = [project_id] * len(rows)
+    # Both directions, so either image of a pair finds it through the primary key
+    db.executemany(
+        stmt, zip(project_ids, image_ids1, image_ids2, pair_ids, counts, inliers)
+    )
+    db.executemany(
+        stmt, zip(project_ids, image_ids2, image_ids1, pair_ids, counts, inliers)
+    )
+    log.info(f"Indexed {len(rows)} image pairs of Project #{project_id}")
+    return len(rows)
+
+
+def index_project_digests(
+    db: sqlite3.Connection, project_id: int, proj_db: sqlite3.Connection
+) -> int:
+    """(Re)builds this Project's rows in projectImageDigests: the md5 of each of its
+    images' keypoints & descriptors, read once here so that merges (see
+    ProjectSynthesizer) compare images found in several Projects without loading
+    their blobs. The version of <proj_db> they were read from is recorded in
+    projectDigestSources, see digests_are_fresh().
+    Returns the number of digested images."""
+    db.execute("DELETE FROM projectImageDigests WHERE project_id=?", [project_id])
+    db.execute(
+        "INSERT OR REPLACE INTO projectDigestSources VALUES (?, ?, ?)",
+        [project_id, *proj_db.fingerprint],
+    )
+    cursor = proj_db.execute(
+        """SELECT keypoints.image_id, keypoints.data AS keypoints_data,
+            descriptors.data AS descriptors_data
+        FROM keypoints
+        INNER JOIN descriptors ON descriptors.image_id = keypoints.image_id"""
+    )
+    count = 0
+    for rows in iter(lambda: cursor.fetchmany(DIGEST_BATCH_SIZE), []):
+        db.executemany(
+            """INSERT INTO projectImageDigests
+            (project_id, project_image_id, keypoints_md5, descriptors_md5)
+            VALUES (?, ?, ?, ?)""",
+            [
+                [
+                    project_id,
+                    row["image_id"],
+                    hashlib.md5(row["keypoints_data"] or b"").hexdigest(),
+                    hashlib.md5(row["descriptors_data"] or b"").hexdigest(),
+                ]
+                for row in rows
+            ],
+        )
+        count += len(rows)
+    log.info(f"Digested the features of {count} images of Project #{project_id}")
+    return count
+
+
+def digests_are_fresh(db: sqlite3.Connection, project_id: int, proj_db) -> bool:
+    """Returns whether this Project's digests were read from the current version
+    (mtime & size) of its database, open as <proj_db> (see db.cache.ProjectDB)."""
+    row = db.execute(
+        "SELECT mtime_ns, size FROM projectDigestSources WHERE project_id=?",
+        [project_id],
+    ).fetchone()
+    return row is not None and (row["mtime_ns"], row["size"]) == proj_db.fingerprint
+
+
+def reindex_projects(db: sqlite3.Connection) -> List[int]:
+    """Rebuilds projectMatches & the covisibility graph of every registered
+    ColmapProject, from their own database.
+    Returns the ids of the Projects whose database couldn't be read, those need to
+    be registered again."""
+    cursor = db.cursor()
+    cursor.row_factory = db_man.dict_factory
+    projects = cursor.execute("SELECT project_id, db_path FROM ColmapProjects")
+    unreachable = []
+    for project in projects.fetchall():
+        project_id = project["project_id"]
+        try:
+            with project_dbs.open(project["db_path"].replace("\\", "/")) as proj_db:
+                index_project_matches(db, project_id, proj_db)
+        except sqlite3.Error as e:
+            log.error(
+                f"Could not index the matches of Project #{project_id}, register it "
+                f"again once {project['db_path']} is available: {e}"
+            )
+            unreachable.append(project_id)
+            continue
+        covisibility.refresh_project(db, project_id)
+    return unreachable
+
+
+def get_project_digests(
+    db: sqlite3.Connection, project_id: int, project_image_ids: Iterable[int]
+) -> Dict[int, Tuple[str, str]]:
+    """Returns {project_image_id: (keypoints md5, descriptors md5)} for those of
+    these images that were digested, see index_project_digests()."""
+    return {
+        i["project_image_id"]: (i["keypoints_md5"], i["descriptors_md5"])
+        for i in db.execute(
+            """SELECT project_image_id, keypoints_md5, descriptors_md5
+            FROM projectImageDigests
+            WHERE project_id=?
+            AND project_image_id IN (SELECT value FROM json_each(?))""",
+            [project_id, json.dumps(sorted(set(project_image_ids)))],
+        )
+    }
+
+
+def get_indexed_matches(
+    db: sqlite3.Connection, project_id: int, project_image_id: int, min_rows: int = 0
+) -> List[dict]:
+    """Returns {pair_id, rows, inliers, match_image_id, file_id} for each image of
+    this Project matched to <project_image_id> at least <min_rows> times.
+    See index_project_matches()."""
+    return db.execute(
+        """SELECT pair_id, projectMatches.rows, inliers, match_image_id,
+            projectImages.file_id
+        FROM projectMatches
+        INNER JOIN projectImages
+        ON projectImages.project_id = projectMatches.project_id
+        AND projectImages.project_image_id = projectMatches.match_image_id
+        WHERE projectMatches.project_id=? AND projectMatches.project_image_id=?
+        AND projectMatches.rows >= ?""",
+        [project_id, project_image_id, min_rows],
+    ).fetchall()
+
+
 def list_image_matches(
     db: sqlite3.Connection, image_id: int, kp_pos_only: bool = False
 ):
     """Returns this Image's keypoints and all its matches.
     <kp_pos_only> toggles whether to include each keypoint's orientation/scale
     parameters.
+    Only the match blobs involving this Image are read, as found in projectMatches.
 
     Return format -> (matches, keypoints)
         matches = {project_id: {image2_global_id: {data: np.ndarray}}}
         keypoints = {project_id: {data: np.ndarray}}
     """
-    stmt = """SELECT * FROM projectImages
-    INNER JOIN Projects 
-    ON Projects.id = projectImages.project_id
+    stmt = """SELECT projectImages.project_id, project_image_id, db_path
+    FROM projectImages
+    INNER JOIN ColmapProjects
+    ON ColmapProjects.project_id = projectImages.project_id
     WHERE file_id=?"""
-    stmt_get_g_img_id = """SELECT file_id FROM projectImages
-    WHERE project_image_id=? AND project_id=?"""
     matches = defaultdict(dict)
     keypoints = dict()
-    for project_data in db.execute(stmt, [image_id]):
+    for project_data in db.execute(stmt, [image_id]).fetchall():
         project_id = project_data["project_id"]
         project_image_id = project_data["project_image_id"]
-        with db_man.mk_conn(project_data["db_path"], read_only=True) as proj_db:
+        pair_file_ids = {
+            row["pair_id"]: row["file_id"]
+            for row in get_indexed_matches(
+                db, project_id, project_image_id, MIN_MATCHES
+            )
+        }
+        with project_dbs.open(project_data["db_path"]) as proj_db:
             kps = proj_db.execute(
                 """SELECT rows, cols, data FROM Keypoints WHERE image_id=?""",
                 [project_image_id],
@@ -221,26 +426,17 @@ def list_image_matches(
             else:
                 kps["data"] = data.tolist()
             keypoints[project_id] = kps
-            for row in proj_db.execute("""SELECT pair_id, rows, data FROM matches"""):
-                i1, i2 = pair_id_to_image_ids(row["pair_id"])
-                if not project_image_id in [i1, i2] or row["rows"] < 25:
-                    continue
-                data = {
+            for row in proj_db.execute(
+                """SELECT pair_id, rows, data FROM matches
+                WHERE pair_id IN (SELECT value FROM json_each(?))""",
+                [json.dumps(list(pair_file_ids))],
+            ):
+                matches[project_id][pair_file_ids[row["pair_id"]]] = {
                     "rows": row["rows"],
                     "data": blob_to_array(
-                        row["data"], dtype=int, shape=(-1, 2)
+                        row["data"], dtype=np.uint32, shape=(-1, 2)
                     ).tolist(),
                 }
-                if project_image_id == i1:
-                    i2_id = db.execute(stmt_get_g_img_id, [i2, project_id]).fetchone()[
-                        "image_id"
-                    ]
-                    matches[project_id][i2_id] = data
-                elif project_image_id == i2:
-                    i1_id = db.execute(stmt_get_g_img_id, [i1, project_id]).fetchone()[
-                        "image_id"
-                    ]
-                    matches[project_id][i1_id] = data
     return dict(matches), keypoints
 
 
@@ -257,48 +453,32 @@ def list_project_matches(db, project_id):
 
 
 def list_project_matches_old(db, project_id, file_id):
-    stmt_get_g_img_id = """SELECT file_id FROM projectImages
-    WHERE project_image_id=? AND project_id=?"""
-    proj_data = db.execute(
-        """SELECT db_path, image_path FROM ColmapProjects
-        WHERE project_id=?""",
-        [project_id],
-    ).fetchone()
+    """Returns the file_ids of every Image matched to this one in this Project.
+    See index_project_matches()."""
     proj_image_id = db.execute(
         """SELECT project_image_id FROM projectImages
     WHERE file_id=? AND project_id=?""",
         [file_id, project_id],
     ).fetchone()["project_image_id"]
-    ret = []
-    with mk_conn(proj_data["db_path"], read_only=True) as proj_db:
-        for row in proj_db.execute("""SELECT pair_id FROM matches"""):
-            i1, i2 = pair_id_to_image_ids(row["pair_id"])
-            if proj_image_id == i1:
-                i2_id = db.execute(stmt_get_g_img_id, [i2, project_id]).fetchone()[
-                    "file_id"
-                ]
-                ret.append(i2_id)
-            elif proj_image_id == i2:
-                i1_id = db.execute(stmt_get_g_img_id, [i1, project_id]).fetchone()[
-                    "file_id"
-                ]
-                ret.append(i1_id)
-    return ret
+    return [
+        row["file_id"] for row in get_indexed_matches(db, project_id, proj_image_id)
+    ]
 
 
 def get_image_descriptors(db, file_id):
     """Returns single set of Descriptors for this Image, as stored in the
     first (in terms of project_id) Project."""
     proj_data = db.execute(
-        """SELECT min(project_id) AS project_id,
-            projectImages.project_image_id, Projects.file_path,
-            Projects.db_path, Projects.image_path
+        """SELECT min(projectImages.project_id) AS project_id,
+            projectImages.project_image_id,
+            ColmapProjects.db_path, ColmapProjects.image_path
         FROM projectImages
-        INNER JOIN Projects ON projectImages.project_id=Projects.id
+        INNER JOIN ColmapProjects
+        ON projectImages.project_id=ColmapProjects.project_id
         WHERE file_id=?""",
         [file_id],
     ).fetchone()
-    with db_man.mk_conn(proj_data["db_path"], read_only=True) as proj_db:
+    with project_dbs.open(proj_data["db_path"]) as proj_db:
         descriptor = proj_db.execute(
             """SELECT * FROM Descriptors WHERE image_id=?""",
             [proj_data["project_image_id"]],
@@ -319,7 +499,8 @@ class RelatedImagesItem(BaseModel):
 
 
 def get_entity_related_images(db, entity_id: int) -> List[RelatedImagesItem]:
-    """Returns basic information for all Images matching this Image."""
+    """Returns basic information for all Images matching this Entity's Images, as
+    found in the covisibility graph."""
     # FIXME: Will break as soon as Image.image_id != imageFile.file_id
     # JOIN imageFiles.file_id through Images
     # see dbman.get_entity_images()
@@ -329,59 +510,36 @@ def get_entity_related_images(db, entity_id: int) -> List[RelatedImagesItem]:
             "SELECT image_id FROM imageEntities WHERE entity_id=?", [entity_id]
         )
     ]
-    related_images = set(registered_images)
-    print("Collecting related images...\nproj#\timg#\tcnt\ttotal")
-    for image_id in registered_images:
-        project_ids = [
-            i["project_id"]
-            for i in db.execute(
-                "SELECT project_id FROM projectImages WHERE file_id = ?", [image_id]
-            )
-        ]
-        for project_id in project_ids:
-            matches = list_project_matches_old(db, project_id, image_id)
-            related_images = related_images.union(matches)
-            print(
-                "{}\t{}\t{}\t{}".format(
-                    project_id, image_id, len(matches), len(related_images)
-                )
-            )
-    related_data = []
-    for image_id in related_images:
-        related_data.extend(
-            db.execute(
-                """SELECT projectImages.file_id as file_id,
+    related_images = covisibility.expand(db, registered_images, hops=1)
+    log.info(
+        f"Entity #{entity_id}: {len(related_images)} related images"
+        f" from {len(registered_images)} registered"
+    )
+    related_data = db.execute(
+        """SELECT projectImages.file_id as file_id,
         project_id, project_image_id, file_path
         FROM projectImages
         INNER JOIN imageFiles ON projectImages.file_id=imageFiles.file_id
-        WHERE projectImages.file_id=?""",
-                [image_id],
-            ).fetchall()
-        )
+        WHERE projectImages.file_id IN (SELECT value FROM json_each(?))""",
+        [json.dumps(list(related_images))],
+    ).fetchall()
     return sorted(related_data, key=lambda x: x["project_id"])
 
 
-def get_imageset_data(db, project_id: int, file_ids: list):
-    """Returns each row of the Project's Match data linking Images listed in
-    <image_ids>."""
-    gid2pid = (
-        lambda file_id: db.execute(
-            """SELECT project_image_id FROM projectImages
-    WHERE file_id=? AND project_id=?""",
-            [file_id, project_id],
-        )
-        .fetchone()
-        .get("project_image_id")
-    )
-    proj_data = db.execute(
-        """SELECT file_path, db_path, image_path FROM Projects WHERE id=?""",
-        [project_id],
-    ).fetchone()
-    proj_image_id_set = set([gid2pid(i) for i in file_ids])
-    print("\t", proj_data["db_path"])
-    with db_man.mk_conn(proj_data["db_path"], read_only=True) as proj_db:
-        img_ids_str = ", ".join(map(str, proj_image_id_set))
-        stmt = """SELECT images.image_id AS project_image_id, images.name, images.camera_id, images.prior_qw, images.prior_qx, images.prior_qy, images.prior_qz, images.prior_tx, images.prior_ty, images.prior_tz,
+###
+#
+# Entity Project synthesis
+#
+###
+
+# Rows written to a synthesized Project database per transaction
+SYNTH_BATCH_SIZE = 256
+# Rows buffered between the Project readers & the synthesized database writer
+SYNTH_QUEUE_SIZE = 256
+# Written next to a synthesized Project's database.db, see extend_entity_project()
+ENTITY_SIDECAR = "entity.json"
+
+IMAGESET_IMAGES_STMT = """SELECT images.image_id AS project_image_id, images.name, images.camera_id, images.prior_qw, images.prior_qx, images.prior_qy, images.prior_qz, images.prior_tx, images.prior_ty, images.prior_tz,
     cameras.model, cameras.width, cameras.height, cameras.params, cameras.prior_focal_length,
     keypoints.rows AS keypoints_rows, keypoints.cols AS keypoints_cols, keypoints.data AS keypoints_data,
     descriptors.rows AS descriptors_rows, descriptors.cols AS descriptors_cols, descriptors.data AS descriptors_data
@@ -389,20 +547,182 @@ def get_imageset_data(db, project_id: int, file_ids: list):
     INNER JOIN cameras on images.camera_id = cameras.camera_id
     INNER JOIN keypoints on keypoints.image_id = images.image_id
     INNER JOIN descriptors on descriptors.image_id = images.image_id
-    WHERE images.image_id in ({})""".format(
-            img_ids_str
-        )
-        images = proj_db.execute(stmt).fetchall()
-        matches = []
-        for row in proj_db.execute(
-            """SELECT matches.pair_id, matches.rows AS matches_rows, matches.cols AS matches_cols, matches.data AS matches_data,
+    WHERE images.image_id IN (SELECT value FROM json_each(?))
+    ORDER BY images.image_id"""
+# Pairs of the image set: one pair_id range per image (see pair_id_ranges()) walks
+# the primary key, the second image is then checked against the set
+IMAGESET_MATCHES_STMT = f"""SELECT matches.pair_id, matches.rows AS matches_rows, matches.cols AS matches_cols, matches.data AS matches_data,
     two_view_geometries.rows AS two_view_geometries_rows, two_view_geometries.cols AS two_view_geometries_cols, two_view_geometries.data AS two_view_geometries_data, two_view_geometries.config, two_view_geometries.F, two_view_geometries.E, two_view_geometries.H
-    FROM matches
-    INNER JOIN two_view_geometries ON matches.pair_id = two_view_geometries.pair_id"""
-        ):
-            id1, id2 = pair_id_to_image_ids(row["pair_id"])
-            if id1 in proj_image_id_set and id2 in proj_image_id_set:
-                matches.append([id1, id2, row])
+    FROM json_each(?) AS ranges
+    INNER JOIN matches
+    ON matches.pair_id BETWEEN json_extract(ranges.value, '$[0]')
+    AND json_extract(ranges.value, '$[1]')
+    INNER JOIN two_view_geometries ON matches.pair_id = two_view_geometries.pair_id
+    WHERE matches.pair_id % {MAX_IMAGE_ID} IN (SELECT value FROM json_each(?))"""
+# Only the pairs of the image set including at least one of the new images
+IMAGESET_NEW_MATCHES_STMT = f"""{IMAGESET_MATCHES_STMT}
+    AND (matches.pair_id / {MAX_IMAGE_ID} IN (SELECT value FROM json_each(?3))
+        OR matches.pair_id % {MAX_IMAGE_ID} IN (SELECT value FROM json_each(?3)))"""
+SYNTH_IMAGE_STMTS = [
+    """INSERT INTO images
+    (image_id, name, camera_id, prior_qw, prior_qx, prior_qy, prior_qz, prior_tx, prior_ty, prior_tz)
+    VALUES (:image_id, :name, :camera_id, :prior_qw, :prior_qx, :prior_qy, :prior_qz, :prior_tx, :prior_ty, :prior_tz)""",
+    """INSERT INTO cameras
+    (camera_id, model, width, height, params, prior_focal_length)
+    VALUES (:camera_id, :model, :width, :height, :params, :prior_focal_length)""",
+    """INSERT INTO keypoints
+    (image_id, rows, cols, data)
+    VALUES (:image_id, :keypoints_rows, :keypoints_cols, :keypoints_data)""",
+    """INSERT INTO descriptors
+    (image_id, rows, cols, data)
+    VALUES (:image_id, :descriptors_rows, :descriptors_cols, :descriptors_data)""",
+]
+SYNTH_MATCH_STMTS = [
+    """INSERT OR IGNORE INTO matches
+    (pair_id, cols, rows, data)
+    VALUES (:pair_id, :matches_cols, :matches_rows, :matches_data)""",
+    """INSERT OR IGNORE INTO two_view_geometries
+    (pair_id, cols, rows, data, config, F, E, H)
+    VALUES (:pair_id, :two_view_geometries_cols, :two_view_geometries_rows, :two_view_geometries_data, :config, :F, :E, :H)""",
+]
+# Overwriting a pair first provided by a Project of lower precedence
+SYNTH_MATCH_REPLACE_STMTS = [
+    i.replace("INSERT OR IGNORE", "INSERT OR REPLACE") for i in SYNTH_MATCH_STMTS
+]
+
+
+def iter_imageset_images(proj_db, project_image_ids: Iterable[int]) -> Iterator[dict]:
+    """Yields the image, camera, keypoints & descriptors data of each of these
+    Images of an open Project database, one row at a time."""
+    yield from proj_db.execute(
+        IMAGESET_IMAGES_STMT, [json.dumps(sorted(set(project_image_ids)))]
+    )
+
+
+def iter_imageset_matches(
+    proj_db,
+    project_image_ids: Iterable[int],
+    new_image_ids: Iterable[int] = None,
+    batch_size: int = SYNTH_BATCH_SIZE,
+) -> Iterator[Tuple[int, int, dict]]:
+    """Yields (image_id1, image_id2, matches & two view geometry data) for each
+    pair of these Images of an open Project database, one row at a time.
+    Only the pairs made of two of them are read, see IMAGESET_MATCHES_STMT. With
+    <new_image_ids>, only those including at least one of them."""
+    project_image_ids = sorted(set(int(i) for i in project_image_ids))
+    if new_image_ids is None:
+        cursor = proj_db.execute(
+            IMAGESET_MATCHES_STMT,
+            [
+                json.dumps(pair_id_ranges(project_image_ids)),
+                json.dumps(project_image_ids),
+            ],
+        )
+    else:
+        new_image_ids = sorted(set(int(i) for i in new_image_ids))
+        cursor = proj_db.execute(
+            IMAGESET_NEW_MATCHES_STMT,
+            [
+                json.dumps(pair_id_ranges(project_image_ids, new_image_ids)),
+                json.dumps(project_image_ids),
+                json.dumps(new_image_ids),
+            ],
+        )
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        ids1, ids2 = pair_ids_to_image_ids([row["pair_id"] for row in rows])
+        yield from zip(ids1.tolist(), ids2.tolist(), rows)
+
+
+def get_project_image_ids(db, project_id: int, file_ids: Iterable[int]) -> dict:
+    """Returns {file_id: project_image_id} for those of <file_ids> that are part
+    of this Project."""
+    return {
+        i["file_id"]: i["project_image_id"]
+        for i in db.execute(
+            """SELECT file_id, project_image_id FROM projectImages
+            WHERE project_id=? AND file_id IN (SELECT value FROM json_each(?))""",
+            [project_id, json.dumps(sorted(set(file_ids)))],
+        )
+    }
+
+
+def stream_projects(
+    read_fn: Callable,
+    sources: List[Tuple[int, str, Iterable[int]]],
+    workers: int = None,
+    queue_size: int = SYNTH_QUEUE_SIZE,
+) -> Iterator[Tuple[int, object]]:
+    """Yields (project_id, item) for each item of read_fn(proj_db, project_image_ids,
+    *args) (see iter_imageset_*()) over every (project_id, db_path,
+    project_image_ids, *args) of <sources>, in arrival order.
+    Each Project is read by its own thread (up to <workers>, their databases being
+    independent files), feeding a queue of at most <queue_size> items consumed by
+    the caller. Runs in the caller's thread when <workers> is 1 (or 0)."""
+    if workers is not None and workers <= 1:
+        for project_id, db_path, project_image_ids, *args in sources:
+            with project_dbs.open(db_path) as proj_db:
+                for item in read_fn(proj_db, project_image_ids, *args):
+                    yield project_id, item
+        return
+    # Keep every open Project database in the cache while it is read
+    workers = min(workers or MAX_ENTRIES, MAX_ENTRIES)
+    items = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    finished = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def reader(project_id, db_path, project_image_ids, *args):
+        try:
+            with project_dbs.open(db_path) as proj_db:
+                for item in read_fn(proj_db, project_image_ids, *args):
+                    if not put((project_id, item, None)):
+                        return
+        except Exception as e:
+            put((project_id, None, e))
+        else:
+            put((project_id, finished, None))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for source in sources:
+            pool.submit(reader, *source)
+        try:
+            remaining = len(sources)
+            while remaining:
+                project_id, item, error = items.get()
+                if error is not None:
+                    raise error
+                if item is finished:
+                    remaining -= 1
+                    continue
+                yield project_id, item
+        finally:
+            # Unblocks the readers if the caller gave up early
+            stop.set()
+
+
+def get_imageset_data(db, project_id: int, file_ids: list):
+    """Returns each row of the Project's Match data linking Images listed in
+    <image_ids>."""
+    proj_data = db.execute(
+        """SELECT db_path, image_path FROM ColmapProjects WHERE project_id=?""",
+        [project_id],
+    ).fetchone()
+    proj_image_id_set = set(get_project_image_ids(db, project_id, file_ids).values())
+    log.debug(f"Reading {len(proj_image_id_set)} Images from {proj_data['db_path']}")
+    with project_dbs.open(proj_data["db_path"]) as proj_db:
+        images = list(iter_imageset_images(proj_db, proj_image_id_set))
+        matches = [list(i) for i in iter_imageset_matches(proj_db, proj_image_id_set)]
     return {
         "images": {row["project_image_id"]: row for row in images},
         "matches": matches,
@@ -425,28 +745,200 @@ def init_db(temp_db):
     ]
 
 
-# TODO: select existing images from project, don't reinsert
-# existing_ids = []
-# related = get_entity_related_images(db, query_entity_id, exclude=existing_ids)
-def create_entity_project(db, query_entity_id: int, output_path="C:\\data\\"):
-    """Synthesize a Colmap Project from available data"""
-    output_dir = os.path.join(output_path, str(query_entity_id))
-    if os.path.exists(output_dir):
-        print(
-            "Entity #{} already has a directory, try colmapParser.extend_entity_project()".format(
-                query_entity_id
-            )
+class ProjectSynthesizer:
+    """Writes a new Colmap project database out of Images taken from several
+    Projects, row by row as they are read: only id mappings stay in memory.
+
+    Every Image is first planned (see plan_image()) from its feature digests, which
+    assigns its id & tells which Project's copy is written. Their data is then
+    added, and only then their matches. Projects take precedence in the order they
+    are first planned: a pair found in several of them is always taken from the
+    first, whatever order their matches arrive in.
+    The database is built in <db_path>.tmp without journal nor fsync, and only
+    moved to <db_path> by close(): a crash never leaves a half written project.
+
+    With <existing> ({file_id: (image_id, feature digests)}), the database already
+    at <db_path> is extended instead: those Images keep their ids & data. Rows are
+    then appended in place, rather than to a copy of a possibly large file, within
+    a single (journaled) transaction that only close() commits."""
+
+    def __init__(
+        self,
+        db_path,
+        batch_size: int = SYNTH_BATCH_SIZE,
+        existing: Dict[int, Tuple[int, tuple]] = None,
+    ):
+        self.db_path = Path(db_path)
+        self.tmp_path = Path(f"{db_path}.tmp")
+        self.tmp_path.unlink(missing_ok=True)
+        self.batch_size = batch_size
+        self.extending = existing is not None
+        if self.extending:
+            self.db = sqlite3.connect(self.db_path)
+            self.db.execute("BEGIN")
+        else:
+            self.db = sqlite3.connect(self.tmp_path)
+            self.db.execute("PRAGMA journal_mode=OFF")
+            self.db.execute("PRAGMA synchronous=OFF")
+            init_db(self.db)
+        # {project_id: {project_image_id: new image_id}}
+        self.new_ids = defaultdict(dict)
+        # {file_id: (new image_id, feature digests)}
+        self.owners = {}
+        self.conflicts = set()
+        self.written = set()
+        self.kept = set()
+        # {project_id: precedence}, {pair_id: precedence of the Project it's from}
+        self.ranks = {}
+        self.pair_ranks = {}
+        for file_id, (image_id, digests) in (existing or {}).items():
+            self.owners[file_id] = (image_id, tuple(digests))
+            self.written.add(image_id)
+            self.kept.add(image_id)
+        (self.last_id,) = self.db.execute(
+            "SELECT coalesce(max(image_id), 0) FROM images"
+        ).fetchone()
+        self.pending = 0
+        self.counts = defaultdict(int)
+
+    def _written(self, table: str):
+        self.counts[table] += 1
+        self.pending += 1
+        if self.pending >= self.batch_size and not self.extending:
+            self.db.commit()
+            self.pending = 0
+
+    def _delete_image(self, new_id: int):
+        for table, column in [
+            ("images", "image_id"),
+            ("cameras", "camera_id"),
+            ("keypoints", "image_id"),
+            ("descriptors", "image_id"),
+        ]:
+            self.db.execute(f"DELETE FROM {table} WHERE {column}=?", [new_id])
+
+    def _drop_image(self, file_id: int, reason: str):
+        log.warning(f"Synthesis: dropping imageFile #{file_id}, {reason}")
+        self.conflicts.add(file_id)
+        if file_id not in self.owners:
+            return
+        new_id, _ = self.owners.pop(file_id)
+        if new_id in self.written:
+            self._delete_image(new_id)
+            self.written.remove(new_id)
+            self.counts["images"] -= 1
+        for project_ids in self.new_ids.values():
+            for project_image_id in [k for k, v in project_ids.items() if v == new_id]:
+                del project_ids[project_image_id]
+
+    def plan_image(
+        self, project_id: int, project_image_id: int, file_id: int, digests: tuple
+    ) -> bool:
+        """Assigns this Image its id in the new database, unless another Project
+        already provided it. Returns whether this copy must be written, see
+        add_image().
+        Images whose feature <digests> (see get_project_digests()) differ between
+        Projects are dropped from all of them."""
+        self.ranks.setdefault(project_id, len(self.ranks))
+        if file_id in self.conflicts:
+            return False
+        if file_id in self.owners:
+            new_id, owner_digests = self.owners[file_id]
+            if tuple(digests) != owner_digests and new_id in self.kept:
+                log.warning(
+                    f"Synthesis: Project #{project_id} has different features for "
+                    f"imageFile #{file_id}, keeping the existing ones"
+                )
+                return False
+            if tuple(digests) != owner_digests:
+                self._drop_image(file_id, "Projects have different features")
+                return False
+            self.new_ids[project_id][project_image_id] = new_id
+            return False
+        self.last_id += 1
+        self.owners[file_id] = (self.last_id, tuple(digests))
+        self.new_ids[project_id][project_image_id] = self.last_id
+        return True
+
+    def add_image(
+        self, project_id: int, row: dict, name_prefix: str = ""
+    ) -> Optional[int]:
+        """Writes the data of a planned Image (see iter_imageset_images()).
+        Returns its id in the new database, None if it isn't part of it."""
+        new_id = self.new_ids[project_id].get(row["project_image_id"])
+        if new_id is None or new_id in self.written:
+            return None
+        data = dict(
+            row,
+            image_id=new_id,
+            camera_id=new_id,
+            name=os.path.join(name_prefix, row["name"]),
         )
+        try:
+            for stmt in SYNTH_IMAGE_STMTS:
+                self.db.execute(stmt, data)
+        except sqlite3.IntegrityError as e:
+            self._delete_image(new_id)
+            file_id = next(k for k, v in self.owners.items() if v[0] == new_id)
+            self._drop_image(file_id, str(e))
+            return None
+        self.written.add(new_id)
+        self._written("images")
+        return new_id
 
-    related = get_entity_related_images(db, query_entity_id)
+    def add_match(self, project_id: int, id1: int, id2: int, row: dict) -> bool:
+        """Writes this pair's matches & geometry (see iter_imageset_matches()),
+        unless one of its Images wasn't written or the pair already exists, either
+        in an extended database or from a Project of higher precedence."""
+        new_ids = self.new_ids[project_id]
+        new_id1, new_id2 = new_ids.get(id1), new_ids.get(id2)
+        if new_id1 not in self.written or new_id2 not in self.written:
+            return False
+        data = dict(row, pair_id=image_ids_to_pair_id(new_id1, new_id2))
+        rank = self.ranks.setdefault(project_id, len(self.ranks))
+        previous = self.pair_ranks.get(data["pair_id"])
+        if previous is not None:
+            if previous <= rank:
+                return False
+            for stmt in SYNTH_MATCH_REPLACE_STMTS:
+                self.db.execute(stmt, data)
+            self.pair_ranks[data["pair_id"]] = rank
+            return True
+        if not self.db.execute(SYNTH_MATCH_STMTS[0], data).rowcount:
+            return False
+        self.db.execute(SYNTH_MATCH_STMTS[1], data)
+        self.pair_ranks[data["pair_id"]] = rank
+        self._written("matches")
+        return True
 
-    image_graph = defaultdict(lambda: defaultdict(int))
-    project_count = defaultdict(list)
+    def close(self, commit: bool = True) -> Optional[Path]:
+        """Moves the finished database to <db_path> (commits the appended rows when
+        extending it) and returns it, or discards it."""
+        if commit:
+            self.db.commit()
+        self.db.close()
+        if not commit:
+            self.tmp_path.unlink(missing_ok=True)
+            return None
+        if not self.extending:
+            os.replace(self.tmp_path, self.db_path)
+        log.info(
+            f"Synthesized {self.db_path}: {self.counts['images']} images, "
+            f"{self.counts['matches']} pairs, {len(self.conflicts)} dropped"
+        )
+        return self.db_path
+
+
+def _synthesize_images(
+    db, synth: ProjectSynthesizer, related: list, image_root: str, workers: int = None
+):
+    """Plans, then writes with <synth> the <related> Images (see
+    get_entity_related_images()) and their matches, Image names being relative to
+    <image_root>."""
+    # {project_id: {project_image_id: file_id}}
+    image_graph = defaultdict(dict)
     for row in related:
-        image_id, project_id, project_image_id, file_path = row.values()
-        image_graph[project_id][image_id] = project_image_id
-        project_count[image_id] += [project_id]
-    image_graph = {k: dict(v) for k, v in image_graph.items() if len(v)}
+        image_graph[row["project_id"]][row["project_image_id"]] = row["file_id"]
     stmt_proj_data = """SELECT db_path, image_path
     FROM ColmapProjects WHERE project_id=?"""
     project_data = {
@@ -456,124 +948,146 @@ def create_entity_project(db, query_entity_id: int, output_path="C:\\data\\"):
         ).fetchone()
         for project_id in image_graph.keys()
     }
-
-    new_image_dir = os.path.commonprefix(
-        [i["image_path"] for i in project_data.values()]
-    )
     image_dir_offsets = {
-        k: os.path.relpath(v["image_path"], start=new_image_dir)
+        k: os.path.relpath(v["image_path"], start=image_root)
         for k, v in project_data.items()
     }
-    print("New image root directory is {}".format(new_image_dir))
+    # Largest Projects first: they provide the Images they share with others, and
+    # take longest to read
+    sources = [
+        (project_id, project_data[project_id]["db_path"], file_ids)
+        for project_id, file_ids in sorted(
+            image_graph.items(), key=lambda x: len(x[1]), reverse=True
+        )
+    ]
+    # Only the copies to write are read, shared Images are compared by digest
+    to_read = []
+    for project_id, db_path, file_ids in sources:
+        digests = get_project_digests(db, project_id, file_ids)
+        with project_dbs.open(db_path) as proj_db:
+            # Registered before digests were cached, or its database changed since
+            if not digests or not digests_are_fresh(db, project_id, proj_db):
+                index_project_digests(db, project_id, proj_db)
+                digests = get_project_digests(db, project_id, file_ids)
+        owned = []
+        for project_image_id, file_id in file_ids.items():
+            image_digests = digests.get(project_image_id)
+            if image_digests and synth.plan_image(
+                project_id, project_image_id, file_id, image_digests
+            ):
+                owned.append(project_image_id)
+        to_read.append((project_id, db_path, owned))
+    for project_id, row in stream_projects(iter_imageset_images, to_read, workers):
+        synth.add_image(project_id, row, image_dir_offsets[project_id])
+    log.info("Synthesis: extracted Image data, starting matches")
+    if synth.kept:
+        # Extending: pairs of Images already in the database were written then
+        new_ids = {
+            project_id: [k for k, v in ids.items() if v not in synth.kept]
+            for project_id, ids in synth.new_ids.items()
+        }
+        sources = [(*source, new_ids.get(source[0], [])) for source in sources]
+    for project_id, match in stream_projects(iter_imageset_matches, sources, workers):
+        synth.add_match(project_id, *match)
 
-    image_data = {}
-    for project_id, images in sorted(
-        image_graph.items(), key=lambda x: len(x[1]), reverse=True
-    ):
-        image_data[project_id] = get_imageset_data(
-            db,
-            project_id,
-            [i["image_id"] for i in related if i["project_id"] == project_id],
+
+def _write_entity_sidecar(
+    output_dir: str, entity_id: int, image_root: str, synth: ProjectSynthesizer
+):
+    """Records which imageFile each Image of the synthesized Project comes from."""
+    sidecar = {
+        "entity_id": entity_id,
+        "image_root": image_root,
+        "updated": str(datetime.now()),
+        "images": {
+            str(file_id): {
+                "image_id": image_id,
+                "keypoints_md5": digests[0],
+                "descriptors_md5": digests[1],
+            }
+            for file_id, (image_id, digests) in sorted(synth.owners.items())
+        },
+    }
+    sidecar_path = os.path.join(output_dir, ENTITY_SIDECAR)
+    with open(f"{sidecar_path}.tmp", "w") as fd:
+        json.dump(sidecar, fd, indent=2)
+    os.replace(f"{sidecar_path}.tmp", sidecar_path)
+
+
+def create_entity_project(
+    db, query_entity_id: int, output_path="C:\\data\\", workers: int = None
+) -> Optional[Path]:
+    """Synthesize a Colmap Project from available data, streamed straight into
+    <output_path>/<query_entity_id>/database.db (see ProjectSynthesizer).
+    Source Projects are read concurrently over <workers> threads, see
+    stream_projects(). Returns that path, None if the directory already exists.
+    The directory is removed again if synthesis fails."""
+    output_dir = os.path.join(output_path, str(query_entity_id))
+    if os.path.exists(output_dir):
+        log.warning(
+            f"Entity #{query_entity_id} already has a directory {output_dir}, try "
+            "colmapParser.extend_entity_project()"
         )
-    print("Starting project database...")
-    with sqlite3.connect(":memory:") as temp_db:
-        init_db(temp_db)
-
-        new_idxs = defaultdict(dict)
-        excluded = defaultdict(dict)
-        skip = defaultdict(list)
-        new_idx = 0
-        for row in related:
-            image_id, project_id, project_image_id, file_path = row.values()
-            if project_image_id in excluded[project_id]:
-                print("Found previously excluded image #{}".format(image_id))
-                continue
-            elif len(project_count[image_id]) > 1:
-                # Find out if each project's descriptors are the same
-                descriptors = set()
-                _p_i_ids = dict()
-                for _project_id in project_count[image_id]:
-                    p_img_id = image_graph[_project_id][image_id]
-                    _p_i_ids[_project_id] = p_img_id
-                    descriptors.add(
-                        image_data[_project_id]["images"][p_img_id]["descriptors_data"]
-                    )
-                    excluded[_project_id][p_img_id] = [project_id, project_image_id]
-                if len(descriptors) > 1:
-                    print(
-                        "Problem: Found {} different descriptors for image #{}. Projects #{}".format(
-                            len(descriptors),
-                            image_id,
-                            ", ".join(project_count[image_id]),
-                        )
-                    )
-                    for k, v in _p_i_ids:
-                        skip[k].append(v)
-                    continue
-            new_idx += 1
-            new_idxs[project_id][project_image_id] = new_idx
-            data = image_data[project_id]["images"][project_image_id]
-            data["image_id"] = new_idx
-            data["camera_id"] = new_idx
-            data["name"] = os.path.join(image_dir_offsets[project_id], data["name"])
-            try:
-                for stmt in [
-                    """INSERT INTO images
-    (image_id, name, camera_id, prior_qw, prior_qx, prior_qy, prior_qz, prior_tx, prior_ty, prior_tz)
-    VALUES (:image_id, :name, :camera_id, :prior_qw, :prior_qx, :prior_qy, :prior_qz, :prior_tx, :prior_ty, :prior_tz)""",
-                    """INSERT INTO cameras
-    (camera_id, model, width, height, params, prior_focal_length)
-    VALUES (:camera_id, :model, :width, :height, :params, :prior_focal_length)""",
-                    """INSERT INTO keypoints
-    (image_id, rows, cols, data)
-    VALUES (:image_id, :keypoints_rows, :keypoints_cols, :keypoints_data)""",
-                    """INSERT INTO descriptors
-    (image_id, rows, cols, data)
-    VALUES (:image_id, :descriptors_rows, :descriptors_cols, :descriptors_data)""",
-                ]:
-                    temp_db.execute(stmt, data)
-            except sqlite3.IntegrityError:
-                continue
-        print("Extracted Image data, starting matches...")
-        # Insert matches with new_idxs
-        for project_id, items in image_data.items():
-            for match in items["matches"]:
-                id1, id2, match_data = match
-                if id1 in skip[project_id] or id2 in skip[project_id]:
-                    continue
-                if id1 in excluded[project_id]:
-                    _p_id, _p_i_id = excluded[project_id][id1]
-                    new_id1 = new_idxs[_p_id][_p_i_id]
-                else:
-                    new_id1 = new_idxs[project_id][id1]
-                if id2 in excluded[project_id]:
-                    _p_id, _p_i_id = excluded[project_id][id2]
-                    new_id2 = new_idxs[_p_id][_p_i_id]
-                else:
-                    new_id2 = new_idxs[project_id][id2]
-                new_pair_id = str(image_ids_to_pair_id(new_id1, new_id2))
-                match_data["pair_id"] = new_pair_id
-                # print('Match data:', id1,id2, new_id1, new_id2, new_pair_id)
-                try:
-                    temp_db.execute(
-                        """INSERT INTO matches
-    (pair_id, cols, rows, data)
-    VALUES (:pair_id, :matches_cols, :matches_rows, :matches_data)""",
-                        match_data,
-                    )
-                    temp_db.execute(
-                        """INSERT INTO two_view_geometries
-    (pair_id, cols, rows, data, config, F, E, H)
-    VALUES (:pair_id, :two_view_geometries_cols, :two_view_geometries_rows, :two_view_geometries_data, :config, :F, :E, :H)""",
-                        match_data,
-                    )
-                except sqlite3.IntegrityError:
-                    continue
-        temp_db.commit()
-        print("Done extracting!")
-        # Create output dir
-        os.mkdir(output_dir)
-        with sqlite3.connect(os.path.join(output_dir, "main.db")) as out_db:
-            temp_db.backup(out_db)
-            out_db.commit()
-        print("Done writing to disk! ({})".format(output_dir))
+        return None
+
+    related = get_entity_related_images(db, query_entity_id)
+    image_paths = db.execute(
+        """SELECT image_path FROM ColmapProjects
+        WHERE project_id IN (SELECT value FROM json_each(?))""",
+        [json.dumps(sorted(set(i["project_id"] for i in related)))],
+    )
+    new_image_dir = os.path.commonprefix([i["image_path"] for i in image_paths])
+    log.info(f"Entity #{query_entity_id}: new image root directory is {new_image_dir}")
+
+    os.makedirs(output_dir)
+    try:
+        synth = ProjectSynthesizer(os.path.join(output_dir, "database.db"))
+        try:
+            _synthesize_images(db, synth, related, new_image_dir, workers)
+        except BaseException:
+            synth.close(commit=False)
+            raise
+        db_path = synth.close()
+        _write_entity_sidecar(output_dir, query_entity_id, new_image_dir, synth)
+    except BaseException:
+        # Left behind, the directory would block both creating & extending it
+        shutil.rmtree(output_dir, ignore_errors=True)
+        raise
+    return db_path
+
+
+def extend_entity_project(
+    db, query_entity_id: int, output_path="C:\\data\\", workers: int = None
+) -> Optional[Path]:
+    """Appends the Images related to this Entity since its Project was synthesized
+    (see create_entity_project()), and their matches, to <output_path>/
+    <query_entity_id>/database.db. Images already in it keep their ids & data, so
+    Colmap runs on it can resume.
+    Returns that path, None if the Entity has no synthesized Project."""
+    output_dir = os.path.join(output_path, str(query_entity_id))
+    try:
+        with open(os.path.join(output_dir, ENTITY_SIDECAR)) as fd:
+            sidecar = json.load(fd)
+    except OSError as e:
+        log.warning(f"Entity #{query_entity_id} has no synthesized Project: {e}")
+        return None
+    existing = {
+        int(file_id): (i["image_id"], (i["keypoints_md5"], i["descriptors_md5"]))
+        for file_id, i in sidecar["images"].items()
+    }
+    db_path = Path(output_dir) / "database.db"
+    related = get_entity_related_images(db, query_entity_id)
+    new_file_ids = {i["file_id"] for i in related} - set(existing)
+    if not new_file_ids:
+        log.info(f"Entity #{query_entity_id}: {db_path} is up to date")
+        return db_path
+    log.info(f"Entity #{query_entity_id}: adding {len(new_file_ids)} images")
+    synth = ProjectSynthesizer(db_path, existing=existing)
+    try:
+        _synthesize_images(db, synth, related, sidecar["image_root"], workers)
+    except BaseException:
+        synth.close(commit=False)
+        raise
+    synth.close()
+    _write_entity_sidecar(output_dir, query_entity_id, sidecar["image_root"], synth)
+    return db_path
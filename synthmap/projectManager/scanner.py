@@ -0,0 +1,67 @@
+"""Discovers Items (images, project files) in the local filesystem.
+
+A single os.scandir() walk finds every kind of Item at once, skipping excluded folders
+before descending into them, and yields results as soon as they are found."""
+import os
+from pathlib import Path
+from typing import Iterable, Iterator, Tuple
+
+from synthmap.log.logger import getLogger
+
+
+log = getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg"}
+# Project file names and the kind of project they denote
+PROJECT_FILES = {"project.ini": "colmap", "sfm.json": "alice"}
+ALL_KINDS = ("image", "colmap", "alice")
+
+
+def is_excluded(path: str, exclude_folders: Iterable[str]) -> bool:
+    """Whether any of <exclude_folders> appears in <path>."""
+    return any(exclude in path for exclude in exclude_folders)
+
+
+def item_kind(file_name: str) -> str:
+    """Returns the kind of Item ("image", "colmap", "alice") this file name denotes,
+    None if it isn't one. Case insensitive."""
+    file_name = file_name.lower()
+    if os.path.splitext(file_name)[1] in IMAGE_EXTENSIONS:
+        return "image"
+    return PROJECT_FILES.get(file_name)
+
+
+def scan(
+    root_folder: Path,
+    exclude_folders: Iterable[str] = (),
+    kinds: Iterable[str] = ALL_KINDS,
+) -> Iterator[Tuple[str, str]]:
+    """Walks <root_folder> once, yielding (kind, path) for each Item of <kinds> found.
+    Folders whose path contains any of <exclude_folders> are never entered.
+    Symbolic links to folders are not followed."""
+    kinds = set(kinds)
+    exclude_folders = list(exclude_folders)
+    folders = [str(root_folder)]
+    while folders:
+        folder = folders.pop()
+        try:
+            entries = os.scandir(folder)
+        except OSError as e:
+            log.error(f"Could not scan {folder}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                if is_excluded(entry.path, exclude_folders):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        folders.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                except OSError as e:
+                    log.error(f"Could not stat {entry.path}: {e}")
+                    continue
+                kind = item_kind(entry.name)
+                if kind in kinds:
+                    yield kind, entry.path
@@ -8,6 +8,7 @@ import sys
 import tempfile
 import time
 
+import numpy as np
 import pytest
 import requests
 import uvicorn
@@ -257,6 +258,71 @@ def setup_db(sample_project_data, sample_entity_data):
         yield initialised_db
 
 
+@pytest.fixture(scope="module")
+def synthetic_project(temp_dir, expected_projectImages):
+    """Writes a small Colmap project database over the sample images: random keypoints
+    & descriptors, each image matched to its next 3 neighbours."""
+    rng = np.random.default_rng(0)
+    project_dir = os.path.join(temp_dir, "synthetic_project")
+    os.makedirs(project_dir)
+    db_path = os.path.join(project_dir, "database.db")
+    with sqlite3.connect(db_path) as proj_db:
+        colmapParser.init_db(proj_db)
+        for image_id, image in enumerate(expected_projectImages, start=1):
+            params = np.array([1000.0, image["w"] / 2, image["h"] / 2, 0.0])
+            proj_db.execute(
+                "INSERT INTO cameras VALUES (?, 2, ?, ?, ?, 0)",
+                [image_id, image["w"], image["h"], params.tobytes()],
+            )
+            proj_db.execute(
+                "INSERT INTO images (image_id, name, camera_id) VALUES (?, ?, ?)",
+                [image_id, os.path.basename(image["file_path"]), image_id],
+            )
+            keypoints = rng.random((100, 4), dtype=np.float32)
+            descriptors = rng.integers(0, 255, (100, 128), dtype=np.uint8)
+            proj_db.execute(
+                "INSERT INTO keypoints VALUES (?, 100, 4, ?)",
+                [image_id, keypoints.tobytes()],
+            )
+            proj_db.execute(
+                "INSERT INTO descriptors VALUES (?, 100, 128, ?)",
+                [image_id, descriptors.tobytes()],
+            )
+        image_count = len(expected_projectImages)
+        for id1 in range(1, image_count + 1):
+            for id2 in range(id1 + 1, min(id1 + 4, image_count + 1)):
+                pair_id = colmapParser.image_ids_to_pair_id(id1, id2)
+                matches = rng.integers(0, 100, (20 + id1 + id2, 2), dtype=np.uint32)
+                inliers = matches[: len(matches) // 2]
+                proj_db.execute(
+                    "INSERT INTO matches VALUES (?, ?, 2, ?)",
+                    [pair_id, len(matches), matches.tobytes()],
+                )
+                proj_db.execute(
+                    "INSERT INTO two_view_geometries VALUES (?, ?, 2, ?, 2, ?, ?, ?)",
+                    [pair_id, len(inliers), inliers.tobytes()]
+                    + [np.eye(3).tobytes()] * 3,
+                )
+    return {
+        "label": "synthetic",
+        "project_type": "colmap",
+        "project_file": os.path.join(project_dir, "project.ini"),
+        "db_path": db_path,
+        "image_path": str(TEST_ROOT / "sample_data" / "sample_big_images"),
+    }
+
+
+@pytest.fixture(scope="module")
+def synthetic_db(synthetic_project):
+    """A synthmap database in which the synthetic project is registered."""
+    with db_man.mk_conn(":memory:") as memconn:
+        db_man.setup_db(memconn)
+        project_id = db_man.insert_project(memconn, dict(synthetic_project))
+        colmapParser.register_project_images(memconn, project_id, workers=1)
+        memconn.commit()
+        yield memconn
+
+
 @pytest.fixture(scope="module")
 def temp_db_dir(setup_db, temp_dir):
     db_path = os.path.join(temp_dir, "main.db")
@@ -332,9 +398,9 @@ def synthmap_workspace_model(temp_db_dir):
 
 @pytest.fixture(scope="module")
 def colmap_scene():
-    cameras_path = os.path.join(TEST_ROOT, "sample_data", "colmap_model", "cameras.txt")
-    images_path = os.path.join(TEST_ROOT, "sample_data", "colmap_model", "images.txt")
-    points_path = os.path.join(TEST_ROOT, "sample_data", "colmap_model", "points.txt")
+    cameras_path = os.path.join(TEST_ROOT, "sample_data", "cameras.txt")
+    images_path = os.path.join(TEST_ROOT, "sample_data", "images.txt")
+    points_path = os.path.join(TEST_ROOT, "sample_data", "points3D.txt")
     yield colscene.Scene(
         cameras_path=cameras_path, images_path=images_path, points_path=points_path
     )
@@ -0,0 +1,113 @@
+import importlib.resources
+import os
+
+import numpy as np
+import pytest
+
+from synthmap.projectManager import colmapModel
+
+TEST_ROOT = importlib.resources.files("synthmap.test")
+SAMPLE_DATA = os.path.join(TEST_ROOT, "sample_data")
+
+
+def read_data_lines(file_name):
+    with open(os.path.join(SAMPLE_DATA, file_name), "r") as fd:
+        return [i.split() for i in fd.read().splitlines() if not i.startswith("#")]
+
+
+class TestTextModel:
+    def test_read_cameras(self):
+        cameras = colmapModel.read_cameras_text(
+            os.path.join(SAMPLE_DATA, "cameras.txt")
+        )["cameras"]
+        lines = read_data_lines("cameras.txt")
+        assert len(cameras) == len(lines) == 17
+        for camera, tokens in zip(cameras, lines):
+            assert camera["camera_id"] == int(tokens[0])
+            assert colmapModel.CAMERA_MODELS[camera["model_id"]][0] == tokens[1]
+            assert camera["params"][:4].tolist() == [float(i) for i in tokens[4:]]
+            assert np.isnan(camera["params"][4:]).all()
+
+    @pytest.mark.parametrize("lines_per_chunk", [4, 2**16])
+    def test_read_images(self, lines_per_chunk):
+        data = colmapModel.read_images_text(
+            os.path.join(SAMPLE_DATA, "images.txt"), lines_per_chunk=lines_per_chunk
+        )
+        lines = read_data_lines("images.txt")
+        headers, features = lines[0::2], lines[1::2]
+        assert data["images"]["image_id"].tolist() == [int(i[0]) for i in headers]
+        assert data["names"].tolist() == [i[9] for i in headers]
+        offsets = data["points2D_offsets"]
+        for idx, tokens in enumerate(features):
+            xy = data["points2D_xy"][offsets[idx] : offsets[idx + 1]]
+            point3D_ids = data["points2D_point3D_ids"][offsets[idx] : offsets[idx + 1]]
+            assert xy[:, 0].tolist() == [float(i) for i in tokens[0::3]]
+            assert xy[:, 1].tolist() == [float(i) for i in tokens[1::3]]
+            assert point3D_ids.tolist() == [int(i) for i in tokens[2::3]]
+
+    @pytest.mark.parametrize("block_size", [1000, 2**24])
+    def test_read_points3D(self, block_size):
+        data = colmapModel.read_points3D_text(
+            os.path.join(SAMPLE_DATA, "points3D.txt"), block_size=block_size
+        )
+        lines = read_data_lines("points3D.txt")
+        points, offsets = data["points"], data["track_offsets"]
+        assert len(points) == len(lines) == 2782
+        for idx, tokens in enumerate(lines):
+            assert points[idx]["point3D_id"] == int(tokens[0])
+            assert points[idx]["xyz"].tolist() == [float(i) for i in tokens[1:4]]
+            assert points[idx]["rgb"].tolist() == [int(i) for i in tokens[4:7]]
+            track = slice(offsets[idx], offsets[idx + 1])
+            assert data["track_image_ids"][track].tolist() == [
+                int(i) for i in tokens[8::2]
+            ]
+            assert data["track_point2D_idx"][track].tolist() == [
+                int(i) for i in tokens[9::2]
+            ]
+
+    def test_malformed(self, temp_dir):
+        file_path = os.path.join(temp_dir, "points3D.txt")
+        with open(file_path, "w") as fd:
+            fd.write(
+                "# comment\n1 0.5 0.5 0.5 1 2 3 0.1 1 2\n2 0.5 nope 0.5 1 2 3 0.1\n"
+            )
+        with pytest.raises(ValueError):
+            colmapModel.read_points3D_text(file_path)
+
+
+class TestBinaryModel:
+    @pytest.mark.parametrize("kind", ["cameras", "images", "points3D"])
+    def test_roundtrip(self, temp_dir, kind):
+        read_text = getattr(colmapModel, f"read_{kind}_text")
+        write_binary = getattr(colmapModel, f"write_{kind}_binary")
+        file_path = os.path.join(temp_dir, f"{kind}.bin")
+        expected = read_text(os.path.join(SAMPLE_DATA, f"{kind}.txt"))
+        write_binary(file_path, expected)
+        data = getattr(colmapModel, f"read_{kind}")(file_path)
+        assert data.keys() == expected.keys()
+        for key, values in data.items():
+            assert values.dtype == expected[key].dtype
+            if values.dtype == object:
+                assert values.tolist() == expected[key].tolist()
+            else:
+                # Compares NaN padded camera parameters too
+                assert values.tobytes() == expected[key].tobytes()
+        os.remove(file_path)
+
+    def test_points3D_layout(self, temp_dir):
+        file_path = os.path.join(temp_dir, "points3D.bin")
+        data = colmapModel.read_points3D_text(os.path.join(SAMPLE_DATA, "points3D.txt"))
+        colmapModel.write_points3D_binary(file_path, data)
+        with open(file_path, "rb") as fd:
+            raw = fd.read()
+        # Number of points, then the first point's fixed fields & track length
+        assert np.frombuffer(raw, "<u8", count=1)[0] == 2782
+        header = np.frombuffer(raw, colmapModel.POINT_HEADER_DTYPE, count=1, offset=8)
+        assert header["point3D_id"][0] == 944
+        assert header["track_length"][0] == 4
+        assert len(raw) == 8 + 2782 * 51 + 8 * len(data["track_image_ids"])
+        os.remove(file_path)
+
+    def test_unknown_format(self):
+        with pytest.raises(ValueError):
+            colmapModel.read_points3D(os.path.join(SAMPLE_DATA, "project.ini"))
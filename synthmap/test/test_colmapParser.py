@@ -1,8 +1,15 @@
+import hashlib
 import importlib.resources
+import json
+import os
+from pathlib import Path
+import shutil
+import sqlite3
 
 import numpy as np
 import pytest
 
+from synthmap.db import manager as db_man
 from synthmap.projectManager import colmapParser
 
 TEST_ROOT = importlib.resources.files("synthmap.test")
@@ -252,3 +259,431 @@ class TestEnumeration:
     def test_get_proj_dirs(self, known_projects):
         for sample_proj_path, known_data in known_projects:
             assert colmapParser.get_proj_dirs(sample_proj_path) == known_data
+
+    def test_get_model_files(self, temp_dir):
+        text_model = TEST_ROOT / "sample_data"
+        assert list(colmapParser.get_model_files(text_model)) == [
+            [text_model / f"{i}.txt" for i in colmapParser.MODEL_FILES]
+        ]
+        bin_model = Path(temp_dir) / "sparse" / "0"
+        bin_model.mkdir(parents=True)
+        for name in colmapParser.MODEL_FILES:
+            (bin_model / f"{name}.bin").touch()
+            (bin_model / f"{name}.txt").touch()
+        assert list(colmapParser.get_model_files(temp_dir)) == [
+            [bin_model / f"{i}.bin" for i in colmapParser.MODEL_FILES]
+        ]
+        shutil.rmtree(Path(temp_dir) / "sparse")
+
+
+class TestRegistration:
+    def test_register_project_images(self, synthetic_db, expected_projectImages):
+        rows = synthetic_db.execute(
+            """SELECT projectImages.project_image_id, imageFiles.md5
+            FROM projectImages
+            INNER JOIN imageFiles ON imageFiles.file_id = projectImages.file_id
+            WHERE project_id=1 ORDER BY project_image_id"""
+        ).fetchall()
+        assert [i["md5"] for i in rows] == [i["md5"] for i in expected_projectImages]
+        assert [i["project_image_id"] for i in rows] == list(range(1, 18))
+
+    def test_register_twice(self, synthetic_db):
+        assert colmapParser.register_project_images(synthetic_db, 1) is None
+
+    def test_index_matches(self, synthetic_db):
+        rows = synthetic_db.execute(
+            "SELECT * FROM projectMatches WHERE project_id=1"
+        ).fetchall()
+        # 17 images matched to their next 3 neighbours, stored in both directions
+        assert len(rows) == 2 * (14 * 3 + 2 + 1)
+        for row in rows:
+            image_ids = [row["project_image_id"], row["match_image_id"]]
+            assert colmapParser.image_ids_to_pair_id(*image_ids) == row["pair_id"]
+            assert row["rows"] == 20 + row["project_image_id"] + row["match_image_id"]
+
+    def test_index_digests(self, synthetic_db, synthetic_project):
+        digests = colmapParser.get_project_digests(synthetic_db, 1, range(1, 18))
+        assert sorted(digests) == list(range(1, 18))
+        with sqlite3.connect(synthetic_project["db_path"]) as proj_db:
+            keypoints, descriptors = proj_db.execute(
+                """SELECT keypoints.data, descriptors.data FROM keypoints
+                INNER JOIN descriptors ON descriptors.image_id = keypoints.image_id
+                WHERE keypoints.image_id=5"""
+            ).fetchone()
+        assert digests[5] == (
+            hashlib.md5(keypoints).hexdigest(),
+            hashlib.md5(descriptors).hexdigest(),
+        )
+
+    def test_list_image_matches(self, synthetic_db, synthetic_project):
+        file_id = synthetic_db.execute(
+            "SELECT file_id FROM projectImages WHERE project_image_id=2"
+        ).fetchone()["file_id"]
+        matches, keypoints = colmapParser.list_image_matches(synthetic_db, file_id)
+        assert keypoints[1]["rows"] == 100
+        # (2, 1) has fewer than MIN_MATCHES matches
+        expected_ids = [3, 4, 5]
+        expected_file_ids = [
+            synthetic_db.execute(
+                "SELECT file_id FROM projectImages WHERE project_image_id=?", [i]
+            ).fetchone()["file_id"]
+            for i in expected_ids
+        ]
+        assert sorted(matches[1]) == sorted(expected_file_ids)
+        with sqlite3.connect(synthetic_project["db_path"]) as proj_db:
+            for image_id, file_id in zip(expected_ids, expected_file_ids):
+                rows, blob = proj_db.execute(
+                    "SELECT rows, data FROM matches WHERE pair_id=?",
+                    [colmapParser.image_ids_to_pair_id(2, image_id)],
+                ).fetchone()
+                assert matches[1][file_id]["rows"] == rows
+                assert matches[1][file_id]["data"] == (
+                    colmapParser.blob_to_array(blob, np.uint32, (-1, 2)).tolist()
+                )
+
+
+@pytest.fixture
+def entity_db(synthetic_db):
+    """A copy of the synthetic db in which Entity #1 is linked to project image 5."""
+    with db_man.mk_conn(":memory:") as db:
+        synthetic_db.backup(db)
+        db.execute("INSERT INTO Entities (entity_id, label) VALUES (1, 'Ruin')")
+        file_id = db.execute(
+            "SELECT file_id FROM projectImages WHERE project_image_id=5"
+        ).fetchone()["file_id"]
+        db_man.register_image_entity(db, file_id, 1)
+        yield db
+
+
+def synth_image_row(project_image_id, name, descriptors):
+    return {
+        "project_image_id": project_image_id,
+        "name": name,
+        "camera_id": 1,
+        **{f"prior_{i}": None for i in ["qw", "qx", "qy", "qz", "tx", "ty", "tz"]},
+        "model": 2,
+        "width": 10,
+        "height": 10,
+        "params": b"",
+        "prior_focal_length": 0,
+        "keypoints_rows": 0,
+        "keypoints_cols": 4,
+        "keypoints_data": b"",
+        "descriptors_rows": 1,
+        "descriptors_cols": len(descriptors),
+        "descriptors_data": descriptors,
+    }
+
+
+class TestSynthesis:
+    def test_create_entity_project(self, entity_db, synthetic_project, temp_dir):
+        output_path = os.path.join(temp_dir, "entities")
+        db_path = colmapParser.create_entity_project(entity_db, 1, output_path)
+        assert db_path == Path(output_path) / "1" / "database.db"
+        assert not os.path.exists(f"{db_path}.tmp")
+        with sqlite3.connect(synthetic_project["db_path"]) as proj_db:
+            source = {
+                name: descriptors
+                for name, descriptors in proj_db.execute(
+                    """SELECT name, data FROM images
+                    INNER JOIN descriptors ON descriptors.image_id = images.image_id
+                    WHERE images.image_id BETWEEN 2 AND 8"""
+                )
+            }
+        with sqlite3.connect(db_path) as out_db:
+            images = out_db.execute(
+                """SELECT images.image_id, name, data FROM images
+                INNER JOIN descriptors ON descriptors.image_id = images.image_id"""
+            ).fetchall()
+            # Image 5 & its neighbours in the covisibility graph
+            assert [i[0] for i in images] == list(range(1, 8))
+            assert {os.path.basename(i[1]): i[2] for i in images} == source
+            pair_ids = [i[0] for i in out_db.execute("SELECT pair_id FROM matches")]
+            # Pairs of images at most 3 apart
+            assert len(pair_ids) == 15
+            assert out_db.execute(
+                "SELECT count(*) FROM two_view_geometries"
+            ).fetchone()[0] == len(pair_ids)
+        assert colmapParser.create_entity_project(entity_db, 1, output_path) is None
+        shutil.rmtree(output_path)
+
+    def test_extend_entity_project(self, entity_db, temp_dir):
+        output_path = os.path.join(temp_dir, "entities")
+        assert colmapParser.extend_entity_project(entity_db, 1, output_path) is None
+        db_path = colmapParser.create_entity_project(entity_db, 1, output_path)
+        with sqlite3.connect(db_path) as out_db:
+            before = sorted(out_db.execute("SELECT image_id, name FROM images"))
+            pairs_before = sorted(out_db.execute("SELECT pair_id FROM matches"))
+        # Nothing new yet
+        assert colmapParser.extend_entity_project(entity_db, 1, output_path) == db_path
+        file_id = entity_db.execute(
+            "SELECT file_id FROM projectImages WHERE project_image_id=12"
+        ).fetchone()["file_id"]
+        db_man.register_image_entity(entity_db, file_id, 1)
+        assert colmapParser.extend_entity_project(entity_db, 1, output_path) == db_path
+        assert not os.path.exists(f"{db_path}.tmp")
+        with sqlite3.connect(db_path) as out_db:
+            after = sorted(out_db.execute("SELECT image_id, name FROM images"))
+            pairs_after = sorted(out_db.execute("SELECT pair_id FROM matches"))
+            keypoints = out_db.execute("SELECT count(*) FROM keypoints").fetchone()[0]
+        # Images 2 to 8, then 9 to 15 (neighbours of 12) appended
+        assert after[: len(before)] == before
+        assert [i[0] for i in after] == list(range(1, 15))
+        assert keypoints == 14
+        assert set(pairs_before) < set(pairs_after)
+        assert len(pairs_after) == 11 * 3 + 2 + 1
+        with open(Path(db_path).parent / colmapParser.ENTITY_SIDECAR) as fd:
+            sidecar = json.load(fd)
+        assert sorted(i["image_id"] for i in sidecar["images"].values()) == [
+            i[0] for i in after
+        ]
+        shutil.rmtree(output_path)
+
+    def test_create_failure(self, entity_db, temp_dir, monkeypatch):
+        output_path = os.path.join(temp_dir, "entities")
+
+        def failing(*args, **kwargs):
+            raise sqlite3.OperationalError("disk I/O error")
+
+        monkeypatch.setattr(colmapParser, "_synthesize_images", failing)
+        with pytest.raises(sqlite3.OperationalError):
+            colmapParser.create_entity_project(entity_db, 1, output_path)
+        assert not os.path.exists(os.path.join(output_path, "1"))
+        monkeypatch.undo()
+        db_path = colmapParser.create_entity_project(entity_db, 1, output_path)
+        assert db_path == Path(output_path) / "1" / "database.db"
+        shutil.rmtree(output_path)
+
+    def test_extend_failure(self, entity_db, temp_dir, monkeypatch):
+        output_path = os.path.join(temp_dir, "entities")
+        db_path = colmapParser.create_entity_project(entity_db, 1, output_path)
+        with sqlite3.connect(db_path) as out_db:
+            before = [
+                sorted(out_db.execute(f"SELECT * FROM {table}"))
+                for table in ["images", "matches"]
+            ]
+        file_id = entity_db.execute(
+            "SELECT file_id FROM projectImages WHERE project_image_id=12"
+        ).fetchone()["file_id"]
+        db_man.register_image_entity(entity_db, file_id, 1)
+
+        def failing(*args, **kwargs):
+            raise sqlite3.OperationalError("disk I/O error")
+
+        monkeypatch.setattr(colmapParser.ProjectSynthesizer, "add_match", failing)
+        with pytest.raises(sqlite3.OperationalError):
+            colmapParser.extend_entity_project(entity_db, 1, output_path)
+        # Appended images were rolled back
+        with sqlite3.connect(db_path) as out_db:
+            after = [
+                sorted(out_db.execute(f"SELECT * FROM {table}"))
+                for table in ["images", "matches"]
+            ]
+        assert after == before
+        shutil.rmtree(output_path)
+
+    def test_missing_digests(self, entity_db, temp_dir):
+        entity_db.execute("DELETE FROM projectImageDigests")
+        output_path = os.path.join(temp_dir, "entities")
+        db_path = colmapParser.create_entity_project(entity_db, 1, output_path)
+        with sqlite3.connect(db_path) as out_db:
+            assert out_db.execute("SELECT count(*) FROM images").fetchone()[0] == 7
+        digests = entity_db.execute("SELECT count(*) AS cnt FROM projectImageDigests")
+        assert digests.fetchone()["cnt"] == 17
+        shutil.rmtree(output_path)
+
+    def test_stale_digests(self, entity_db, synthetic_project, temp_dir):
+        output_path = os.path.join(temp_dir, "entities")
+        colmapParser.create_entity_project(entity_db, 1, output_path)
+        shutil.rmtree(output_path)
+        with sqlite3.connect(synthetic_project["db_path"]) as proj_db:
+            (original,) = proj_db.execute(
+                "SELECT data FROM descriptors WHERE image_id=5"
+            ).fetchone()
+            changed = bytes(255 - i for i in original)
+            proj_db.execute("UPDATE descriptors SET data=? WHERE image_id=5", [changed])
+        proj_db.close()
+        try:
+            db_path = colmapParser.create_entity_project(entity_db, 1, output_path)
+            digests = colmapParser.get_project_digests(entity_db, 1, [5])
+            assert digests[5][1] == hashlib.md5(changed).hexdigest()
+            with open(Path(db_path).parent / colmapParser.ENTITY_SIDECAR) as fd:
+                sidecar = json.load(fd)
+            assert hashlib.md5(changed).hexdigest() in [
+                i["descriptors_md5"] for i in sidecar["images"].values()
+            ]
+        finally:
+            with sqlite3.connect(synthetic_project["db_path"]) as proj_db:
+                proj_db.execute(
+                    "UPDATE descriptors SET data=? WHERE image_id=5", [original]
+                )
+            proj_db.close()
+            shutil.rmtree(output_path, ignore_errors=True)
+
+    def test_imageset_matches(self, synthetic_project):
+        image_ids = [2, 3, 5, 9, 10, 17]
+        with sqlite3.connect(synthetic_project["db_path"]) as proj_db:
+            proj_db.row_factory = db_man.dict_factory
+            pairs = [
+                (id1, id2, row["matches_rows"])
+                for id1, id2, row in colmapParser.iter_imageset_matches(
+                    proj_db, image_ids, batch_size=2
+                )
+            ]
+            plan = " ".join(
+                i["detail"]
+                for i in proj_db.execute(
+                    f"EXPLAIN QUERY PLAN {colmapParser.IMAGESET_MATCHES_STMT}",
+                    ["[]", "[]"],
+                )
+            )
+        # Neighbours at most 3 apart were matched
+        expected = [(2, 3), (2, 5), (3, 5), (9, 10)]
+        assert sorted(pairs) == [(i, j, 20 + i + j) for i, j in expected]
+        with sqlite3.connect(synthetic_project["db_path"]) as proj_db:
+            proj_db.row_factory = db_man.dict_factory
+            new_pairs = [
+                (id1, id2)
+                for id1, id2, _ in colmapParser.iter_imageset_matches(
+                    proj_db, image_ids, new_image_ids=[5, 9]
+                )
+            ]
+        assert sorted(new_pairs) == [(2, 5), (3, 5), (9, 10)]
+        assert "SEARCH matches USING INTEGER PRIMARY KEY" in plan
+
+    def test_get_imageset_data(self, synthetic_db):
+        file_ids = colmapParser.get_project_image_ids(
+            synthetic_db,
+            1,
+            [
+                i["file_id"]
+                for i in synthetic_db.execute("SELECT file_id FROM projectImages")
+            ],
+        )
+        assert sorted(file_ids.values()) == list(range(1, 18))
+        pids = {v: k for k, v in file_ids.items()}
+        data = colmapParser.get_imageset_data(synthetic_db, 1, [pids[1], pids[2]])
+        assert sorted(data["images"]) == [1, 2]
+        assert [i[:2] for i in data["matches"]] == [[1, 2]]
+
+    def test_concurrent_readers(self, entity_db, temp_dir):
+        contents = []
+        for workers in [1, 4]:
+            output_path = os.path.join(temp_dir, f"entities_{workers}")
+            db_path = colmapParser.create_entity_project(
+                entity_db, 1, output_path, workers=workers
+            )
+            with sqlite3.connect(db_path) as out_db:
+                contents.append(
+                    [
+                        sorted(out_db.execute(f"SELECT * FROM {table}"))
+                        for table in ["images", "keypoints", "matches"]
+                    ]
+                )
+            shutil.rmtree(output_path)
+        assert contents[0] == contents[1]
+
+    def test_stream_projects(self, synthetic_project, temp_dir):
+        sources = [
+            (project_id, synthetic_project["db_path"], range(1, 18))
+            for project_id in [1, 2]
+        ]
+        items = list(
+            colmapParser.stream_projects(
+                colmapParser.iter_imageset_images, sources, workers=2, queue_size=2
+            )
+        )
+        assert sorted(i[0] for i in items) == [1] * 17 + [2] * 17
+        # Readers are released when the caller stops early
+        stream = colmapParser.stream_projects(
+            colmapParser.iter_imageset_matches, sources, workers=2, queue_size=1
+        )
+        assert next(stream)[0] in [1, 2]
+        stream.close()
+        missing = [(3, os.path.join(temp_dir, "missing.db"), [1])]
+        with pytest.raises(sqlite3.OperationalError):
+            list(
+                colmapParser.stream_projects(
+                    colmapParser.iter_imageset_images, sources + missing, workers=2
+                )
+            )
+
+    def test_shared_images(self, temp_dir):
+        db_path = os.path.join(temp_dir, "synthesized.db")
+        synth = colmapParser.ProjectSynthesizer(db_path, batch_size=2)
+        assert synth.plan_image(1, 1, 100, ("ka", "da")) is True
+        assert synth.plan_image(1, 2, 101, ("kb", "db")) is True
+        assert synth.plan_image(1, 3, 102, ("kc", "dc")) is True
+        assert synth.plan_image(1, 4, 103, ("kd", "dd")) is True
+        # Same features: project 2's image 7 is image 1 in the new project
+        assert synth.plan_image(2, 7, 100, ("ka", "da")) is False
+        # Different features: dropped from every project
+        assert synth.plan_image(2, 8, 101, ("kb", "dx")) is False
+        assert synth.add_image(1, synth_image_row(1, "a.jpg", b"a")) == 1
+        assert synth.add_image(1, synth_image_row(2, "b.jpg", b"b")) is None
+        assert synth.add_image(1, synth_image_row(3, "c.jpg", b"c")) == 3
+        assert synth.add_image(2, synth_image_row(7, "a.jpg", b"a")) is None
+        # Image 4 was planned but never written
+        match = {
+            "matches_rows": 0,
+            "matches_cols": 2,
+            "matches_data": b"",
+            "two_view_geometries_rows": 0,
+            "two_view_geometries_cols": 2,
+            "two_view_geometries_data": b"",
+            "config": 2,
+            "F": None,
+            "E": None,
+            "H": None,
+        }
+        assert synth.add_match(2, 7, 9, match) is False
+        assert synth.add_match(1, 1, 2, match) is False
+        assert synth.add_match(1, 1, 4, match) is False
+        assert synth.add_match(1, 1, 3, match) is True
+        assert synth.add_match(2, 7, 3, match) is False
+        assert synth.close() == Path(db_path)
+        with sqlite3.connect(db_path) as out_db:
+            assert [i[0] for i in out_db.execute("SELECT name FROM images")] == [
+                "a.jpg",
+                "c.jpg",
+            ]
+            assert [i[0] for i in out_db.execute("SELECT pair_id FROM matches")] == [
+                colmapParser.image_ids_to_pair_id(1, 3)
+            ]
+        os.remove(db_path)
+
+    def test_shared_pairs(self, temp_dir):
+        db_path = os.path.join(temp_dir, "synthesized.db")
+        synth = colmapParser.ProjectSynthesizer(db_path)
+        for project_id, project_image_ids in [(1, [1, 2]), (2, [5, 6])]:
+            for project_image_id, file_id in zip(project_image_ids, [100, 101]):
+                synth.plan_image(project_id, project_image_id, file_id, ("k", "d"))
+        synth.add_image(1, synth_image_row(1, "a.jpg", b"a"))
+        synth.add_image(1, synth_image_row(2, "b.jpg", b"b"))
+
+        def match(data):
+            return {
+                "matches_rows": 1,
+                "matches_cols": 2,
+                "matches_data": data,
+                "two_view_geometries_rows": 1,
+                "two_view_geometries_cols": 2,
+                "two_view_geometries_data": data,
+                "config": 2,
+                "F": None,
+                "E": None,
+                "H": None,
+            }
+
+        # Project 1 was planned first, its copy of the pair wins whenever it arrives
+        assert synth.add_match(2, 5, 6, match(b"project 2")) is True
+        assert synth.add_match(1, 1, 2, match(b"project 1")) is True
+        assert synth.add_match(2, 5, 6, match(b"project 2")) is False
+        assert synth.counts["matches"] == 1
+        synth.close()
+        with sqlite3.connect(db_path) as out_db:
+            for table in ["matches", "two_view_geometries"]:
+                assert out_db.execute(f"SELECT data FROM {table}").fetchall() == [
+                    (b"project 1",)
+                ]
+        os.remove(db_path)
@@ -0,0 +1,120 @@
+import os
+import shutil
+import sqlite3
+import threading
+
+import pytest
+
+from synthmap.db.cache import ProjectDBCache
+
+
+@pytest.fixture
+def project_db_paths(temp_dir, synthetic_project):
+    paths = []
+    for idx in range(2):
+        path = os.path.join(temp_dir, f"cached_{idx}.db")
+        shutil.copy(synthetic_project["db_path"], path)
+        paths.append(path)
+    yield paths
+    for path in paths:
+        os.remove(path)
+
+
+class TestProjectDBCache:
+    def test_reuse(self, project_db_paths):
+        cache = ProjectDBCache()
+        with cache.open(project_db_paths[0]) as proj_db:
+            first = proj_db
+            assert proj_db.count("images") == 17
+            assert "pair_id" in proj_db.columns("matches")
+        with cache.open(project_db_paths[0]) as proj_db:
+            assert proj_db is first
+        cache.clear()
+
+    def test_relative_path(self, project_db_paths, monkeypatch):
+        cache = ProjectDBCache()
+        folder, name = os.path.split(project_db_paths[0])
+        monkeypatch.chdir(folder)
+        with cache.open(name) as proj_db:
+            first = proj_db
+        with cache.open(project_db_paths[0]) as proj_db:
+            assert proj_db is first
+        assert len(cache) == 1
+        # Reached from another working directory
+        monkeypatch.chdir(os.path.dirname(folder))
+        with cache.open(os.path.join(os.path.basename(folder), name)) as proj_db:
+            assert proj_db is first
+        cache.clear()
+
+    def test_read_only(self, project_db_paths):
+        cache = ProjectDBCache()
+        with cache.open(project_db_paths[0]) as proj_db:
+            with pytest.raises(sqlite3.OperationalError):
+                proj_db.execute("DELETE FROM images")
+        cache.clear()
+
+    def test_invalidate(self, project_db_paths):
+        cache = ProjectDBCache()
+        with cache.open(project_db_paths[0]) as proj_db:
+            first = proj_db
+            assert proj_db.count("images") == 17
+        with sqlite3.connect(project_db_paths[0]) as db:
+            db.execute("DELETE FROM images WHERE image_id > 10")
+        stat = os.stat(project_db_paths[0])
+        os.utime(project_db_paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        with cache.open(project_db_paths[0]) as proj_db:
+            assert proj_db is not first
+            assert proj_db.count("images") == 10
+        cache.clear()
+
+    def test_evict(self, project_db_paths):
+        cache = ProjectDBCache(max_entries=1)
+        with cache.open(project_db_paths[0]) as proj_db:
+            first = proj_db
+        with cache.open(project_db_paths[1]):
+            pass
+        assert len(cache) == 1
+        with pytest.raises(sqlite3.ProgrammingError):
+            first.execute("SELECT 1")
+        cache.clear()
+
+    def test_evict_in_use(self, project_db_paths):
+        cache = ProjectDBCache(max_entries=1)
+        with cache.open(project_db_paths[0]) as proj_db:
+            # Evicted by another user while still in use
+            with cache.open(project_db_paths[1]):
+                pass
+            assert len(cache) == 1
+            assert proj_db.count("images") == 17
+            proj_db.execute("SELECT 1")
+        with pytest.raises(sqlite3.ProgrammingError):
+            proj_db.execute("SELECT 1")
+        cache.clear()
+
+    def test_concurrent_users(self, project_db_paths):
+        cache = ProjectDBCache(max_entries=1)
+        errors = []
+
+        def read(path):
+            try:
+                for _ in range(50):
+                    with cache.open(path) as proj_db:
+                        proj_db.execute("SELECT count(*) FROM images").fetchone()
+            except sqlite3.Error as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=read, args=[project_db_paths[i % 2]])
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        cache.clear()
+
+    def test_missing(self, temp_dir):
+        with pytest.raises(sqlite3.OperationalError):
+            with ProjectDBCache().open(os.path.join(temp_dir, "missing.db")):
+                pass
@@ -0,0 +1,51 @@
+import pytest
+
+from synthmap.db import covisibility
+
+
+@pytest.fixture(scope="module")
+def file_ids(synthetic_db):
+    """{project_image_id: file_id} for the synthetic project."""
+    return {
+        i["project_image_id"]: i["file_id"]
+        for i in synthetic_db.execute(
+            "SELECT project_image_id, file_id FROM projectImages WHERE project_id=1"
+        )
+    }
+
+
+class TestCovisibility:
+    def test_edges(self, synthetic_db, file_ids):
+        rows = synthetic_db.execute("SELECT * FROM imageCovisibility").fetchall()
+        assert len(rows) == 2 * (14 * 3 + 2 + 1)
+        assert all(i["projects"] == 1 for i in rows)
+
+    def test_neighbours(self, synthetic_db, file_ids):
+        neighbours = covisibility.get_neighbours(synthetic_db, file_ids[5])
+        expected = {file_ids[i]: 20 + 5 + i for i in [2, 3, 4, 6, 7, 8]}
+        assert neighbours == expected
+        neighbours = covisibility.get_neighbours(
+            synthetic_db, file_ids[5], min_weight=32
+        )
+        assert sorted(neighbours) == sorted([file_ids[7], file_ids[8]])
+
+    def test_top_k(self, synthetic_db, file_ids):
+        top = covisibility.get_top_k(synthetic_db, file_ids[5], k=2, weight="matches")
+        assert [i["match_file_id"] for i in top] == [file_ids[8], file_ids[7]]
+        assert [i["inliers"] for i in top] == [(20 + 5 + 8) // 2, (20 + 5 + 7) // 2]
+        with pytest.raises(ValueError):
+            covisibility.get_top_k(synthetic_db, file_ids[5], weight="rows")
+
+    def test_expand(self, synthetic_db, file_ids):
+        distances = covisibility.expand(synthetic_db, [file_ids[1]], hops=2)
+        expected = {file_ids[1]: 0}
+        expected.update({file_ids[i]: 1 for i in [2, 3, 4]})
+        expected.update({file_ids[i]: 2 for i in [5, 6, 7]})
+        assert distances == expected
+
+    def test_refresh(self, synthetic_db, file_ids):
+        before = synthetic_db.execute("SELECT * FROM imageCovisibility").fetchall()
+        synthetic_db.execute("DELETE FROM imageCovisibility")
+        covisibility.refresh_project(synthetic_db, 1)
+        after = synthetic_db.execute("SELECT * FROM imageCovisibility").fetchall()
+        assert sorted(before, key=str) == sorted(after, key=str)
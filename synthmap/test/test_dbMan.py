@@ -1,4 +1,7 @@
-from synthmap.db import manager as db_man
+import os
+import shutil
+
+from synthmap.db import ingest, manager as db_man, migrations
 from synthmap.models import synthmap as synthmodels
 from synthmap.projectManager import colmapParser
 
@@ -28,12 +31,61 @@ class TestConnectionCreation:
             "projectImages",
             "sessionImages",
             "projectScenes",
+            "fileStates",
+            "schema_version",
+            "projectMatches",
+            "imageCovisibility",
+            "projectImageDigests",
+            "projectDigestSources",
         ]
         db_man.setup_db(memconn)
         cursor = memconn.execute("SELECT name FROM sqlite_master WHERE type='table'")
         db_table_names = [i["name"] for i in cursor]
         assert set(db_table_names) == set(expected_names)
 
+    def test_upgrade_db(self):
+        memconn = db_man.mk_conn(":memory:")
+        # A database created before migrations existed
+        for table_name, stmt in db_man.schemas.items():
+            if table_name != "fileStates":
+                memconn.execute(stmt)
+        assert migrations.get_schema_version(memconn) == 0
+        assert migrations.upgrade(memconn) == migrations.LATEST_VERSION
+        cursor = memconn.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        index_names = {i["name"] for i in cursor}
+        assert "idx_projectImages_file" in index_names
+        assert "fileStates" in {
+            i["name"] for i in memconn.execute("SELECT name FROM sqlite_master")
+        }
+        plan = memconn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM imageEntities WHERE entity_id=1"
+        ).fetchall()
+        assert "idx_imageEntities_entity" in plan[0]["detail"]
+        # Upgrading is idempotent
+        assert migrations.upgrade(memconn) == migrations.LATEST_VERSION
+        versions = memconn.execute("SELECT version FROM schema_version").fetchall()
+        assert len(versions) == migrations.LATEST_VERSION
+
+    def test_upgrade_reindexes(self, synthetic_db):
+        memconn = db_man.mk_conn(":memory:")
+        synthetic_db.backup(memconn)
+        # A database indexed before inlier counts & the covisibility graph
+        memconn.execute("DELETE FROM schema_version WHERE version >= 4")
+        memconn.execute("DELETE FROM imageCovisibility")
+        memconn.execute("UPDATE projectMatches SET inliers=0")
+        memconn.execute(
+            "INSERT INTO ColmapProjects (project_id, db_path, image_path) VALUES (?, ?, ?)",
+            [99, "missing.db", "missing"],
+        )
+        memconn.commit()
+        assert migrations.upgrade(memconn) == migrations.LATEST_VERSION
+        matches = memconn.execute("SELECT * FROM projectMatches").fetchall()
+        assert len(matches) == 2 * (14 * 3 + 2 + 1)
+        assert all(i["inliers"] == i["rows"] // 2 for i in matches)
+        edges = memconn.execute("SELECT count(*) AS cnt FROM imageCovisibility")
+        assert edges.fetchone()["cnt"] == len(matches)
+        assert colmapParser.reindex_projects(memconn) == [99]
+
 
 ###
 #
@@ -88,3 +140,110 @@ class TestProjectManagement:
         for entity_id, observations in known_data.items():
             db_images = db_man.get_entity_images(initialised_db, entity_id)
             assert observations == [i["file_id"] for i in db_images]
+
+
+class TestImageIngest:
+    def test_register_images(self, initialised_db, expected_projectImages):
+        paths = [i["file_path"] for i in expected_projectImages[:6]]
+        file_ids = ingest.register_images(initialised_db, paths, workers=2)
+        assert set(file_ids.keys()) == set(paths)
+        for image in expected_projectImages[:6]:
+            row = initialised_db.execute(
+                "SELECT * FROM imageFiles WHERE file_id=?",
+                [file_ids[image["file_path"]]],
+            ).fetchone()
+            assert row["md5"] == image["md5"]
+            assert (row["w"], row["h"]) == (image["w"], image["h"])
+        views = initialised_db.execute("SELECT count(*) AS cnt FROM imageViews")
+        assert views.fetchone()["cnt"] == 6
+
+    def test_register_known_images(self, initialised_db, expected_projectImages):
+        paths = [i["file_path"] for i in expected_projectImages[4:8]]
+        file_ids = ingest.register_images(
+            initialised_db, paths, workers=1, batch_size=3
+        )
+        assert len(file_ids) == 4
+        count = initialised_db.execute("SELECT count(*) AS cnt FROM imageFiles")
+        assert count.fetchone()["cnt"] == 8
+
+    def test_update_changed_images(
+        self, initialised_db, expected_projectImages, temp_dir
+    ):
+        copy_path = os.path.join(temp_dir, "changed.JPG")
+        old, new = expected_projectImages[12], expected_projectImages[13]
+        shutil.copy(old["file_path"], copy_path)
+        file_ids = ingest.register_images(initialised_db, [copy_path], workers=1)
+        file_id = file_ids[copy_path]
+        shutil.copy(new["file_path"], copy_path)
+        os.utime(copy_path, ns=(0, 0))
+        file_ids = ingest.register_images(initialised_db, [copy_path], workers=1)
+        assert file_ids == {copy_path: file_id}
+        row = initialised_db.execute(
+            "SELECT * FROM imageFiles WHERE file_id=?", [file_id]
+        ).fetchone()
+        assert (row["md5"], row["w"], row["h"]) == (new["md5"], new["w"], new["h"])
+        state = initialised_db.execute(
+            "SELECT md5 FROM fileStates WHERE file_path=?", [copy_path]
+        )
+        assert state.fetchone()["md5"] == new["md5"]
+        # Same with single insertions
+        shutil.copy(old["file_path"], copy_path)
+        os.utime(copy_path, ns=(1, 1))
+        assert db_man.insert_image(initialised_db, copy_path) == file_id
+        row = initialised_db.execute(
+            "SELECT md5 FROM imageFiles WHERE file_id=?", [file_id]
+        ).fetchone()
+        assert row["md5"] == old["md5"]
+        os.remove(copy_path)
+
+    def test_register_uncommitted(self, temp_dir, expected_projectImages):
+        db_path = os.path.join(temp_dir, "uncommitted.db")
+        paths = [i["file_path"] for i in expected_projectImages[:3]]
+        with db_man.mk_conn(db_path) as db:
+            db_man.setup_db(db)
+            db.commit()
+            ingest.register_images(db, paths, workers=1, batch_size=2)
+            assert db.in_transaction
+            db.rollback()
+            count = db.execute("SELECT count(*) AS cnt FROM imageFiles")
+            assert count.fetchone()["cnt"] == 0
+            ingest.register_images(db, paths, workers=1, batch_size=2, commit=True)
+            assert not db.in_transaction
+        db.close()
+        with db_man.mk_conn(db_path) as db:
+            count = db.execute("SELECT count(*) AS cnt FROM imageFiles")
+            assert count.fetchone()["cnt"] == 3
+        db.close()
+        os.remove(db_path)
+
+    def test_skip_unchanged_images(
+        self, initialised_db, expected_projectImages, monkeypatch
+    ):
+        paths = [i["file_path"] for i in expected_projectImages[:8]]
+
+        def fail(fp):
+            raise AssertionError(f"{fp} should not be hashed")
+
+        monkeypatch.setattr(db_man, "get_md5", fail)
+        file_ids = ingest.register_images(initialised_db, paths, workers=1)
+        assert len(file_ids) == 8
+        assert db_man.insert_image(initialised_db, paths[0]) == file_ids[paths[0]]
+
+    def test_rehash_changed_images(
+        self, initialised_db, expected_projectImages, temp_dir
+    ):
+        copy_path = os.path.join(temp_dir, "copy.JPG")
+        shutil.copy(expected_projectImages[0]["file_path"], copy_path)
+        file_ids = ingest.register_images(initialised_db, [copy_path], workers=1)
+        assert file_ids[copy_path] == 1
+        shutil.copy(expected_projectImages[9]["file_path"], copy_path)
+        os.utime(copy_path, ns=(0, 0))
+        state = initialised_db.execute(
+            "SELECT md5 FROM fileStates WHERE file_path=?", [copy_path]
+        )
+        assert state.fetchone()["md5"] == expected_projectImages[0]["md5"]
+        ingest.register_images(initialised_db, [copy_path], workers=1)
+        state = initialised_db.execute(
+            "SELECT md5 FROM fileStates WHERE file_path=?", [copy_path]
+        )
+        assert state.fetchone()["md5"] == expected_projectImages[9]["md5"]
@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from synthmap.db import manager as db_man
+from synthmap.db.pool import ConnectionPool
+
+
+@pytest.fixture
+def pool(temp_dir):
+    db_path = os.path.join(temp_dir, "pooled.db")
+    with db_man.mk_conn(db_path) as db:
+        db_man.setup_db(db)
+    pool = ConnectionPool(db_path, max_readers=2, timeout=0.5)
+    yield pool
+    pool.close()
+    os.remove(db_path)
+
+
+class TestConnectionPool:
+    def test_pragmas(self, pool):
+        with pool.writer() as db:
+            assert db.execute("PRAGMA journal_mode").fetchone()["journal_mode"] == "wal"
+            assert db.execute("PRAGMA synchronous").fetchone()["synchronous"] == 1
+        with pool.reader() as db:
+            assert db.execute("PRAGMA mmap_size").fetchone()["mmap_size"] > 0
+
+    def test_reuse_readers(self, pool):
+        with pool.reader() as first:
+            pass
+        with pool.reader() as second:
+            assert second is first
+
+    def test_readers_are_read_only(self, pool):
+        with pytest.raises(sqlite3.OperationalError):
+            with pool.reader() as db:
+                db.execute("INSERT INTO Entities (label) VALUES ('x')")
+
+    def test_writer_commits(self, pool):
+        with pool.writer() as db:
+            db.execute("INSERT INTO Entities (label) VALUES ('committed')")
+        with pytest.raises(ValueError):
+            with pool.writer() as db:
+                db.execute("INSERT INTO Entities (label) VALUES ('rolled back')")
+                raise ValueError
+        with pool.reader() as db:
+            labels = [i["label"] for i in db.execute("SELECT label FROM Entities")]
+        assert labels == ["committed"]
+
+    def test_exhausted(self, pool):
+        with pool.reader(), pool.reader():
+            with pytest.raises(TimeoutError):
+                with pool.reader():
+                    pass
+
+    def test_threads(self, pool):
+        results = []
+
+        def count():
+            with pool.reader() as db:
+                results.append(db.execute("SELECT count(*) c FROM Entities").fetchone())
+
+        threads = [threading.Thread(target=count) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [{"c": 0}] * 8
+        assert len(pool._readers) <= 2
@@ -0,0 +1,116 @@
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+
+import numpy as np
+import pytest
+
+from synthmap.db import manager as db_man, snapshot
+from synthmap.models.colmapScene import SceneArrays
+
+
+TEST_ROOT = Path(__file__).parent
+
+
+@pytest.fixture
+def snapshot_db(temp_dir, synthetic_db):
+    """A file copy of the synthetic db, with two entities & the sample ColmapScene."""
+    db_path = os.path.join(temp_dir, "snapshot.db")
+    with sqlite3.connect(db_path) as db:
+        synthetic_db.backup(db)
+        db.executemany(
+            "INSERT INTO Entities (entity_id, label, detail) VALUES (?, ?, ?)",
+            [(1, "Ruin", None), (2, "Tower", "North wall")],
+        )
+        db.execute(
+            """INSERT INTO ColmapScenes (cameras_path, images_path, points_path)
+            VALUES (?, ?, ?)""",
+            [
+                str(TEST_ROOT / "sample_data" / i)
+                for i in ["cameras.txt", "images.txt", "points3D.txt"]
+            ],
+        )
+    yield db_path
+    os.remove(db_path)
+
+
+@pytest.fixture
+def snapshot_path(temp_dir):
+    path = os.path.join(temp_dir, "snapshot")
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+class TestSnapshot:
+    def test_tables(self, snapshot_db, snapshot_path):
+        snap = snapshot.write_snapshot(snapshot_db, snapshot_path, scenes=False)
+        assert snap.is_fresh()
+        assert snap.scene_ids == []
+        image_files = snap.columns("imageFiles")
+        assert isinstance(image_files["file_id"], np.memmap)
+        assert len(image_files["file_id"]) == 17
+        with sqlite3.connect(snapshot_db) as db:
+            expected = db.execute("SELECT file_id, md5 FROM imageFiles").fetchall()
+        assert sorted(
+            zip(image_files["file_id"].tolist(), image_files["md5"])
+        ) == sorted(tuple(i) for i in expected)
+        entities = snap.columns("Entities")
+        assert entities["label"].tolist() == ["Ruin", "Tower"]
+        assert entities["detail"].tolist() == ["", "North wall"]
+        assert snap.null_mask("Entities", "detail").tolist() == [True, False]
+        assert snap.null_mask("Entities", "label").tolist() == [False, False]
+        assert len(snap.columns("Sessions")["session_id"]) == 0
+        with pytest.raises(KeyError):
+            snap.columns("Users")
+
+    def test_scenes(self, snapshot_db, snapshot_path, colmap_scene):
+        snap = snapshot.write_snapshot(snapshot_db, snapshot_path)
+        assert snap.scene_ids == [1]
+        arrays = snapshot.load_snapshot(snapshot_path).scene(1)
+        expected = SceneArrays.from_files(
+            colmap_scene.cameras_path,
+            colmap_scene.images_path,
+            colmap_scene.points_path,
+        )
+        assert arrays.points.tobytes() == expected.points.tobytes()
+        assert arrays.image_names.tolist() == expected.image_names.tolist()
+        image_id = int(expected.images["image_id"][0])
+        assert (arrays.features(image_id)[0] == expected.features(image_id)[0]).all()
+        with pytest.raises(KeyError):
+            snap.scene(2)
+
+    def test_stale(self, snapshot_db, snapshot_path):
+        snapshot.write_snapshot(snapshot_db, snapshot_path, scenes=False)
+        snapshot.load_snapshot(snapshot_path)
+        with sqlite3.connect(snapshot_db) as db:
+            db.execute("DELETE FROM Entities")
+        with pytest.raises(ValueError):
+            snapshot.load_snapshot(snapshot_path)
+        assert snapshot.Snapshot(snapshot_path).changes() == [
+            f"database {Path(snapshot_db).absolute()}"
+        ]
+        snap = snapshot.write_snapshot(snapshot_db, snapshot_path, scenes=False)
+        assert snap.is_fresh()
+        assert len(snap.columns("Entities")["entity_id"]) == 0
+
+    def test_project_images(self, snapshot_db, snapshot_path):
+        snap = snapshot.write_snapshot(snapshot_db, snapshot_path, scenes=False)
+        with db_man.mk_conn(snapshot_db) as db:
+            expected = db_man.get_project_images(db, 1)
+            assert db_man.get_project_images(db, 2) == []
+        db.close()
+        key = lambda i: i["file_id"]
+        images = snapshot.get_project_images(snap, 1)
+        assert sorted(images, key=key) == sorted(expected, key=key)
+        assert images[0]["ipfs"] is None
+        assert snapshot.get_project_images(snap, 2) == []
+        assert snap.tables_are_fresh()
+        with sqlite3.connect(snapshot_db) as db:
+            db.execute("DELETE FROM Entities")
+        db.close()
+        assert not snap.tables_are_fresh()
+
+    def test_missing(self, snapshot_path):
+        with pytest.raises(ValueError):
+            snapshot.load_snapshot(snapshot_path)
@@ -0,0 +1,50 @@
+import importlib.resources
+import os
+
+import cv2
+import numpy as np
+from PIL import Image as PILImage
+import pytest
+
+from synthmap.imageProcessing import imgproc, probe
+
+
+TEST_ROOT = importlib.resources.files("synthmap.test")
+
+
+@pytest.fixture
+def generated_images(temp_dir):
+    pixels = np.random.randint(0, 255, (48, 64, 3), dtype=np.uint8)
+    paths = {}
+    paths["png"] = os.path.join(temp_dir, "sample.png")
+    PILImage.fromarray(pixels).save(paths["png"])
+    paths["jpg"] = os.path.join(temp_dir, "sample.jpg")
+    PILImage.fromarray(pixels).save(paths["jpg"])
+    exif = PILImage.Exif()
+    exif[probe.EXIF_ORIENTATION] = 6
+    paths["rotated"] = os.path.join(temp_dir, "rotated.jpg")
+    PILImage.fromarray(pixels).save(paths["rotated"], exif=exif)
+    paths["garbage"] = os.path.join(temp_dir, "garbage.jpg")
+    with open(paths["garbage"], "wb") as fd:
+        fd.write(b"\xff\xd8\xff\xe0\x00")
+    return paths
+
+
+class TestProbe:
+    def test_sample_images(self, expected_projectImages):
+        for image in expected_projectImages:
+            assert probe.probe_size(image["file_path"]) == (image["w"], image["h"])
+
+    def test_formats(self, generated_images):
+        assert probe.probe_size(generated_images["png"]) == (64, 48)
+        assert probe.probe_size(generated_images["jpg"]) == (64, 48)
+        assert probe.probe_size(generated_images["garbage"]) is None
+
+    def test_orientation(self, generated_images):
+        y, x, _ = cv2.imread(generated_images["rotated"]).shape
+        assert probe.probe_size(generated_images["rotated"]) == (x, y) == (48, 64)
+
+    def test_batch(self, expected_projectImages):
+        sizes = imgproc.get_sizes([i["file_path"] for i in expected_projectImages])
+        for image in expected_projectImages:
+            assert sizes[image["file_path"]] == (image["w"], image["h"])
@@ -1,10 +1,14 @@
 import importlib.resources
+import io
+import json
+import os
+import shutil
 
+import numpy as np
 import pytest
 
 from synthmap.projectManager import aliceParser
-from synthmap.models import alice as alicemodels
-
+from synthmap.models import alice as alicemodels, colmap as colmodels
 
 TEST_ROOT = importlib.resources.files("synthmap.test")
 
@@ -18,3 +22,173 @@ class TestParser:
     def test_sfm_construction(self, known_projects):
         proj_data = aliceParser.parse_sfm(known_projects[0])
         assert alicemodels.AliceProject(**proj_data)
+
+    def test_sfm_header(self, known_projects):
+        proj_data = aliceParser.parse_sfm_header(known_projects[0])
+        assert "views" not in proj_data
+        assert proj_data["featuresFolders"] and proj_data["matchesFolders"]
+        assert alicemodels.AliceProject(**proj_data)
+
+    @pytest.mark.parametrize("read_size", [7, aliceParser.READ_SIZE])
+    def test_sfm_structure(self, known_projects, monkeypatch, read_size):
+        monkeypatch.setattr(aliceParser, "READ_SIZE", read_size)
+        with open(known_projects[0]) as fd:
+            expected = json.load(fd)
+        project = alicemodels.AliceProject(**aliceParser.parse_sfm(known_projects[0]))
+        assert [i.viewId for i in project.views] == [
+            int(i["viewId"]) for i in expected["views"]
+        ]
+        assert [i.poseId for i in project.poses] == [
+            int(i["poseId"]) for i in expected["poses"]
+        ]
+        structure = project.structure_arrays
+        assert len(structure.landmark_ids) == len(expected["structure"]) == 3005
+        for idx in [0, 1500, 3004]:
+            landmark = expected["structure"][idx]
+            view_ids, feature_ids, x = structure.observations(idx)
+            assert structure.landmark_ids[idx] == int(landmark["landmarkId"])
+            assert structure.X[idx].tolist() == [float(i) for i in landmark["X"]]
+            assert view_ids.tolist() == [
+                int(i["observationId"]) for i in landmark["observations"]
+            ]
+            assert feature_ids.tolist() == [
+                int(i["featureId"]) for i in landmark["observations"]
+            ]
+            assert x.tolist() == [
+                pytest.approx([float(j) for j in i["x"]])
+                for i in landmark["observations"]
+            ]
+
+
+class TestSfmStream:
+    def test_items(self):
+        fd = io.StringIO('{"a": 12345, "b": [1, {"c": [2]}, 3], "d": [], "e": "f"}')
+        stream = aliceParser.SfmStream(fd, read_size=2)
+        items = []
+        for key, value in stream.items():
+            if key == "b":
+                # Partly consumed array
+                value = next(value)
+            elif key == "d":
+                value = list(value)
+            items.append((key, value))
+        assert items == [("a", 12345), ("b", 1), ("d", []), ("e", "f")]
+
+    def test_truncated(self):
+        stream = aliceParser.SfmStream(io.StringIO('{"a": [1, 2'), read_size=4)
+        with pytest.raises(ValueError):
+            for _, value in stream.items():
+                list(value)
+
+
+@pytest.fixture
+def matches_folder():
+    return TEST_ROOT / "sample_data" / "meshroom_big_images" / "FeatureMatching"
+
+
+def read_matches_naive(file_path):
+    with open(file_path) as fd:
+        lines = [i.split() for i in fd.read().splitlines() if i.strip()]
+    matches, idx = {}, 0
+    while idx < len(lines):
+        view_ids = (int(lines[idx][0]), int(lines[idx][1]))
+        idx += 2
+        describer_type, num_matches = lines[idx][0], int(lines[idx][1])
+        matches[view_ids] = {
+            describer_type: [
+                [int(j) for j in i] for i in lines[idx + 1 : idx + 1 + num_matches]
+            ]
+        }
+        idx += num_matches + 1
+    return matches
+
+
+class TestMatches:
+    def test_read_matches(self, matches_folder):
+        file_path = matches_folder / "0.matches.txt"
+        matches = aliceParser.read_matches_text(file_path)
+        expected = read_matches_naive(file_path)
+        assert len(matches) == len(expected) == 53
+        for view_ids, pair_matches in matches.items():
+            assert pair_matches["sift"].dtype == np.uint32
+            assert pair_matches["sift"].tolist() == expected[view_ids]["sift"]
+
+    def test_describer_types(self, temp_dir):
+        file_path = os.path.join(temp_dir, "1.matches.txt")
+        with open(file_path, "w") as fd:
+            fd.write("1 2\n2\nsift 2\n0 1\n2 3\nakaze 1\n4 5\n3 1\n1\nsift 0\n")
+        matches = aliceParser.read_matches_text(file_path)
+        assert matches[(1, 2)]["sift"].tolist() == [[0, 1], [2, 3]]
+        assert matches[(1, 2)]["akaze"].tolist() == [[4, 5]]
+        assert matches[(3, 1)]["sift"].shape == (0, 2)
+        image_matches = aliceParser.list_image_matches(matches, 2)
+        assert image_matches == {
+            1: {
+                "rows": 3,
+                "data": [[1, 0], [3, 2], [5, 4]],
+                "describer_types": {"sift": 2, "akaze": 1},
+            }
+        }
+        with open(file_path, "w") as fd:
+            fd.write("1 2\n1\nsift 2\n0 1\n")
+        with pytest.raises(ValueError):
+            aliceParser.read_matches_text(file_path)
+        os.remove(file_path)
+
+    def test_read_folder(self, matches_folder):
+        matches = aliceParser.read_matches_folder(matches_folder, workers=1)
+        assert (
+            matches.keys()
+            == aliceParser.read_matches_folder(matches_folder, workers=2).keys()
+        )
+        image_matches = aliceParser.list_image_matches(matches, 306185676, 100)
+        assert image_matches[103257357]["rows"] == 143
+        assert image_matches[103257357]["data"][0] == [2586, 2519]
+        assert all(i["rows"] >= 100 for i in image_matches.values())
+
+
+@pytest.fixture
+def features_folder(temp_dir):
+    folder = os.path.join(temp_dir, "FeatureExtraction")
+    os.makedirs(folder)
+    rng = np.random.default_rng(0)
+    features = rng.uniform(0, 1000, size=(50, 4)).astype(np.float32)
+    descriptors = rng.integers(0, 256, size=(50, 128), dtype=np.uint8)
+    np.savetxt(os.path.join(folder, "42.sift.feat"), features, fmt="%.9g")
+    with open(os.path.join(folder, "42.sift.desc"), "wb") as fd:
+        fd.write(np.array(50, dtype="<u8").tobytes())
+        fd.write(descriptors.tobytes())
+    np.savetxt(os.path.join(folder, "43.akaze.feat"), features[:3], fmt="%.9g")
+    yield folder, features, descriptors
+    shutil.rmtree(folder)
+
+
+class TestFeatures:
+    def test_list_feature_files(self, features_folder):
+        folder, _, _ = features_folder
+        files = aliceParser.list_feature_files(folder)
+        assert sorted(files) == [42, 43]
+        assert sorted(files[42]["sift"]) == ["desc", "feat"]
+        assert sorted(files[43]["akaze"]) == ["feat"]
+
+    def test_read_features(self, features_folder):
+        folder, features, descriptors = features_folder
+        keypoints, desc = aliceParser.get_image_features(folder, 42)
+        assert isinstance(keypoints, colmodels.ImageKeypoints)
+        assert (keypoints.rows, keypoints.cols) == (50, 4)
+        assert keypoints.data.dtype == np.float32
+        assert np.array_equal(keypoints.data, features)
+        assert isinstance(desc, colmodels.ImageDescriptors)
+        assert isinstance(desc.data, np.memmap)
+        assert (desc.rows, desc.cols) == (50, 128)
+        assert np.array_equal(desc.data, descriptors)
+        keypoints, desc = aliceParser.get_image_features(folder, 43, "akaze")
+        assert keypoints.rows == 3 and desc is None
+
+    def test_truncated_descriptors(self, features_folder):
+        folder, _, _ = features_folder
+        file_path = os.path.join(folder, "42.sift.desc")
+        with open(file_path, "r+b") as fd:
+            fd.truncate(8 + 128 * 10)
+        with pytest.raises(ValueError):
+            aliceParser.read_descriptors(file_path, 42)
@@ -1,7 +1,10 @@
 import importlib.resources
 import os
 from pathlib import Path
+import sqlite3
 
+import numpy as np
+import pytest
 
 from synthmap.models import colmap as colmodels
 
@@ -61,3 +64,178 @@ class TestColmap:
         )
         twin_project_model.load_all()
         assert twin_project_model.is_eq(colmap_project_model)
+
+
+@pytest.fixture
+def lazy_project(synthetic_project):
+    project = colmodels.ColmapProject(
+        db_path=synthetic_project["db_path"],
+        image_path=synthetic_project["image_path"],
+    )
+    project.load_all(lazy=True)
+    yield project
+    for table in (
+        project.keypoints,
+        project.descriptors,
+        project.matches,
+        project.geometries,
+    ):
+        table.close()
+
+
+class TestLazyColmap:
+    def test_lazy_tables(self, lazy_project, synthetic_project):
+        assert isinstance(lazy_project.descriptors, colmodels.LazyTable)
+        assert len(lazy_project.cameras) == 17
+        assert len(lazy_project.descriptors) == 17
+        assert 1 in lazy_project.keypoints and 18 not in lazy_project.keypoints
+        # Nothing decoded yet
+        assert len(lazy_project.descriptors.cache) == 0
+        descriptors = lazy_project.descriptors[3]
+        assert descriptors.data.shape == (100, 128)
+        assert lazy_project.descriptors[3] is descriptors
+        with sqlite3.connect(synthetic_project["db_path"]) as db:
+            blob = db.execute(
+                "SELECT data FROM descriptors WHERE image_id=3"
+            ).fetchone()
+        assert descriptors.data.tobytes() == blob[0]
+        with pytest.raises(KeyError):
+            lazy_project.keypoints[18]
+
+    def test_byte_budget(self, synthetic_project):
+        project = colmodels.ColmapProject(
+            db_path=synthetic_project["db_path"],
+            image_path=synthetic_project["image_path"],
+        )
+        # Room for 2 images' descriptors
+        project.load_lazy(max_bytes=2 * 100 * 128 + 1)
+        for image_id in project.descriptors:
+            project.descriptors[image_id]
+        cache = project.descriptors.cache
+        assert len(cache) == 2
+        assert cache.nbytes <= cache.max_bytes
+
+    def test_concatenated(self, lazy_project):
+        ids, offsets, data = lazy_project.keypoints.concatenated(np.float32)
+        assert ids.tolist() == list(range(1, 18))
+        assert data.shape == (17 * 100, 4)
+        assert np.array_equal(
+            data[offsets[4] : offsets[5]], lazy_project.keypoints[5].data
+        )
+        pair_ids, offsets, data = lazy_project.matches.concatenated(np.uint32)
+        assert len(pair_ids) == len(lazy_project.matches)
+        assert offsets[-1] == len(data)
+
+    def test_image_ids(self, synthetic_project):
+        project = colmodels.ColmapProject(
+            db_path=synthetic_project["db_path"],
+            image_path=synthetic_project["image_path"],
+        )
+        with pytest.raises(ValueError):
+            project.load_all(lazy=True, image_ids=[2, 3, 5], workers=2)
+        project.load_all(lazy=True, image_ids=[5, 2, 3])
+        assert sorted(project.images) == [2, 3, 5]
+        assert list(project.descriptors) == [2, 3, 5]
+        with pytest.raises(KeyError):
+            project.keypoints[1]
+        # Pairs made of two of them
+        assert [project.matches[i].p2i() for i in project.matches] == [
+            (2, 3),
+            (2, 5),
+            (3, 5),
+        ]
+        ids, offsets, data = project.keypoints.concatenated(np.float32)
+        assert ids.tolist() == [2, 3, 5]
+        assert data.shape == (3 * 100, 4)
+        for table in (project.keypoints, project.descriptors, project.matches):
+            table.close()
+
+    def test_same_as_eager(self, lazy_project, synthetic_project_model):
+        synthetic_project_model.load_all()
+        for attr in ["keypoints", "descriptors", "matches", "geometries"]:
+            eager = getattr(synthetic_project_model, attr)
+            lazy = getattr(lazy_project, attr)
+            assert sorted(eager) == list(lazy)
+            for key, model in eager.items():
+                assert model.is_eq(lazy[key])
+
+    def test_yield_pairs(self, lazy_project):
+        pairs = dict(lazy_project.yield_pairs_for(5, lazy_project.matches))
+        assert sorted(pairs) == [2, 3, 4, 6, 7, 8]
+        pair_id = pairs[2].pair_id
+        # The cached model isn't modified by reversing its columns
+        assert np.array_equal(
+            pairs[2].data, lazy_project.matches[pair_id].data[:, ::-1]
+        )
+
+
+@pytest.fixture
+def synthetic_project_model(synthetic_project):
+    yield colmodels.ColmapProject(
+        db_path=synthetic_project["db_path"],
+        image_path=synthetic_project["image_path"],
+    )
+
+
+class TestSelectiveColmap:
+    def test_pair_id_ranges(self):
+        ranges = colmodels.pair_id_ranges([5, 2, 3, 2])
+        base = colmodels.MAX_IMAGE_ID
+        assert ranges == [(2 * base + 3, 2 * base + 5), (3 * base + 5, 3 * base + 5)]
+        assert colmodels.pair_id_ranges([1]) == []
+        # Only pairs including 3 or 7
+        ranges = colmodels.pair_id_ranges([2, 3, 5, 7, 8], new_ids=[7, 3, 9])
+        assert ranges == [
+            (2 * base + 3, 2 * base + 7),
+            (3 * base + 5, 3 * base + 8),
+            (5 * base + 7, 5 * base + 7),
+            (7 * base + 8, 7 * base + 8),
+        ]
+        assert colmodels.pair_id_ranges([2, 3], new_ids=[]) == []
+
+    def test_read_rows_closed(self, synthetic_project_model, monkeypatch):
+        connections = []
+        connect = sqlite3.connect
+
+        def recording(database, *args, **kwargs):
+            connections.append((database, connect(database, *args, **kwargs)))
+            return connections[-1][1]
+
+        monkeypatch.setattr(colmodels.sqlite3, "connect", recording)
+        assert sorted(synthetic_project_model.read_images([1, 2])) == [1, 2]
+        assert connections
+        for database, db in connections:
+            assert database.endswith("?mode=ro")
+            with pytest.raises(sqlite3.ProgrammingError):
+                db.execute("SELECT 1")
+
+    def test_load_all(self, synthetic_project_model):
+        errors = synthetic_project_model.load_all(workers=3)
+        assert errors == {}
+        assert len(synthetic_project_model.keypoints) == 17
+        assert len(synthetic_project_model.matches) == 14 * 3 + 2 + 1
+        assert len(synthetic_project_model.geometries) == 14 * 3 + 2 + 1
+
+    def test_image_ids(self, synthetic_project_model):
+        synthetic_project_model.load_all(image_ids=[5, 2, 3])
+        assert len(synthetic_project_model.cameras) == 17
+        assert sorted(synthetic_project_model.images) == [2, 3, 5]
+        assert sorted(synthetic_project_model.keypoints) == [2, 3, 5]
+        assert sorted(synthetic_project_model.descriptors) == [2, 3, 5]
+        expected = sorted(
+            i * colmodels.MAX_IMAGE_ID + j for i, j in [(2, 3), (2, 5), (3, 5)]
+        )
+        assert sorted(synthetic_project_model.matches) == expected
+        assert sorted(synthetic_project_model.geometries) == expected
+
+    def test_failed_table(self, synthetic_project_model, monkeypatch):
+        def read_descriptors(cls, image_ids=None):
+            raise sqlite3.OperationalError("no such table: descriptors")
+
+        monkeypatch.setattr(
+            colmodels.ColmapProject, "read_descriptors", read_descriptors
+        )
+        errors = synthetic_project_model.load_tables()
+        assert list(errors) == ["descriptors"]
+        assert synthetic_project_model.descriptors is None
+        assert len(synthetic_project_model.geometries) == 14 * 3 + 2 + 1
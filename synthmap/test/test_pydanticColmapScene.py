@@ -1,5 +1,8 @@
 import importlib.resources
 
+import numpy as np
+import pytest
+
 
 # from synthmap.models import colmapscene as colScene
 
@@ -12,10 +15,49 @@ class TestColmapScene:
         assert colmap_scene
 
     def test_load_cameras(self, colmap_scene):
-        colmap_scene.parse_camera_file()
+        cameras = list(colmap_scene.parse_camera_file())
+        assert len(cameras) == 17
+        assert cameras[0]["model"] == "SIMPLE_RADIAL"
+        assert cameras[0]["params"] == [4717.24, 3000, 2000, -0.097508]
 
     def test_load_images(self, colmap_scene):
-        colmap_scene.parse_image_file()
+        images = list(colmap_scene.parse_image_file())
+        assert len(images) == 17
+        assert images[0]["name"] == "IMGP0751.JPG"
+        assert images[0]["features"][0] == [85.4286, 630.595, -1]
 
     def test_load_points(self, colmap_scene):
-        colmap_scene.parse_point_file()
+        points = list(colmap_scene.parse_point_file())
+        assert len(points) == 2782
+        assert points[0]["landmark_id"] == 944
+        assert points[0]["track"] == {12: 7124, 7: 10687, 6: 10643, 13: 10616}
+
+    def test_load_arrays(self, colmap_scene):
+        arrays = colmap_scene.load_arrays()
+        assert len(arrays.images) == 17
+        assert len(arrays.points) == 2782
+        num_features = len(arrays.feature_xy)
+        num_observations = len(arrays.track_image_ids)
+        feature_bytes = arrays.feature_xy.nbytes + arrays.feature_landmark_ids.nbytes
+        track_bytes = arrays.track_image_ids.nbytes + arrays.track_point2d_idx.nbytes
+        assert feature_bytes == 12 * num_features
+        assert track_bytes == 8 * num_observations
+
+    def test_array_views(self, colmap_scene):
+        arrays = colmap_scene.load_arrays()
+        image = next(colmap_scene.parse_image_file())
+        xy, landmark_ids = arrays.features(image["image_id"])
+        assert np.shares_memory(xy, arrays.feature_xy)
+        assert len(xy) == len(image["features"])
+        assert xy[0].tolist() == pytest.approx([85.4286, 630.595])
+        assert landmark_ids[0] == -1
+        image_ids, point2d_idx = arrays.track(944)
+        assert np.shares_memory(image_ids, arrays.track_image_ids)
+        assert dict(zip(image_ids.tolist(), point2d_idx.tolist())) == {
+            12: 7124,
+            7: 10687,
+            6: 10643,
+            13: 10616,
+        }
+        with pytest.raises(KeyError):
+            arrays.track(-1)
@@ -1,3 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+from synthmap.models import synthmap as synthmodels
+
+
+@pytest.fixture
+def synthetic_workspace(temp_dir, synthetic_db):
+    db_path = os.path.join(temp_dir, "synthetic_workspace.db")
+    with sqlite3.connect(db_path) as file_db:
+        synthetic_db.backup(file_db)
+    workspace = synthmodels.Workspace(db_path=db_path)
+    yield workspace
+    workspace.close()
+    os.remove(db_path)
+
+
 class TestWorkspace:
     def test_setup(self, synthmap_workspace_model):
         synthmap_workspace_model.db_is_init(synthmap_workspace_model.db_path)
@@ -49,3 +70,62 @@ class TestWorkspace:
     def test_load_SessionImages(self, synthmap_workspace_model):
         synthmap_workspace_model.load_SessionImages()
         assert len(synthmap_workspace_model.sessionImages) == 0
+
+
+class TestTrustedWorkspace:
+    def test_load_all(self, synthetic_workspace, monkeypatch):
+        connections = []
+        connect = sqlite3.connect
+
+        def recording(*args, **kwargs):
+            connections.append(connect(*args, **kwargs))
+            return connections[-1]
+
+        monkeypatch.setattr(synthmodels.sqlite3, "connect", recording)
+        synthetic_workspace.load_all()
+        assert len(synthetic_workspace.projects) == 1
+        assert len(synthetic_workspace.imageFiles) == 17
+        assert len(synthetic_workspace.projectImages) == 17
+        image_file = next(iter(synthetic_workspace.imageFiles.values()))
+        assert isinstance(image_file, synthmodels.ImageFile)
+        assert len(image_file.md5) == 32
+        # All tables were read over the same connection, then closed
+        assert len(connections) == 1
+        assert synthetic_workspace._db is None
+        with pytest.raises(sqlite3.ProgrammingError):
+            connections[0].execute("SELECT 1")
+        with synthetic_workspace:
+            synthetic_workspace.load_Projects()
+            synthetic_workspace.load_ImageFiles(trusted=False)
+            assert synthetic_workspace._db is connections[1]
+        assert len(connections) == 2
+        assert synthetic_workspace._db is None
+
+    def test_threads(self, synthetic_workspace):
+        with synthetic_workspace:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(
+                    pool.map(synthetic_workspace.read_columns, ["imageFiles"] * 8)
+                )
+        assert all(len(i["file_id"]) == 17 for i in results)
+        assert synthetic_workspace._db is None
+
+    def test_trusted_matches_validated(self, synthetic_workspace):
+        synthetic_workspace.load_ImageFiles(trusted=True)
+        trusted = dict(synthetic_workspace.imageFiles)
+        synthetic_workspace.imageFiles = None
+        synthetic_workspace.load_ImageFiles(trusted=False)
+        assert trusted == synthetic_workspace.imageFiles
+
+    def test_read_columns(self, synthetic_workspace):
+        columns = synthetic_workspace.read_columns("imageFiles")
+        assert list(columns) == ["file_id", "file_path", "md5", "ipfs", "w", "h"]
+        assert columns["file_id"].dtype == np.int64
+        assert columns["md5"].dtype == object
+        assert len(columns["w"]) == 17
+        array = synthetic_workspace.read_array("imageFiles")
+        assert array.dtype.names == tuple(columns)
+        assert array["file_id"].tolist() == columns["file_id"].tolist()
+        assert len(synthetic_workspace.read_columns("Sessions")["session_id"]) == 0
+        with pytest.raises(ValueError):
+            synthetic_workspace.read_columns("imageFiles; DROP TABLE Projects")
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from synthmap.projectManager import scanner
+
+
+@pytest.fixture
+def sample_tree(temp_dir):
+    root = os.path.join(temp_dir, "scan_root")
+    files = [
+        "a.JPG",
+        "b.jpg",
+        "notes.txt",
+        os.path.join("colmap", "project.ini"),
+        os.path.join("colmap", "images", "c.Jpg"),
+        os.path.join("meshroom", "sfm.json"),
+        os.path.join("meshroom", "cache", "d.jpeg"),
+        os.path.join("excluded", "e.JPG"),
+        os.path.join("excluded", "project.ini"),
+    ]
+    for file_name in files:
+        path = os.path.join(root, file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fd:
+            fd.write("")
+    return root
+
+
+class TestScanner:
+    def test_scan_all(self, sample_tree):
+        found = {
+            (kind, os.path.relpath(path, sample_tree))
+            for kind, path in scanner.scan(sample_tree, exclude_folders=["excluded"])
+        }
+        assert found == {
+            ("image", "a.JPG"),
+            ("image", "b.jpg"),
+            ("colmap", os.path.join("colmap", "project.ini")),
+            ("image", os.path.join("colmap", "images", "c.Jpg")),
+            ("alice", os.path.join("meshroom", "sfm.json")),
+            ("image", os.path.join("meshroom", "cache", "d.jpeg")),
+        }
+
+    def test_scan_kinds(self, sample_tree):
+        found = [kind for kind, _ in scanner.scan(sample_tree, kinds=["colmap"])]
+        assert found == ["colmap", "colmap"]
+
+    def test_prune_excluded(self, sample_tree, monkeypatch):
+        scanned = []
+        scandir = os.scandir
+
+        def spy(path):
+            scanned.append(path)
+            return scandir(path)
+
+        monkeypatch.setattr(scanner.os, "scandir", spy)
+        list(scanner.scan(sample_tree, exclude_folders=["excluded", "cache"]))
+        assert not [i for i in scanned if "excluded" in i or "cache" in i]